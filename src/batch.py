@@ -0,0 +1,271 @@
+# src/batch.py
+# Headless batch mode: python -m src.batch "sessions/*.mat" --output-dir results --workers 8
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+import types
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from . import config
+from . import data_loader
+from . import instrumentation
+from . import memory_report
+from . import pipeline
+from . import track_management
+from .track_store import TRACK_TYPE_NAMES
+
+try:
+    import pyarrow as pa # Optional: only needed for --track-format parquet
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+TRACK_FORMATS = ('npz', 'parquet')
+SESSION_RECORD_NAME = 'session.json' # Written last, so its presence marks a finished session
+MANIFEST_NAME = 'manifest.json'
+
+class StageTimer:
+    """Records wall-clock seconds per stage, with the same stage() interface as StageMemoryReport."""
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, stage_name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.stages.append({'stage': stage_name, 'seconds': time.time() - start_time})
+
+def expand_inputs(patterns):
+    """Expands paths, glob patterns and @list files (one path per line) into unique absolute paths."""
+    filepaths = []
+    for pattern in patterns:
+        if pattern.startswith('@'):
+            with open(pattern[1:], encoding='utf-8') as f:
+                filepaths.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+        elif glob.has_magic(pattern):
+            filepaths.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            filepaths.append(pattern)
+    return list(dict.fromkeys(os.path.abspath(filepath) for filepath in filepaths))
+
+def make_session_names(filepaths):
+    """Output directory name per input: the file stem, suffixed with a counter where stems collide."""
+    names, seen = {}, {}
+    for filepath in filepaths:
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        names[filepath] = stem if seen[stem] == 1 else f"{stem}_{seen[stem]}"
+    return names
+
+def band_file_label(band_name, band_idx):
+    """File-name-safe label of a band, e.g. 'Delta (δ)' -> 'delta'."""
+    label = re.sub(r'[^0-9a-z]+', '_', band_name.split('(')[0].strip().lower()).strip('_')
+    return label or f'band{band_idx}'
+
+def condition_file_label(condition_key, band_labels):
+    is_filtered, band_name = condition_key
+    return band_labels[band_name] if is_filtered else 'raw'
+
+def make_session_config(overrides):
+    """Snapshot of the config module's constants with per-run overrides applied (picklable, per session)."""
+    values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    values.update(overrides)
+    return types.SimpleNamespace(**values)
+
+def load_session(cfg, filepath):
+    """Opens one session's LFP data; errors are raised, so one bad session does not stop the batch."""
+    lfp_data = data_loader.open_lfp_data(filepath, cfg.VARIABLE_NAME, num_expected_channels=cfg.GRID_DIM * cfg.GRID_DIM)
+    data_loader.verify_grid_compatibility(lfp_data.shape[0], cfg.GRID_DIM)
+    return lfp_data, lfp_data.shape[1]
+
+def load_finished_session(session_dir, stage_keys):
+    """Returns the record of finished outputs in session_dir computed from the same input and config, else None."""
+    record_path = os.path.join(session_dir, SESSION_RECORD_NAME)
+    if not os.path.exists(record_path):
+        return None
+    with open(record_path, encoding='utf-8') as f:
+        record = json.load(f)
+    return record if record.get('status') == 'done' and record.get('stage_keys') == stage_keys else None
+
+def export_session(session_dir, band_envelopes, all_phase_series, all_tracks, track_format, all_detections=None):
+    """
+    Writes envelope_<band>.npy, phase_<raw|band>.npy, tracks (per-condition .npz or one tracks.parquet)
+    and the per-frame detections as detections_<raw|band>.npz (input for python -m src.relink_sweep).
+    """
+    band_labels = {band_name: band_file_label(band_name, band_idx) for band_idx, band_name in enumerate(band_envelopes)}
+    output_files = {'envelopes': {}, 'phases': {}, 'tracks': {}, 'detections': {}}
+    for band_name, envelope in band_envelopes.items():
+        filename = f'envelope_{band_labels[band_name]}.npy'
+        np.save(os.path.join(session_dir, filename), envelope)
+        output_files['envelopes'][band_name] = filename
+    for condition_key, phase_series in all_phase_series.items():
+        filename = f'phase_{condition_file_label(condition_key, band_labels)}.npy'
+        np.save(os.path.join(session_dir, filename), phase_series)
+        output_files['phases'][repr(condition_key)] = filename
+
+    if track_format == 'parquet':
+        write_tracks_parquet(os.path.join(session_dir, 'tracks.parquet'), all_tracks, band_labels)
+        output_files['tracks'] = {repr(condition_key): 'tracks.parquet' for condition_key in all_tracks}
+    else:
+        for condition_key, track_store in all_tracks.items():
+            filename = f'tracks_{condition_file_label(condition_key, band_labels)}.npz'
+            track_store.save_npz(os.path.join(session_dir, filename), compressed=True)
+            output_files['tracks'][repr(condition_key)] = filename
+    for condition_key, detection_store in (all_detections or {}).items():
+        filename = f'detections_{condition_file_label(condition_key, band_labels)}.npz'
+        detection_store.save_npz(os.path.join(session_dir, filename), compressed=True)
+        output_files['detections'][repr(condition_key)] = filename
+    return output_files
+
+def write_tracks_parquet(filepath, all_tracks, band_labels):
+    """One row per track point: condition, track_id, track_type, time_idx, row_zoomed, col_zoomed."""
+    if pa is None:
+        raise ImportError("Writing Parquet requires pyarrow (pip install pyarrow), or use --track-format npz.")
+    columns = {'condition': [], 'track_id': [], 'track_type': [], 'time_idx': [], 'row_zoomed': [], 'col_zoomed': []}
+    for condition_key, track_store in all_tracks.items():
+        points_per_track = track_store.track_lengths()
+        columns['condition'].append(np.full(track_store.num_points, condition_file_label(condition_key, band_labels), dtype=object))
+        columns['track_id'].append(np.repeat(track_store.track_ids, points_per_track))
+        columns['track_type'].append(np.asarray(TRACK_TYPE_NAMES, dtype=object)[np.repeat(track_store.types, points_per_track)])
+        columns['time_idx'].append(track_store.time_indices)
+        columns['row_zoomed'].append(track_store.points_rc_zoomed[:, 0])
+        columns['col_zoomed'].append(track_store.points_rc_zoomed[:, 1])
+    table = pa.table({name: pa.array(np.concatenate(parts)) if parts else pa.array([])
+                      for name, parts in columns.items()})
+    pq.write_table(table, filepath)
+
+def process_session(filepath, session_dir, overrides, track_format='npz', resume=True, report_memory=False,
+                    trace_format=None):
+    """
+    Runs load -> envelopes/phases -> tracks -> export for one input file (in a worker process).
+    With trace_format ('json' or 'jsonl'), the session's instrumentation is written to session_dir/trace.<format>.
+    Returns the session record (also written to session_dir/session.json on success).
+    """
+    cfg = make_session_config(overrides)
+    if cfg.PROFILE_STAGES: # Profiles are written per session
+        cfg.PROFILE_OUTPUT_DIR = os.path.join(session_dir, 'profiles')
+    if trace_format or cfg.PROFILE_STAGES:
+        cfg.INSTRUMENTATION_ENABLED = True
+    recorder = instrumentation.configure_from_config(cfg)
+    if cfg.CHUNKED_OUTPUT_DIR: # Chunked intermediates must not be shared between concurrently running sessions
+        cfg.CHUNKED_OUTPUT_DIR = os.path.join(session_dir, 'chunked')
+    cfg.TIME_PYRAMID_DIR = None # GUI only; its memory-mapped envelopes must not be shared between sessions either
+    record = {'input': filepath, 'output_dir': session_dir, 'status': 'failed', 'stages': []}
+    start_time = time.time()
+    try:
+        stage_keys = pipeline.make_stage_keys(cfg, filepath)
+        record['stage_keys'] = stage_keys
+        finished_record = load_finished_session(session_dir, stage_keys) if resume else None
+        if finished_record is not None: # Keep the original timings and outputs in the manifest
+            record.update({name: value for name, value in finished_record.items() if name != 'seconds'})
+            record['status'] = 'skipped'
+            return record
+        os.makedirs(session_dir, exist_ok=True)
+        stage_report = memory_report.StageMemoryReport(enabled=True) if report_memory else StageTimer()
+
+        with instrumentation.span('stage.load'), stage_report.stage('load'):
+            lfp_data, num_time_points = load_session(cfg, filepath)
+        band_envelopes, all_phase_series, all_tracks = pipeline.run_processing_stages(
+                                                            lfp_data, num_time_points, cfg, filepath, stage_report)
+        with instrumentation.span('stage.export'), stage_report.stage('export'):
+            record['files'] = export_session(session_dir, band_envelopes, all_phase_series, all_tracks, track_format,
+                                             track_management.all_detections_cache)
+        record.update({'status': 'done', 'stages': stage_report.stages, 'num_time_points': num_time_points,
+                       'num_tracks': {repr(condition_key): len(track_store) for condition_key, track_store in all_tracks.items()}})
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['traceback'] = traceback.format_exc()
+    finally:
+        track_management.all_tracks_cache.clear() # Do not carry one session's tracks into the next
+        track_management.all_detections_cache.clear()
+        record['seconds'] = time.time() - start_time
+        recorder.stop()
+    if trace_format and record['status'] != 'skipped':
+        os.makedirs(session_dir, exist_ok=True)
+        record['trace'] = f'trace.{trace_format}'
+        recorder.export(os.path.join(session_dir, record['trace']))
+    if record['status'] == 'done':
+        with open(os.path.join(session_dir, SESSION_RECORD_NAME), 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+    return record
+
+def run_batch(filepaths, output_dir, num_workers=1, track_format='npz', resume=True, overrides=None, report_memory=False,
+              trace_format=None):
+    """Processes all sessions (in num_workers processes) and writes output_dir/manifest.json. Returns the manifest."""
+    overrides = dict(overrides or {})
+    if num_workers > 1:
+        overrides['TRACK_PRECOMPUTE_NUM_WORKERS'] = 1 # Parallelism is across sessions; avoid nested pools
+    os.makedirs(output_dir, exist_ok=True)
+    session_names = make_session_names(filepaths)
+    batch_start = time.time()
+    records = []
+    print(f"===== BATCH: {len(filepaths)} sessions, {num_workers} worker(s), output in {output_dir} =====")
+
+    def _report(record):
+        records.append(record)
+        message = f"  [{len(records)}/{len(filepaths)}] {record['status']:<7} {record['input']} ({record['seconds']:.1f}s)"
+        print(message if record['status'] != 'failed' else f"{message}\n    {record['error']}")
+
+    job_args = [(filepath, os.path.join(output_dir, session_names[filepath]), overrides, track_format, resume, report_memory,
+                 trace_format)
+                for filepath in filepaths]
+    if num_workers <= 1:
+        for args in job_args:
+            _report(process_session(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(process_session, *args) for args in job_args]
+            for future in as_completed(futures):
+                _report(future.result())
+
+    records.sort(key=lambda record: filepaths.index(record['input']))
+    manifest = {'created': time.time(), 'seconds': time.time() - batch_start, 'num_workers': num_workers,
+                'track_format': track_format, 'config_overrides': {name: repr(value) for name, value in overrides.items()},
+                'counts': {status: sum(record['status'] == status for record in records)
+                           for status in ('done', 'skipped', 'failed')},
+                'sessions': records}
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"===== BATCH FINISHED in {manifest['seconds']:.1f}s: {manifest['counts']} =====")
+    return manifest
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.batch',
+                                     description="Compute envelopes, phases and singularity tracks for many LFP sessions without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="Input files, glob patterns (quote them) or @file with one path per line.")
+    parser.add_argument('-o', '--output-dir', required=True, help="One subdirectory per session plus manifest.json are written here.")
+    parser.add_argument('-j', '--workers', type=int, default=config.BATCH_NUM_WORKERS or os.cpu_count(),
+                        help="Sessions processed in parallel (default: BATCH_NUM_WORKERS, or all CPUs).")
+    parser.add_argument('--track-format', choices=TRACK_FORMATS, default=config.BATCH_TRACK_FORMAT)
+    parser.add_argument('--variable-name', help="MATLAB variable holding the LFP (default: VARIABLE_NAME).")
+    parser.add_argument('--no-resume', action='store_true', help="Recompute sessions that already have finished outputs.")
+    parser.add_argument('--report-memory', action='store_true', help="Record peak memory per stage in the manifest (slower).")
+    parser.add_argument('--trace', choices=('json', 'jsonl'),
+                        help="Write each session's instrumentation as trace.json (Chrome trace) or trace.jsonl.")
+    parser.add_argument('--profile-stage', action='append', default=[], metavar='SPAN_NAME',
+                        help="Run this span (e.g. stage.tracks) under cProfile; profiles go to <session>/profiles. Repeatable.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    filepaths = expand_inputs(args.inputs)
+    if not filepaths:
+        print("No input files matched.")
+        return 1
+    overrides = {'VARIABLE_NAME': args.variable_name} if args.variable_name else {}
+    if args.profile_stage:
+        overrides['PROFILE_STAGES'] = tuple(args.profile_stage)
+    manifest = run_batch(filepaths, args.output_dir, max(1, args.workers), args.track_format,
+                         not args.no_resume, overrides, args.report_memory, args.trace)
+    return 1 if manifest['counts']['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# src/benchmark.py
+# Stage timings, scaling sweeps and accuracy on synthetic spiral data: python -m src.benchmark [--quick] [--output r.json] [--plot c.png]
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+from . import config
+from . import synthetic
+from .signal_processing import calculate_amplitude_envelopes_and_filtered_lfp, precompute_all_phase_series
+from .singularity_detection import (detect_singularities, detect_singularities_batch, detect_singularities_from_series,
+                                    get_zoomed_phase_grid_from_series, get_zoomed_phase_grids_from_series)
+from .track_linking import TrackLinker
+
+STAGE_NAMES = ('envelopes_and_filtered_lfp', # calculate_amplitude_envelopes_and_filtered_lfp
+               'phase_series',               # precompute_all_phase_series
+               'zoom_per_frame',             # get_zoomed_phase_grid_from_series, every frame
+               'detect_per_frame',           # detect_singularities, every frame
+               'zoom_batched',               # get_zoomed_phase_grids_from_series (used by track precomputation)
+               'detect_batched',             # detect_singularities_batch (used by track precomputation)
+               'tracking_loop',              # TrackLinker.step over all frames
+               'detect_native_subpixel')     # detect_singularities_from_series(..., 'native_subpixel'): replaces zoom + detect
+DEFAULT_SWEEPS = {'grid_dim': [10, 20, 32, 64], 'upsample_factor': [1, 2, 3, 4], 'num_time_points': [2000, 4000, 8000, 16000]}
+QUICK_SWEEPS = {'grid_dim': [10, 20], 'upsample_factor': [1, 3], 'num_time_points': [2000, 4000]}
+DEFAULT_BASE_CASE = {'grid_dim': 20, 'upsample_factor': 3, 'num_time_points': 4000}
+
+def benchmark_case(grid_dim, upsample_factor, num_time_points, cfg=config, seed=0,
+                   max_per_frame_samples=500, match_radius=1.0, quiet=True):
+    """
+    Generates synthetic spiral LFP, times every stage on it and scores the tracks of the band carrying
+    the spiral wave and of the raw phase against the ground truth, for upsampled detection ('<condition>')
+    and native-grid sub-pixel detection ('<condition> native').
+    Per-frame stages are timed on up to max_per_frame_samples evenly spaced frames and extrapolated to all frames.
+    The track distance limit is scaled with upsample_factor, so it covers the same native-grid distance as
+    cfg.MAX_TRACK_DISTANCE_SQ does at cfg.UPSAMPLE_FACTOR.
+    Returns {'params', 'seconds': {stage: s}, 'accuracy': {condition: scores}}.
+    """
+    lfp, ground_truth = synthetic.generate_spiral_lfp(grid_dim, num_time_points, cfg.FS,
+                                                      background_bands=cfg.FREQ_BANDS, seed=seed)
+    spiral_band = next(band_name for band_name, (low, high) in cfg.FREQ_BANDS.items()
+                       if low <= ground_truth['spiral_freq'] <= high)
+    max_track_distance_sq = cfg.MAX_TRACK_DISTANCE_SQ * (upsample_factor / cfg.UPSAMPLE_FACTOR) ** 2
+    seconds = {}
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+
+    with output:
+        start_time = time.perf_counter()
+        _, filtered_lfp = calculate_amplitude_envelopes_and_filtered_lfp(lfp, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER)
+        seconds['envelopes_and_filtered_lfp'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        all_phase_series = precompute_all_phase_series(lfp, filtered_lfp, cfg.FREQ_BANDS, cfg.FS)
+        seconds['phase_series'] = time.perf_counter() - start_time
+
+    accuracy = {}
+    for condition_key in ((True, spiral_band), (False, None)):
+        phase_series = all_phase_series[condition_key]
+        timings = condition_key == (True, spiral_band) # Per-condition stages are timed once, on the spiral band
+
+        if timings:
+            sample_frames = np.unique(np.linspace(0, num_time_points - 1, min(max_per_frame_samples, num_time_points)).astype(int))
+            zoom_seconds = detect_seconds = 0.0
+            for time_idx in sample_frames:
+                start_time = time.perf_counter()
+                phase_grid = get_zoomed_phase_grid_from_series(time_idx, phase_series, grid_dim, upsample_factor,
+                                                               cfg.INTERPOLATION_ORDER_ZOOM)
+                zoom_seconds += time.perf_counter() - start_time
+                start_time = time.perf_counter()
+                detect_singularities(phase_grid, cfg.PHASE_TOLERANCE)
+                detect_seconds += time.perf_counter() - start_time
+            seconds['zoom_per_frame'] = zoom_seconds * num_time_points / len(sample_frames)
+            seconds['detect_per_frame'] = detect_seconds * num_time_points / len(sample_frames)
+
+        condition_name = spiral_band if condition_key[0] else 'raw'
+        for detection_mode in ('upsampled', 'native_subpixel'):
+            track_store, stage_seconds = _detect_and_link(phase_series, num_time_points, grid_dim, upsample_factor,
+                                                          max_track_distance_sq, detection_mode, cfg)
+            if timings:
+                seconds.update(stage_seconds)
+            accuracy_name = condition_name if detection_mode == 'upsampled' else f'{condition_name} native'
+            accuracy[accuracy_name] = synthetic.score_tracks(ground_truth, track_store, grid_dim, upsample_factor,
+                                                             match_radius, exclude_edge_frames=cfg.FS // 2)
+
+    return {'params': {'grid_dim': grid_dim, 'upsample_factor': upsample_factor, 'num_time_points': num_time_points,
+                       'seed': seed},
+            'seconds': seconds, 'accuracy': accuracy}
+
+def _detect_and_link(phase_series, num_time_points, grid_dim, upsample_factor, max_track_distance_sq, detection_mode, cfg):
+    """
+    Chunked detection, then linking, as in track precomputation. Returns (TrackStore, {stage: seconds}):
+    zoom_batched / detect_batched / tracking_loop for 'upsampled', detect_native_subpixel for 'native_subpixel'.
+    """
+    linker = TrackLinker(max_track_distance_sq, cfg.TRACK_LINKING_MODE)
+    zoom_seconds = detect_seconds = link_seconds = 0.0
+    for chunk_start in range(0, num_time_points, cfg.SINGULARITY_DETECTION_CHUNK_SIZE):
+        chunk_stop = min(chunk_start + cfg.SINGULARITY_DETECTION_CHUNK_SIZE, num_time_points)
+        start_time = time.perf_counter()
+        if detection_mode == 'upsampled':
+            phase_volume = get_zoomed_phase_grids_from_series(chunk_start, chunk_stop, phase_series, grid_dim,
+                                                              upsample_factor, cfg.INTERPOLATION_ORDER_ZOOM)
+            zoom_seconds += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            s_rc, s_frames, a_rc, a_frames = detect_singularities_batch(phase_volume, cfg.PHASE_TOLERANCE)
+        else:
+            s_rc, s_frames, a_rc, a_frames = detect_singularities_from_series(
+                                                chunk_start, chunk_stop, phase_series, grid_dim, upsample_factor,
+                                                cfg.INTERPOLATION_ORDER_ZOOM, cfg.PHASE_TOLERANCE, detection_mode)
+        detect_seconds += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        s_bounds = np.searchsorted(s_frames, np.arange(chunk_stop - chunk_start + 1))
+        a_bounds = np.searchsorted(a_frames, np.arange(chunk_stop - chunk_start + 1))
+        for frame_in_chunk in range(chunk_stop - chunk_start):
+            linker.step(chunk_start + frame_in_chunk,
+                        s_rc[s_bounds[frame_in_chunk]:s_bounds[frame_in_chunk + 1]],
+                        a_rc[a_bounds[frame_in_chunk]:a_bounds[frame_in_chunk + 1]])
+        link_seconds += time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    track_store = linker.finish()
+    link_seconds += time.perf_counter() - start_time
+    if detection_mode == 'upsampled':
+        return track_store, {'zoom_batched': zoom_seconds, 'detect_batched': detect_seconds, 'tracking_loop': link_seconds}
+    return track_store, {'detect_native_subpixel': detect_seconds}
+
+def run_sweeps(sweeps=None, base_case=None, cfg=config, seed=0):
+    """
+    Varies one parameter at a time around base_case ({'grid_dim', 'upsample_factor', 'num_time_points'}).
+    Returns {parameter: [benchmark_case result, ...]}.
+    """
+    sweeps = DEFAULT_SWEEPS if sweeps is None else sweeps
+    base_case = DEFAULT_BASE_CASE if base_case is None else base_case
+    results = {}
+    for parameter, values in sweeps.items():
+        results[parameter] = []
+        for value in values:
+            case = dict(base_case, **{parameter: value})
+            print(f"  {parameter}={value} ({case})...")
+            results[parameter].append(benchmark_case(case['grid_dim'], case['upsample_factor'], case['num_time_points'],
+                                                     cfg, seed))
+    return results
+
+def scaling_exponents(sweep_results, parameter):
+    """Log-log slope of each stage's time against the swept parameter (1 = linear, 2 = quadratic, ...)."""
+    values = np.array([result['params'][parameter] for result in sweep_results], dtype=float)
+    exponents = {}
+    for stage_name in STAGE_NAMES:
+        stage_seconds = np.array([result['seconds'][stage_name] for result in sweep_results])
+        if len(values) > 1 and np.all(values > 0) and np.all(stage_seconds > 0):
+            exponents[stage_name] = float(np.polyfit(np.log(values), np.log(stage_seconds), 1)[0])
+    return exponents
+
+def print_sweep_report(results):
+    for parameter, sweep_results in results.items():
+        print(f"\n===== SWEEP: {parameter} (seconds per stage) =====")
+        print(f"  {parameter:>16} " + ' '.join(f"{stage_name[:14]:>14}" for stage_name in STAGE_NAMES) + "   det.F1  coverage  native.F1")
+        for result in sweep_results:
+            spiral_band = next(iter(result['accuracy']))
+            spiral_scores, native_scores = result['accuracy'][spiral_band], result['accuracy'][f'{spiral_band} native']
+            print(f"  {result['params'][parameter]:>16} "
+                  + ' '.join(f"{result['seconds'][stage_name]:>14.3f}" for stage_name in STAGE_NAMES)
+                  + f"   {spiral_scores['f1']:>6.3f}  {spiral_scores['mean_coverage']:>8.3f}  {native_scores['f1']:>9.3f}")
+        exponents = scaling_exponents(sweep_results, parameter)
+        print(f"  {'scaling exponent':>16} " + ' '.join(f"{exponents[stage_name]:>14.2f}" if stage_name in exponents
+                                                       else f"{'n/a':>14}" for stage_name in STAGE_NAMES))
+
+def print_accuracy_report(result):
+    print(f"\n===== ACCURACY vs GROUND TRUTH ({result['params']}) =====")
+    for condition_name, scores in result['accuracy'].items():
+        print(f"  {condition_name:<18} precision {scores['precision']:.3f}  recall {scores['recall']:.3f}  "
+              f"F1 {scores['f1']:.3f}  loc.err {scores['mean_localization_error']:.2f}  "
+              f"coverage {scores['mean_coverage']:.3f}  fragments {scores['mean_fragments']:.2f}  "
+              f"id switches {scores['id_switches']}  spurious tracks {scores['spurious_tracks']}/{scores['num_tracks']}")
+    seconds = result['seconds']
+    upsampled_seconds = seconds['zoom_batched'] + seconds['detect_batched']
+    print(f"  Detection time: upsampled (zoom + detect) {upsampled_seconds:.3f}s, "
+          f"native sub-pixel {seconds['detect_native_subpixel']:.3f}s "
+          f"({upsampled_seconds / max(seconds['detect_native_subpixel'], 1e-12):.1f}x faster)")
+
+def plot_scaling_curves(results, filepath):
+    """Saves one log-log panel per swept parameter (matplotlib is only imported here)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(1, len(results), figsize=(5 * len(results), 4), squeeze=False)
+    for panel_ax, (parameter, sweep_results) in zip(axes[0], results.items()):
+        values = [result['params'][parameter] for result in sweep_results]
+        for stage_name in STAGE_NAMES:
+            panel_ax.loglog(values, [result['seconds'][stage_name] for result in sweep_results], 'o-', label=stage_name)
+        panel_ax.set_xlabel(parameter); panel_ax.set_ylabel('seconds')
+    axes[0][0].legend(fontsize='small')
+    fig.tight_layout()
+    fig.savefig(filepath)
+    plt.close(fig)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.benchmark',
+                                     description="Time pipeline stages on synthetic spiral LFP and score accuracy.")
+    parser.add_argument('--quick', action='store_true', help="Small sweep for a fast smoke run.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write all results to this JSON file.")
+    parser.add_argument('--plot', help="Save log-log scaling curves to this image file.")
+    args = parser.parse_args(argv)
+
+    base_case = dict(DEFAULT_BASE_CASE, num_time_points=2000) if args.quick else DEFAULT_BASE_CASE
+    print("===== BENCHMARK on synthetic spiral LFP =====")
+    results = run_sweeps(QUICK_SWEEPS if args.quick else DEFAULT_SWEEPS, base_case, seed=args.seed)
+    print_sweep_report(results)
+    base_result = next(result for result in results['upsample_factor']
+                       if result['params']['upsample_factor'] == base_case['upsample_factor'])
+    print_accuracy_report(base_result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'base_case': base_case, 'results': results}, f, indent=2, ensure_ascii=False)
+    if args.plot:
+        plot_scaling_curves(results, args.plot)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
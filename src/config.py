@@ -1,4 +1,5 @@
 # src/config.py
+import numpy as np
 
 # --- File and Data Configuration ---
 MAT_FILE_PATH = '/Users/xxx/Desktop/extracted_lfp_segments_fixed.mat' # LFP data recorded from the electrode array
@@ -15,6 +16,36 @@ FREQ_BANDS = {
     'Gamma (γ)': (30, 80)
 }
 FILTER_ORDER = 4
+SIGNAL_PROCESSING_METHOD = 'filtfilt' # 'filtfilt' or 'fft_bank' (one rFFT, one inverse FFT per band)
+ENVELOPE_STORAGE_DTYPE = 'float64' # 'float64', 'float32' or 'float16'
+PHASE_STORAGE_DTYPE = 'float64' # 'float64', 'float32', 'float16' or 'int16' (quantized angle)
+CHUNKED_OUTPUT_DIR = None # If set, filter/Hilbert in overlapping time blocks and write memory-mapped .npy outputs here
+CHUNK_BLOCK_SIZE = 60000 # Samples per block in chunked mode (padding is added on both sides)
+REPORT_STAGE_MEMORY = False # Print peak memory per pipeline stage (uses tracemalloc, adds some overhead)
+
+# --- Result Cache Configuration ---
+RESULT_CACHE_DIR = None # If set, stage results are stored here and reused across restarts
+RESULT_CACHE_MAX_BYTES = 20 * 1024**3 # Least recently used entries are evicted above this size
+RESULT_CACHE_HASH_INPUT_CONTENTS = False # Key the input by SHA-256 of its contents instead of path/size/mtime
+
+# --- Instrumentation and Profiling ---
+INSTRUMENTATION_ENABLED = False # Record timed spans, counters and memory samples for each stage/condition
+INSTRUMENTATION_OUTPUT = None # Export path: '*.jsonl' for JSON lines, anything else (e.g. 'trace.json') for Chrome trace
+INSTRUMENTATION_MEMORY_SAMPLE_INTERVAL_S = 0.5 # Background RSS sampling period (None disables sampling)
+PROFILE_STAGES = () # Span names to run under a profiler, e.g. ('stage.tracks', 'signal.band')
+PROFILE_MODE = 'cprofile' # 'cprofile' or 'line' (requires line_profiler)
+PROFILE_OUTPUT_DIR = 'profiles'
+LINE_PROFILE_FUNCTIONS = () # For 'line' mode, e.g. ('src.singularity_detection.detect_singularities_batch', 'src.track_linking:TrackLinker.step')
+
+# --- Batch Mode Configuration (python -m src.batch) ---
+BATCH_NUM_WORKERS = None # Sessions processed in parallel; None uses all CPUs
+BATCH_TRACK_FORMAT = 'npz' # 'npz' (one file per condition) or 'parquet' (one table, requires pyarrow)
+
+# --- Lazy Condition Computation ---
+LAZY_CONDITIONS = False # Open the GUI immediately; compute each band's envelope/phase/tracks on first view
+LAZY_MAX_RESIDENT_CONDITIONS = 3 # Envelope/phase sets kept in memory (least recently viewed are recomputed)
+LAZY_PREFETCH_WORKERS = 1 # Background threads computing the remaining conditions while the GUI is open
+LAZY_CHANNEL_BLOCK_SIZE = 50 # Channels read from the (lazily loaded) recording and filtered at a time per condition
 
 # --- Visualization and Grid Configuration ---
 AMPLITUDE_CMAP = 'viridis'
@@ -24,16 +55,62 @@ INTERPOLATION_ORDER_ZOOM = 1 # 1=bilinear for zoom
 
 # --- Singularity Detection Configuration ---
 PHASE_TOLERANCE = np.pi / 2 # Tolerance for sum being close to +/- 2*pi
+SINGULARITY_DETECTION_CHUNK_SIZE = 1000 # Frames per vectorized detection pass (bounds peak memory)
+SINGULARITY_DETECTION_MODE = 'upsampled' # 'upsampled' (winding numbers on the zoomed grid) or 'native_subpixel'
+                                         # (native grid, cores refined to sub-pixel positions; ~10x faster, same coordinates)
 
 # --- Track Management Configuration ---
 MAX_PIXEL_DISPLACEMENT_FOR_TRACK_MATCHING_ZOOMED = 7.0 # Max pixel distance in ZOOMED grid
 MAX_TRACK_DISTANCE_SQ = MAX_PIXEL_DISPLACEMENT_FOR_TRACK_MATCHING_ZOOMED**2
+TRACK_LINKING_MODE = 'greedy' # 'greedy' (nearest match in track order) or 'optimal' (Hungarian assignment)
 TRACK_LINEWIDTH = 1.5
-MAX_POINTS_PER_TRACK_DEQUE = 50 # Max points in deque for display of active tracks
+SINGULARITY_MARKER_SIZE = 40
+SINGULARITY_EDGE_COLOR = 'red' # Spiral markers and tracks
+SINGULARITY_ANTI_EDGE_COLOR = 'cyan' # Anti-spiral markers and tracks
+MAX_POINTS_PER_TRACK_DEQUE = 50 # Max trailing points drawn per active track (stored tracks keep full trajectories)
+TRACK_PRECOMPUTE_NUM_WORKERS = 1 # >1 precomputes conditions in parallel worker processes
 
 # --- GUI Initial States ---
 INITIAL_TIME_IDX = 0
 # INITIAL_BAND_NAME will be the first key from FREQ_BANDS
 INITIAL_SHOW_SINGULARITIES = True
 INITIAL_FILTER_PHASE_FOR_SINGULARITIES = False
-INITIAL_SHOW_TRACKS = False # Start with tracks OFF for potentially faster first load
\ No newline at end of file
+INITIAL_SHOW_TRACKS = False # Start with tracks OFF for potentially faster first load
+
+# --- Rendering and Playback Configuration ---
+GUI_BLITTING = True # Redraw only the changing artists while scrubbing the time slider or playing
+GUI_FRAME_CACHE_BLOCK_SIZE = 128 # Upsampled envelope frames computed together and cached per block
+GUI_FRAME_CACHE_MAX_BLOCKS = 16 # Cached blocks (least recently used are dropped)
+PLAYBACK_TARGET_FPS = 30 # Rendered frames per second during playback
+PLAYBACK_TIME_STEP = 1 # Time points advanced per rendered frame (at least one pyramid bin); frames are skipped when rendering falls behind
+PLAYBACK_LOOP = True # Restart from the beginning at the end of the recording (or of the time pyramid view window)
+
+# --- Time Pyramid Configuration (overview and scrubbing of long recordings) ---
+TIME_PYRAMID_DIR = None # If set, min/mean/max envelope pyramids are built here (memory-mapped) and the GUI gets an overview strip
+TIME_PYRAMID_FACTOR = 4 # Samples per bin grow by this factor from one level to the next
+TIME_PYRAMID_MIN_BINS = 500 # Levels are added until the coarsest has at most this many bins
+TIME_PYRAMID_BLOCK_SIZE = 65536 # Bins read per pass while building (bounds memory)
+GUI_MAX_SLIDER_STEPS = 2000 # The finest level with at most this many bins in the visible window is shown; full-resolution
+                            # frames, singularities and tracks only when the window spans at most this many samples
+GUI_PYRAMID_STATISTIC = 'mean' # Envelope shown at coarse levels: 'min', 'mean' or 'max' over each bin
+GUI_OVERVIEW_MAX_POINTS = 4000 # Resolution of the overview strip's band power curve
+
+# --- Streaming Configuration (python -m src.streaming) ---
+STREAM_BLOCK_SIZE = 50 # Samples per incoming block (50 ms at 1 kHz)
+STREAM_HILBERT_CYCLES = 3 # FIR Hilbert length in periods of each band's low edge (longer = more accurate, more delay)
+STREAM_HILBERT_MAX_TAPS = 1001 # Cap on the FIR length (also used for the raw LFP); delay is (taps - 1) / 2 samples
+STREAM_RING_BUFFER_FRAMES = 2000 # Latest envelope/phase frames kept per condition for display
+STREAM_NUM_THREADS = 1 # >1 processes the conditions of each block concurrently
+
+# --- Video Export Configuration (python -m src.video_export) ---
+VIDEO_EXPORT_FPS = 30 # Frames per second of exported movies
+VIDEO_EXPORT_TIME_STEP = 1 # Time points advanced per exported frame
+VIDEO_EXPORT_DPI = 100
+VIDEO_EXPORT_FIGSIZE = (8, 7) # Inches; with VIDEO_EXPORT_DPI this sets the frame size in pixels
+VIDEO_EXPORT_BITRATE = None # kbit/s for MP4 (None lets ffmpeg choose)
+VIDEO_EXPORT_NUM_WORKERS = None # Frame ranges rendered in parallel; None uses all CPUs
+
+# --- Epoched / Multi-Trial Configuration (python -m src.trials) ---
+TRIAL_LAYOUT = 'auto' # Stored axis order of epoched data, e.g. 'trials_channels_time' ('auto' finds channels by GRID_DIM^2)
+TRIAL_BATCH_SIZE = 16 # Trials filtered together in one batched call and handed to a worker as one task
+TRIAL_NUM_WORKERS = None # Trial batches processed in parallel; None uses all CPUs
@@ -1,28 +1,255 @@
 # src/data_loader.py
+import os
 import scipy.io
 import numpy as np
+from . import instrumentation
 
-def load_lfp_data(filepath, variable_name):
-    """Loads LFP data from a .mat file."""
+try:
+    import h5py # Optional: only needed for MATLAB v7.3 (HDF5) files
+except ImportError:
+    h5py = None
+
+RAW_BINARY_EXTENSIONS = ('.bin', '.dat', '.raw')
+
+def load_lfp_data(filepath, variable_name, num_expected_channels=None):
+    """
+    Loads LFP data from a .mat (v5 or v7.3), .npy or raw binary file.
+    Returns a lazily sliceable LazyLFPArray (channels x time) plus its dimensions.
+    Raises FileNotFoundError, ValueError (missing variable, unusable file) or ImportError; callers decide whether to exit.
+    """
     try:
-        mat_contents = scipy.io.loadmat(filepath)
-        lfp_data_all_channels = mat_contents[variable_name]
-        print(f"Data loaded successfully. Shape: {lfp_data_all_channels.shape}")
-        num_total_channels, num_time_points = lfp_data_all_channels.shape
-        return lfp_data_all_channels, num_total_channels, num_time_points
+        with instrumentation.span('load.open', file=os.path.basename(filepath)):
+            lfp_data_all_channels = open_lfp_data(filepath, variable_name, num_expected_channels=num_expected_channels)
     except FileNotFoundError:
-        print(f"FNF Error: File '{filepath}' not found.")
-        exit()
+        raise FileNotFoundError(f"File '{filepath}' not found.") from None
     except KeyError:
-        print(f"KE Error: Variable '{variable_name}' not found in '{filepath}'.")
-        exit()
-    except Exception as e:
-        print(f"An unexpected error occurred during data loading: {e}")
-        exit()
+        raise ValueError(f"Variable '{variable_name}' not found in '{filepath}'.") from None
+    print(f"Data loaded successfully. Shape: {lfp_data_all_channels.shape}")
+    num_total_channels, num_time_points = lfp_data_all_channels.shape
+    return lfp_data_all_channels, num_total_channels, num_time_points
+
+def open_lfp_data(filepath, variable_name=None, channels=None, time_range=None, layout='auto',
+                  num_expected_channels=None, raw_dtype='float32', raw_num_channels=None):
+    """
+    Opens LFP data without reading it into memory where the format allows it:
+        MATLAB v7.3 (.mat, HDF5) -> h5py dataset (requires h5py)
+        MATLAB v5 (.mat)         -> scipy.io.loadmat (eager; the format has no lazy access)
+        .npy                     -> np.load(mmap_mode='r')
+        .bin / .dat / .raw       -> np.memmap of raw_dtype with raw_num_channels channels
+    layout: 'channels_first', 'time_first', or 'auto'. With 'auto', the axis whose length equals
+    num_expected_channels is the channel axis; without it, the shorter axis is.
+    MATLAB v7.3 files store arrays transposed, so a MATLAB channels x time matrix usually arrives
+    time-first; this is handled by index translation, not by copying.
+    channels / time_range optionally restrict the returned view (index array or slice / (start, stop)).
+    Raises FileNotFoundError, KeyError (missing variable), ValueError or ImportError.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
+    extension = os.path.splitext(filepath)[1].lower()
+
+    if extension == '.npy':
+        source = np.load(filepath, mmap_mode='r')
+    elif extension in RAW_BINARY_EXTENSIONS:
+        if raw_num_channels is None:
+            raise ValueError("raw_num_channels is required for raw binary LFP files.")
+        flat = np.memmap(filepath, dtype=raw_dtype, mode='r')
+        if flat.size % raw_num_channels:
+            raise ValueError(f"File size is not a multiple of {raw_num_channels} channels of {raw_dtype}.")
+        # Raw exports are usually interleaved (time x channels) unless told otherwise
+        source = flat.reshape((raw_num_channels, -1) if layout == 'channels_first' else (-1, raw_num_channels))
+        if layout == 'auto': layout = 'time_first'
+    elif extension == '.mat':
+        source = _open_mat_variable(filepath, variable_name)
+    else:
+        raise ValueError(f"Unsupported LFP file type '{extension}'.")
+
+    if source.ndim != 2:
+        raise ValueError(f"Expected a 2-D LFP array, got shape {source.shape}.")
+    lfp_array = LazyLFPArray(source, time_first=_is_time_first(source.shape, layout, num_expected_channels))
+    if channels is not None or time_range is not None:
+        lfp_array = lfp_array.select(channels, time_range)
+    return lfp_array
+
+TRIAL_AXIS_NAMES = ('trials', 'channels', 'time')
+
+def open_lfp_trials(filepath, variable_name=None, num_expected_channels=None, layout='auto'):
+    """
+    Opens epoched LFP data (.npy or .mat) as a trials x channels x time array, transposing without copying
+    where the format allows it (.npy is memory-mapped, MATLAB v7.3 datasets are wrapped in a LazyTrialArray
+    that reads only the indexed trials).
+    layout: 'auto', or the stored axis order as '_'-joined names, e.g. 'trials_channels_time' or
+    'time_channels_trials' (a MATLAB trials x channels x time variable as stored in v7.3 files).
+    With 'auto', the axis whose length equals num_expected_channels is the channel axis (the middle
+    one when several match) and the longer remaining axis is time. 2-D data is one trial.
+    Raises FileNotFoundError, KeyError (missing variable), ValueError or ImportError.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.npy':
+        source = np.load(filepath, mmap_mode='r')
+    elif extension == '.mat':
+        source = _open_mat_variable(filepath, variable_name)
+    else:
+        raise ValueError(f"Unsupported epoched LFP file type '{extension}'.")
+
+    if source.ndim == 2:
+        axes = (None, 1, 0) if _is_time_first(source.shape, 'auto', num_expected_channels) else (None, 0, 1)
+    elif source.ndim == 3:
+        axes = _trial_axes(source.shape, layout, num_expected_channels)
+    else:
+        raise ValueError(f"Expected a 3-D trials x channels x time LFP array, got shape {source.shape}.")
+    if isinstance(source, np.ndarray): # Memory-mapped .npy or an eagerly loaded MATLAB v5 variable
+        return source[None].transpose(0, axes[1] + 1, axes[2] + 1) if axes[0] is None else source.transpose(axes)
+    return LazyTrialArray(source, axes)
+
+def _trial_axes(shape, layout, num_expected_channels):
+    """Axis permutation bringing an epoched array of the given stored shape into trials x channels x time order."""
+    if layout != 'auto':
+        stored_names = layout.split('_')
+        if sorted(stored_names) != sorted(TRIAL_AXIS_NAMES):
+            raise ValueError(f"Unknown trial layout '{layout}'. Expected 'auto' or an order of {TRIAL_AXIS_NAMES}.")
+        return tuple(stored_names.index(name) for name in TRIAL_AXIS_NAMES)
+    channel_candidates = [axis for axis in range(3) if shape[axis] == num_expected_channels]
+    if not channel_candidates:
+        raise ValueError(f"No axis of {shape} has {num_expected_channels} channels; set the trial layout explicitly.")
+    channel_axis = 1 if 1 in channel_candidates else channel_candidates[0]
+    trial_axis, time_axis = sorted((axis for axis in range(3) if axis != channel_axis), key=lambda axis: shape[axis])
+    return trial_axis, channel_axis, time_axis
+
+def _open_mat_variable(filepath, variable_name):
+    major_version, _ = scipy.io.matlab.matfile_version(filepath)
+    if major_version == 2: # v7.3 is HDF5
+        if h5py is None:
+            raise ImportError("Reading MATLAB v7.3 files requires h5py (pip install h5py).")
+        mat_file = h5py.File(filepath, 'r') # Kept open for as long as the dataset is referenced
+        if variable_name not in mat_file:
+            raise KeyError(variable_name)
+        return mat_file[variable_name]
+    mat_contents = scipy.io.loadmat(filepath, variable_names=[variable_name])
+    return mat_contents[variable_name]
+
+def _is_time_first(shape, layout, num_expected_channels):
+    if layout == 'channels_first': return False
+    if layout == 'time_first': return True
+    if layout != 'auto':
+        raise ValueError(f"Unknown layout '{layout}'. Expected 'channels_first', 'time_first' or 'auto'.")
+    if num_expected_channels is not None and num_expected_channels in shape:
+        return shape[0] != num_expected_channels
+    return shape[0] > shape[1]
+
+class LazyLFPArray:
+    """
+    Channels x time view over an on-disk or in-memory 2-D array (h5py dataset, np.memmap or ndarray),
+    stored either channels-first or time-first. Indexing reads only the requested block;
+    np.asarray() reads everything.
+    """
+    def __init__(self, source, time_first=False, channel_indices=None, time_start=0, time_stop=None):
+        self.source = source
+        self.time_first = time_first
+        num_source_channels, num_source_time = source.shape[::-1] if time_first else source.shape
+        self.channel_indices = channel_indices # None = all channels, else an index array into the source
+        self.time_start = time_start
+        self.time_stop = num_source_time if time_stop is None else time_stop
+        num_channels = num_source_channels if channel_indices is None else len(channel_indices)
+        self.shape = (num_channels, self.time_stop - self.time_start)
+        self.dtype = source.dtype
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def select(self, channels=None, time_range=None):
+        """Returns a narrower view: channels as an index array/slice, time_range as (start, stop)."""
+        channel_indices = self.channel_indices
+        if channels is not None:
+            all_channels = np.arange(self.shape[0]) if channel_indices is None else channel_indices
+            channel_indices = np.atleast_1d(all_channels[channels])
+        time_start, time_stop = self.time_start, self.time_stop
+        if time_range is not None:
+            start, stop, _ = slice(*time_range).indices(self.shape[1])
+            time_start, time_stop = self.time_start + start, self.time_start + max(start, stop)
+        return LazyLFPArray(self.source, self.time_first, channel_indices, time_start, time_stop)
+
+    def __getitem__(self, key):
+        channel_key, time_key = key if isinstance(key, tuple) else (key, slice(None))
+        squeeze_time = isinstance(time_key, (int, np.integer))
+        if squeeze_time:
+            time_idx = time_key + self.shape[1] if time_key < 0 else time_key
+            time_key = slice(time_idx, time_idx + 1)
+        if not isinstance(time_key, slice):
+            raise TypeError("LazyLFPArray supports integer or slice indexing along time.")
+        start, stop, step = time_key.indices(self.shape[1])
+        source_time = slice(self.time_start + start, self.time_start + max(start, stop), step)
+
+        if isinstance(self.source, np.ndarray) and self.channel_indices is None:
+            # ndarray / memmap with all channels: a (possibly transposed) view, no copy
+            view = self.source.T if self.time_first else self.source
+            block = view[channel_key, source_time]
+        else:
+            # Read only the channel range covering the request, then pick channels in memory
+            all_channels = np.arange(self.shape[0]) if self.channel_indices is None else self.channel_indices
+            wanted = np.atleast_1d(all_channels[channel_key])
+            if len(wanted) == 0:
+                block = np.empty((0, len(range(start, stop, step))), dtype=self.dtype)
+            else:
+                first, last = int(wanted.min()), int(wanted.max()) + 1
+                block = self.source[source_time, first:last].T if self.time_first else self.source[first:last, source_time]
+                block = np.asarray(block)[wanted - first]
+            if np.ndim(all_channels[channel_key]) == 0:
+                block = block[0]
+        instrumentation.count('lfp_bytes_read', block.nbytes)
+        return block[..., 0] if squeeze_time else block
+
+    def __array__(self, dtype=None, copy=None):
+        block = self[:, :]
+        return block if dtype is None else block.astype(dtype, copy=False)
+
+class LazyTrialArray:
+    """
+    Trials x channels x time view over an on-disk array (h5py dataset) stored in another axis order.
+    axes gives the stored axis of (trials, channels, time); a None trial axis means one stored trial.
+    Indexing the trial axis reads only those trials; np.asarray() reads everything.
+    """
+    def __init__(self, source, axes):
+        self.source = source
+        self.axes = tuple(axes)
+        num_trials = 1 if self.axes[0] is None else source.shape[self.axes[0]]
+        self.shape = (num_trials, source.shape[self.axes[1]], source.shape[self.axes[2]])
+        self.dtype = source.dtype
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        trial_key, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        squeeze_trial = isinstance(trial_key, (int, np.integer))
+        if squeeze_trial:
+            trial_idx = trial_key + self.shape[0] if trial_key < 0 else trial_key
+            trial_key = slice(trial_idx, trial_idx + 1)
+        if not isinstance(trial_key, slice):
+            raise TypeError("LazyTrialArray supports integer or slice indexing along trials.")
+        start, stop, step = trial_key.indices(self.shape[0])
+        if self.axes[0] is None:
+            block = np.asarray(self.source)[None][start:stop:step]
+            stored_axes = (0, self.axes[1] + 1, self.axes[2] + 1)
+        else:
+            stored_key = [slice(None)] * 3
+            stored_key[self.axes[0]] = slice(start, max(start, stop), step)
+            block = np.asarray(self.source[tuple(stored_key)])
+            stored_axes = self.axes
+        block = block.transpose(stored_axes)
+        instrumentation.count('lfp_bytes_read', block.nbytes)
+        block = block[0] if squeeze_trial else block
+        return block[rest] if rest else block
+
+    def __array__(self, dtype=None, copy=None):
+        block = self[:]
+        return block if dtype is None else block.astype(dtype, copy=False)
 
 def verify_grid_compatibility(num_total_channels, grid_dim):
-    """Verifies if the number of channels matches the grid dimensions."""
+    """Verifies if the number of channels matches the grid dimensions (raises ValueError otherwise)."""
     if num_total_channels != grid_dim * grid_dim:
-        print(f"Grid Error: Number of channels ({num_total_channels}) "
-              f"does not match GRID_DIM^2 ({grid_dim*grid_dim}).")
-        exit()
\ No newline at end of file
+        raise ValueError(f"Number of channels ({num_total_channels}) "
+                         f"does not match GRID_DIM^2 ({grid_dim*grid_dim}).")
@@ -0,0 +1,239 @@
+# src/instrumentation.py
+# Timed spans, counters and memory samples for pipeline runs, exportable as JSON lines or Chrome trace
+# (chrome://tracing, ui.perfetto.dev). Disabled by default; span() then only measures its duration
+# and count() does nothing.
+import os
+import json
+import time
+import pstats
+import cProfile
+import importlib
+import threading
+from contextlib import contextmanager
+from . import memory_report
+
+try:
+    import line_profiler # Optional: only needed for PROFILE_MODE = 'line'
+except ImportError:
+    line_profiler = None
+
+PROFILE_MODES = ('cprofile', 'line')
+
+class Recorder:
+    """
+    Collects span, memory-sample and counter events for one process. Spans record wall time, the
+    current RSS at entry/exit and the peak RSS seen by the background sampler while they were open.
+    Spans whose name is in profile_stages also run under cProfile (or line_profiler for the
+    functions named in line_profile_functions) and save the profile in profile_output_dir.
+    """
+    def __init__(self, enabled=False, memory_sample_interval_s=None, profile_stages=(), profile_mode='cprofile',
+                 profile_output_dir='profiles', line_profile_functions=()):
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{profile_mode}'. Expected one of {PROFILE_MODES}.")
+        self.enabled = enabled
+        self.memory_sample_interval_s = memory_sample_interval_s
+        self.profile_stages = tuple(profile_stages)
+        self.profile_mode = profile_mode
+        self.profile_output_dir = profile_output_dir
+        self.line_profile_functions = tuple(line_profile_functions)
+        self.events = []   # Span and memory-sample dicts (epoch start times, so processes can be merged)
+        self.counters = {} # name -> total
+        self._open_spans = {}
+        self._span_ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+        self._sampler_stop = threading.Event()
+        if enabled and memory_sample_interval_s:
+            threading.Thread(target=self._sample_memory_loop, daemon=True).start()
+
+    def settings(self):
+        """Constructor arguments, e.g. to configure worker processes the same way."""
+        return {'enabled': self.enabled, 'memory_sample_interval_s': self.memory_sample_interval_s,
+                'profile_stages': self.profile_stages, 'profile_mode': self.profile_mode,
+                'profile_output_dir': self.profile_output_dir, 'line_profile_functions': self.line_profile_functions}
+
+    def stop(self):
+        self._sampler_stop.set()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled: # Only the duration, which callers may print
+            record = {}
+            start_counter = time.perf_counter()
+            try:
+                yield record
+            finally:
+                record['seconds'] = time.perf_counter() - start_counter
+            return
+        rss_bytes = memory_report.get_current_rss_bytes()
+        record = {'type': 'span', 'name': name, 'attrs': attrs, 'pid': os.getpid(), 'tid': threading.get_ident(),
+                  'start': time.time(), 'rss_start_bytes': rss_bytes, 'rss_peak_bytes': rss_bytes}
+        with self._lock:
+            span_id = next(self._span_ids)
+            self._open_spans[span_id] = record
+        profiler = self._start_profiler() if name in self.profile_stages else None
+        start_counter = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start_counter
+            if profiler is not None:
+                record['profile'] = self._stop_profiler(profiler, name)
+            rss_bytes = memory_report.get_current_rss_bytes()
+            with self._lock:
+                del self._open_spans[span_id]
+                record['rss_end_bytes'] = rss_bytes
+                record['rss_peak_bytes'] = max(record['rss_peak_bytes'] or 0, rss_bytes or 0)
+                record['counters'] = dict(self.counters) # Running totals at the end of the span
+                self.events.append(record)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_memory(self):
+        """Records the current RSS and raises the peak of every open span."""
+        rss_bytes = memory_report.get_current_rss_bytes()
+        if rss_bytes is None:
+            return
+        with self._lock:
+            for record in self._open_spans.values():
+                record['rss_peak_bytes'] = max(record['rss_peak_bytes'] or 0, rss_bytes)
+            self.events.append({'type': 'memory', 'pid': os.getpid(), 'start': time.time(), 'rss_bytes': rss_bytes})
+
+    def _sample_memory_loop(self):
+        while not self._sampler_stop.wait(self.memory_sample_interval_s):
+            self.sample_memory()
+
+    # --- Profiling ---
+
+    def _start_profiler(self):
+        if self.profile_mode == 'line':
+            if line_profiler is None:
+                raise ImportError("PROFILE_MODE 'line' requires line_profiler (pip install line_profiler).")
+            profiler = line_profiler.LineProfiler(*(_resolve_function(path) for path in self.line_profile_functions))
+        else:
+            profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler, span_name):
+        """Saves the profile (.prof for cProfile, .lprof + .txt for line_profiler) and returns its path."""
+        profiler.disable()
+        os.makedirs(self.profile_output_dir, exist_ok=True)
+        base_path = os.path.join(self.profile_output_dir, f"{span_name}-{os.getpid()}-{int(time.time() * 1000)}")
+        if self.profile_mode == 'line':
+            profiler.dump_stats(f'{base_path}.lprof')
+            with open(f'{base_path}.txt', 'w', encoding='utf-8') as f:
+                profiler.print_stats(stream=f)
+            return f'{base_path}.lprof'
+        profiler.dump_stats(f'{base_path}.prof')
+        print(f"  Profile of '{span_name}' saved to {base_path}.prof; top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
+        return f'{base_path}.prof'
+
+    # --- Export ---
+
+    def drain(self):
+        """Returns and clears the recorded events and counters (e.g. to send them from a worker to the parent process)."""
+        with self._lock:
+            drained = {'events': self.events, 'counters': self.counters}
+            self.events, self.counters = [], {}
+        return drained
+
+    def merge(self, drained):
+        """Adds events and counters recorded in another process (the result of its drain())."""
+        with self._lock:
+            self.events.extend(drained['events'])
+            for name, value in drained['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def write_jsonl(self, filepath):
+        """One JSON object per line: spans and memory samples, then the final counter totals."""
+        with open(filepath, 'w', encoding='utf-8') as f:
+            for event in sorted(self.events, key=lambda event: event['start']):
+                f.write(json.dumps(event, ensure_ascii=False, default=repr) + '\n')
+            f.write(json.dumps({'type': 'counters', 'pid': os.getpid(), 'counters': self.counters}) + '\n')
+
+    def write_chrome_trace(self, filepath):
+        """Chrome trace event format: spans as complete ('X') events, memory and counters as counter ('C') tracks."""
+        origin = min((event['start'] for event in self.events), default=time.time())
+        trace_events = []
+        for event in self.events:
+            timestamp_us = (event['start'] - origin) * 1e6
+            if event['type'] == 'memory':
+                trace_events.append({'name': 'memory', 'ph': 'C', 'ts': timestamp_us, 'pid': event['pid'],
+                                     'args': {'rss_mb': event['rss_bytes'] / 2**20}})
+                continue
+            args = dict(event['attrs'], rss_peak_mb=(event['rss_peak_bytes'] or 0) / 2**20)
+            if 'profile' in event:
+                args['profile'] = event['profile']
+            trace_events.append({'name': event['name'], 'cat': event['name'].split('.')[0], 'ph': 'X',
+                                 'ts': timestamp_us, 'dur': event['seconds'] * 1e6,
+                                 'pid': event['pid'], 'tid': event['tid'], 'args': args})
+            if event['counters']:
+                trace_events.append({'name': 'counters', 'ph': 'C', 'ts': timestamp_us + event['seconds'] * 1e6,
+                                     'pid': event['pid'], 'args': event['counters']})
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=repr)
+
+    def export(self, filepath):
+        """Writes JSON lines for *.jsonl paths and Chrome trace format otherwise."""
+        (self.write_jsonl if filepath.endswith('.jsonl') else self.write_chrome_trace)(filepath)
+        print(f"Instrumentation written to {filepath}")
+
+    def print_summary(self):
+        """
+        Total time, call count and peak RSS per span name (per condition for spans with a 'condition'
+        attribute, e.g. tracks.condition), then the counter totals.
+        """
+        if not self.enabled:
+            return
+        totals = {}
+        for event in self.events:
+            if event['type'] == 'span':
+                row_name = event['name']
+                if 'condition' in event['attrs']:
+                    row_name = f"{row_name} {event['attrs']['condition']}"
+                seconds, calls, peak = totals.get(row_name, (0.0, 0, 0))
+                totals[row_name] = (seconds + event['seconds'], calls + 1, max(peak, event['rss_peak_bytes'] or 0))
+        print("\n===== INSTRUMENTATION SUMMARY =====")
+        for name, (seconds, calls, peak) in sorted(totals.items(), key=lambda item: -item[1][0]):
+            print(f"  {name:<44} {seconds:>9.3f}s  {calls:>6} call(s)  peak RSS {memory_report.format_bytes(peak):>10}")
+        for name, value in sorted(self.counters.items()):
+            print(f"  {name:<44} {value:>12}")
+
+def _resolve_function(dotted_path):
+    """'src.singularity_detection.detect_singularities_batch' -> the function object."""
+    module_path, _, attribute_path = dotted_path.partition(':') if ':' in dotted_path else dotted_path.rpartition('.')
+    target = importlib.import_module(module_path)
+    for attribute in attribute_path.split('.'):
+        target = getattr(target, attribute)
+    return target
+
+# --- Process-wide recorder used by the pipeline modules ---
+
+_recorder = Recorder(enabled=False)
+
+def configure(**settings):
+    """Replaces the process-wide recorder (see Recorder for the settings) and returns it."""
+    global _recorder
+    _recorder.stop()
+    _recorder = Recorder(**settings)
+    return _recorder
+
+def configure_from_config(cfg):
+    return configure(enabled=cfg.INSTRUMENTATION_ENABLED,
+                     memory_sample_interval_s=cfg.INSTRUMENTATION_MEMORY_SAMPLE_INTERVAL_S,
+                     profile_stages=cfg.PROFILE_STAGES, profile_mode=cfg.PROFILE_MODE,
+                     profile_output_dir=cfg.PROFILE_OUTPUT_DIR, line_profile_functions=cfg.LINE_PROFILE_FUNCTIONS)
+
+def get_recorder():
+    return _recorder
+
+def span(name, **attrs):
+    """Context manager timing a block as a named span (attrs are stored with it)."""
+    return _recorder.span(name, **attrs)
+
+def count(name, value=1):
+    _recorder.count(name, value)
@@ -0,0 +1,203 @@
+# src/lazy_conditions.py
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future
+import numpy as np
+from . import instrumentation
+from . import signal_processing
+from . import time_pyramid
+from . import track_management
+
+USER_PRIORITY, PREFETCH_PRIORITY = 0, 1 # Lower runs first
+
+class LazyConditionPipeline:
+    """
+    Computes each condition the first time it is requested instead of all of them up front.
+    Work units are ('signal', band_or_None) -> (envelope, phase), ('tracks', condition_key) -> TrackStore and,
+    with cfg.TIME_PYRAMID_DIR and a pyramid_source_key, ('pyramid', band) -> time_pyramid.EnvelopePyramid.
+    Background worker threads run requested units first and prefetch the rest at lower priority.
+    At most `max_resident_conditions` signal units stay in memory (least recently used are dropped
+    and recomputed if needed again); track stores are compact and are all kept.
+    The `envelopes`, `phases` and `tracks` attributes are read-only mappings that can replace the
+    dicts the GUI normally receives, as is `pyramids` (None without pyramids).
+    lfp_data stays lazy (e.g. a LazyLFPArray): a signal unit reads and filters it channel_block_size
+    channels at a time, so the raw recording is never resident as a whole.
+    """
+    def __init__(self, lfp_data, cfg, num_time_points, max_resident_conditions=3, num_workers=1,
+                 channel_block_size=50, pyramid_source_key=None):
+        self.lfp_data = lfp_data
+        self.channel_block_size = max(1, channel_block_size)
+        self.cfg = cfg
+        self.num_time_points = num_time_points
+        self.max_resident_conditions = max(1, max_resident_conditions)
+        self._lock = threading.Lock()
+        self._resident = OrderedDict() # unit -> result, in LRU order
+        self._futures = {}             # unit -> Future for queued or running units
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+
+        band_names = list(cfg.FREQ_BANDS.keys())
+        condition_keys = [(False, None)] + [(True, band_name) for band_name in band_names]
+        self.envelopes = LazyConditionMapping(self, band_names, lambda band: ('signal', band), 0)
+        self.phases = LazyConditionMapping(self, condition_keys, lambda key: ('signal', key[1] if key[0] else None), 1)
+        self.tracks = LazyConditionMapping(self, condition_keys, lambda key: ('tracks', key), None)
+        self.pyramid_source_key = pyramid_source_key
+        self.pyramids = None
+        if cfg.TIME_PYRAMID_DIR and pyramid_source_key is not None:
+            self.pyramids = LazyConditionMapping(self, band_names, lambda band: ('pyramid', band), None)
+
+        for _ in range(max(1, num_workers)):
+            threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def prefetch_all(self):
+        """Queues every condition's signal and tracks at background priority."""
+        for condition_key in self.tracks:
+            self.submit(('signal', condition_key[1] if condition_key[0] else None), PREFETCH_PRIORITY)
+            if self.pyramids is not None and condition_key[0]:
+                self.submit(('pyramid', condition_key[1]), PREFETCH_PRIORITY)
+            self.submit(('tracks', condition_key), PREFETCH_PRIORITY)
+
+    def is_ready(self, unit):
+        with self._lock:
+            return unit in self._resident
+
+    def submit(self, unit, priority=USER_PRIORITY):
+        """Queues a unit unless it is resident, running, or already queued at the same or higher priority."""
+        with self._lock:
+            if unit in self._resident or (unit in self._futures and priority != USER_PRIORITY):
+                return
+            if unit not in self._futures:
+                self._futures[unit] = Future()
+            elif self._futures[unit].running():
+                return
+        # A user request for an already queued unit simply adds a higher-priority queue entry
+        self._queue.put((priority, next(self._sequence), unit))
+
+    def get(self, unit):
+        """Returns a unit's result, computing it in the calling thread if no worker has started it."""
+        with self._lock:
+            if unit in self._resident:
+                self._resident.move_to_end(unit)
+                return self._resident[unit]
+            future = self._futures.setdefault(unit, Future())
+            run_here = not future.running() and not future.done()
+            if run_here:
+                future.set_running_or_notify_cancel()
+        if run_here:
+            self._run(unit, future)
+        return future.result()
+
+    def _worker_loop(self):
+        while True:
+            _, _, unit = self._queue.get()
+            with self._lock:
+                future = self._futures.get(unit)
+                if future is None or future.running() or future.done():
+                    continue # Finished, running elsewhere, or a stale duplicate entry
+                future.set_running_or_notify_cancel()
+            self._run(unit, future)
+
+    def _run(self, unit, future):
+        try:
+            result = self._compute(unit)
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(unit, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._resident[unit] = result
+            self._futures.pop(unit, None)
+            self._evict()
+        future.set_result(result)
+
+    def _evict(self):
+        signal_units = [unit for unit in self._resident if unit[0] == 'signal']
+        for unit in signal_units[:max(0, len(signal_units) - self.max_resident_conditions)]:
+            del self._resident[unit]
+
+    def _compute(self, unit):
+        with instrumentation.span(f'lazy.{unit[0]}', key=repr(unit[1])):
+            return self._compute_unit(unit)
+
+    def _compute_unit(self, unit):
+        kind, key = unit
+        cfg = self.cfg
+        if kind == 'signal':
+            print(f"  Computing envelope/phase on demand for {key or 'raw LFP'}...")
+            return self._compute_signal(key)
+        if kind == 'pyramid': # Memory-mapped and compact, so kept like the tracks
+            envelope, _ = self.get(('signal', key))
+            return time_pyramid.build_or_load_band_pyramid(envelope, cfg.TIME_PYRAMID_DIR,
+                                                           time_pyramid.pyramid_label(list(cfg.FREQ_BANDS).index(key)),
+                                                           self.pyramid_source_key, cfg.TIME_PYRAMID_FACTOR,
+                                                           cfg.TIME_PYRAMID_MIN_BINS, cfg.TIME_PYRAMID_BLOCK_SIZE)
+        _, phase = self.get(('signal', key[1] if key[0] else None))
+        return track_management.precompute_all_tracks_for_condition(
+                    phase, key, self.num_time_points,
+                    cfg.GRID_DIM, cfg.UPSAMPLE_FACTOR, cfg.INTERPOLATION_ORDER_ZOOM,
+                    cfg.MAX_TRACK_DISTANCE_SQ, cfg.PHASE_TOLERANCE,
+                    detection_chunk_size=cfg.SINGULARITY_DETECTION_CHUNK_SIZE, linking_mode=cfg.TRACK_LINKING_MODE,
+                    detection_mode=cfg.SINGULARITY_DETECTION_MODE)
+
+    def _compute_signal(self, band_name):
+        """(envelope, phase) of one band (None = raw LFP), filtered a channel block at a time along the full time axis."""
+        cfg = self.cfg
+        num_channels = self.lfp_data.shape[0]
+        envelope = phase = None
+        for channel_start in range(0, num_channels, self.channel_block_size):
+            channel_stop = min(channel_start + self.channel_block_size, num_channels)
+            lfp_block = np.asarray(self.lfp_data[channel_start:channel_stop])
+            block_envelope, block_phase = signal_processing.compute_condition_envelope_and_phase(
+                                              lfp_block, band_name, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER,
+                                              cfg.SIGNAL_PROCESSING_METHOD, cfg.ENVELOPE_STORAGE_DTYPE,
+                                              cfg.PHASE_STORAGE_DTYPE)
+            del lfp_block
+            if phase is None:
+                phase = np.empty((num_channels,) + block_phase.shape[1:], dtype=block_phase.dtype)
+                if block_envelope is not None:
+                    envelope = np.empty((num_channels,) + block_envelope.shape[1:], dtype=block_envelope.dtype)
+            phase[channel_start:channel_stop] = block_phase
+            if envelope is not None:
+                envelope[channel_start:channel_stop] = block_envelope
+        return envelope, phase
+
+class LazyConditionMapping(Mapping):
+    """
+    Read-only mapping view over a LazyConditionPipeline. Indexing blocks until the value is computed;
+    request() queues it at user priority and returns whether it is already available.
+    """
+    def __init__(self, pipeline, keys, unit_for_key, result_index):
+        self._pipeline = pipeline
+        self._keys = list(keys)
+        self._unit_for_key = unit_for_key
+        self._result_index = result_index # Position in the unit's result tuple, or None for the whole result
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        result = self._pipeline.get(self._unit_for_key(key))
+        return result if self._result_index is None else result[self._result_index]
+
+    def __contains__(self, key):
+        return key in self._keys # Does not trigger computation
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def is_ready(self, key):
+        return self._pipeline.is_ready(self._unit_for_key(key))
+
+    def request(self, key):
+        """Queues key at user priority (if needed) and returns True if it can be read without waiting."""
+        unit = self._unit_for_key(key)
+        if self._pipeline.is_ready(unit):
+            return True
+        self._pipeline.submit(unit, USER_PRIORITY)
+        return self._pipeline.is_ready(unit)
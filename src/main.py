@@ -1,43 +1,43 @@
 # src/main.py
-import time
+import sys
 from . import config # Imports all variables from config.py
-from . import data_loader
-from . import signal_processing
-from . import track_management # This now handles its own singularity_detection import if needed
+from . import instrumentation
+from . import lazy_conditions
+from . import memory_report
+from . import pipeline # Load, signal processing and track stages (with optional result cache)
 from . import visualization
 
 def run_analysis_and_gui():
-    # 1. Load Data
-    lfp_data, num_channels, num_time_points = data_loader.load_lfp_data(
-                                                    config.MAT_FILE_PATH, 
-                                                    config.VARIABLE_NAME
-                                                )
-    data_loader.verify_grid_compatibility(num_channels, config.GRID_DIM)
+    stage_memory = memory_report.StageMemoryReport(enabled=config.REPORT_STAGE_MEMORY)
+    recorder = instrumentation.configure_from_config(config)
 
-    # 2. Precompute Signal Properties (Amplitude Envelopes and ALL Phase Series)
-    amp_env_data, filtered_lfp_data = \
-        signal_processing.calculate_amplitude_envelopes_and_filtered_lfp(
-            lfp_data, config.FREQ_BANDS, config.FS, config.FILTER_ORDER
-        )
-    
-    all_phase_series_cache_data = \
-        signal_processing.precompute_all_phase_series(
-            lfp_data, filtered_lfp_data, config.FREQ_BANDS, config.FS
-        )
+    if config.LAZY_CONDITIONS:
+        # 1. Load Data; 2./3. are computed per condition on first view, the rest prefetched in the background
+        with stage_memory.stage('load'):
+            lfp_data, _, num_time_points = pipeline.load_stage(config)
+        lazy_pipeline = lazy_conditions.LazyConditionPipeline(lfp_data, config, num_time_points,
+                                                              config.LAZY_MAX_RESIDENT_CONDITIONS,
+                                                              config.LAZY_PREFETCH_WORKERS,
+                                                              config.LAZY_CHANNEL_BLOCK_SIZE,
+                                                              pipeline.pyramid_source_key(config) if config.TIME_PYRAMID_DIR else None)
+        lazy_pipeline.prefetch_all()
+        amp_env_data, all_phase_series_cache_data, all_tracks_cache_data = \
+            lazy_pipeline.envelopes, lazy_pipeline.phases, lazy_pipeline.tracks
+        envelope_pyramids = lazy_pipeline.pyramids # Built per band after its envelope, like the other conditions
+    else:
+        # 1. Load Data, 2. Precompute Signal Properties (Amplitude Envelopes and ALL Phase Series),
+        # 3. Precompute All Tracks for ALL conditions (reused from the result cache when configured)
+        amp_env_data, all_phase_series_cache_data, all_tracks_cache_data, num_time_points = \
+            pipeline.run_pipeline(config, stage_memory=stage_memory)
+        envelope_pyramids = None
+        if config.TIME_PYRAMID_DIR: # Overview strip and zoom-dependent resolution in the GUI
+            with stage_memory.stage('time_pyramid'):
+                envelope_pyramids = pipeline.pyramid_stage(amp_env_data, config)
 
-    # 3. Precompute All Tracks for ALL conditions
-    # This function will populate track_management.all_tracks_cache
-    all_tracks_cache_data = track_management.perform_all_track_precomputations(
-        all_phase_series_cache_data, 
-        config.FREQ_BANDS,
-        config.GRID_DIM, 
-        config.UPSAMPLE_FACTOR, 
-        config.INTERPOLATION_ORDER_ZOOM,
-        config.MAX_TRACK_DISTANCE_SQ,
-        config.PHASE_TOLERANCE,
-        config.MAX_POINTS_PER_TRACK_DEQUE,
-        num_time_points # Pass num_time_points here
-    )
+    stage_memory.print_report()
+    recorder.print_summary()
+    if config.INSTRUMENTATION_ENABLED and config.INSTRUMENTATION_OUTPUT:
+        recorder.export(config.INSTRUMENTATION_OUTPUT) # Lazy mode: only what was computed before the GUI opened
 
     # 4. Launch Visualization GUI
     visualization.launch_gui(
@@ -45,8 +45,13 @@ def run_analysis_and_gui():
         all_phase_series_cache_data, # For instantaneous singularity display
         all_tracks_cache_data,       # For displaying precomputed tracks
         config,                      # Pass the config module for GUI to access constants
-        num_time_points
+        num_time_points,
+        _envelope_pyramids=envelope_pyramids
     )
 
 if __name__ == "__main__":
-    run_analysis_and_gui()
\ No newline at end of file
+    try:
+        run_analysis_and_gui()
+    except (FileNotFoundError, ValueError, ImportError) as e: # Data loading errors, e.g. a missing file or grid mismatch
+        print(f"Error: {e}")
+        sys.exit(1)
\ No newline at end of file
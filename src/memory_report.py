@@ -0,0 +1,76 @@
+# src/memory_report.py
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+def get_peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # macOS reports bytes, Linux kilobytes
+
+def get_current_rss_bytes():
+    """Current resident set size (Linux /proc), falling back to the peak RSS elsewhere."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return get_peak_rss_bytes()
+
+def format_bytes(num_bytes):
+    if num_bytes is None:
+        return 'n/a'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+
+class StageMemoryReport:
+    """
+    Records, for each pipeline stage, the peak memory allocated during the stage (via tracemalloc,
+    which also sees NumPy arrays), the memory still held afterwards, and the process peak RSS.
+    Tracing starts when the report is created, so create it before loading data.
+    When disabled, stage() is a no-op so callers can leave it in place.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = [] # List of dicts, one per completed stage
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage_name):
+        if not self.enabled:
+            yield
+            return
+        held_before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            held_after, stage_peak = tracemalloc.get_traced_memory()
+            self.stages.append({'stage': stage_name,
+                                'seconds': time.time() - start_time,
+                                'held_before_bytes': held_before,
+                                'stage_peak_bytes': stage_peak,
+                                'held_after_bytes': held_after,
+                                'process_peak_rss_bytes': get_peak_rss_bytes()})
+
+    def print_report(self):
+        if not self.enabled:
+            return
+        print("\n===== PEAK MEMORY PER STAGE =====")
+        for entry in self.stages:
+            print(f"  {entry['stage']:<32} peak {format_bytes(entry['stage_peak_bytes']):>10}  "
+                  f"held after {format_bytes(entry['held_after_bytes']):>10}  "
+                  f"process peak RSS {format_bytes(entry['process_peak_rss_bytes']):>10}  "
+                  f"({entry['seconds']:.2f}s)")
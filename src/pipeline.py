@@ -0,0 +1,155 @@
+# src/pipeline.py
+# Config-driven pipeline stages shared by the GUI entry point and headless tools (no GUI imports here).
+import os
+from contextlib import contextmanager
+from . import data_loader
+from . import instrumentation
+from . import result_cache
+from . import signal_processing
+from . import time_pyramid
+from . import track_management
+
+def load_stage(cfg, filepath=None):
+    """Opens the LFP data lazily. Returns (lfp_data, num_channels, num_time_points)."""
+    lfp_data, num_channels, num_time_points = data_loader.load_lfp_data(
+                                                    filepath or cfg.MAT_FILE_PATH,
+                                                    cfg.VARIABLE_NAME,
+                                                    cfg.GRID_DIM * cfg.GRID_DIM # Picks the channel axis
+                                                )
+    data_loader.verify_grid_compatibility(num_channels, cfg.GRID_DIM)
+    return lfp_data, num_channels, num_time_points
+
+def signal_stage(lfp_data, cfg):
+    """Amplitude envelopes and all phase series: ({band: envelope}, {(is_filtered, band): phase})."""
+    if cfg.CHUNKED_OUTPUT_DIR: # Out-of-core: results are memory-mapped .npy files
+        return signal_processing.compute_envelopes_and_phases_chunked(
+                    lfp_data, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER,
+                    cfg.CHUNKED_OUTPUT_DIR,
+                    cfg.CHUNK_BLOCK_SIZE,
+                    envelope_dtype=cfg.ENVELOPE_STORAGE_DTYPE,
+                    phase_dtype=cfg.PHASE_STORAGE_DTYPE
+                )
+    return signal_processing.compute_envelopes_and_phases(
+                lfp_data, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER,
+                cfg.SIGNAL_PROCESSING_METHOD,
+                cfg.ENVELOPE_STORAGE_DTYPE,
+                cfg.PHASE_STORAGE_DTYPE,
+                envelope_output_dir=pyramid_envelope_dir(cfg) # With pyramids, envelopes are memory-mapped too
+            )
+
+def track_stage(all_phase_series, num_time_points, cfg):
+    """Tracks for every condition: {(is_filtered, band): TrackStore}."""
+    return track_management.perform_all_track_precomputations(
+                all_phase_series,
+                cfg.FREQ_BANDS,
+                cfg.GRID_DIM,
+                cfg.UPSAMPLE_FACTOR,
+                cfg.INTERPOLATION_ORDER_ZOOM,
+                cfg.MAX_TRACK_DISTANCE_SQ,
+                cfg.PHASE_TOLERANCE,
+                cfg.MAX_POINTS_PER_TRACK_DEQUE, # Ignored, kept for the signature
+                num_time_points,
+                detection_chunk_size_config=cfg.SINGULARITY_DETECTION_CHUNK_SIZE,
+                linking_mode_config=cfg.TRACK_LINKING_MODE,
+                num_workers_config=cfg.TRACK_PRECOMPUTE_NUM_WORKERS,
+                detection_mode_config=cfg.SINGULARITY_DETECTION_MODE
+            )
+
+def relink_stage(all_detections, cfg):
+    """Tracks for every condition from stored detections: {(is_filtered, band): TrackStore}."""
+    for condition_key, detection_store in all_detections.items():
+        track_management.all_tracks_cache[condition_key] = track_management.link_detections(
+                                                                detection_store, cfg.MAX_TRACK_DISTANCE_SQ,
+                                                                cfg.TRACK_LINKING_MODE)
+    return track_management.all_tracks_cache
+
+def pyramid_stage(band_envelopes, cfg, filepath=None):
+    """
+    Memory-mapped min/mean/max envelope pyramids {band: EnvelopePyramid} in cfg.TIME_PYRAMID_DIR (reused if current).
+    Built a block at a time from the envelopes, which signal_stage memory-maps when pyramids are enabled.
+    """
+    return time_pyramid.build_or_load_pyramids(band_envelopes, cfg.TIME_PYRAMID_DIR, pyramid_source_key(cfg, filepath),
+                                               cfg.TIME_PYRAMID_FACTOR, cfg.TIME_PYRAMID_MIN_BINS,
+                                               cfg.TIME_PYRAMID_BLOCK_SIZE)
+
+def pyramid_source_key(cfg, filepath=None):
+    return make_stage_keys(cfg, filepath)['signal'] # Pyramids depend on exactly the signal stage's output
+
+def pyramid_envelope_dir(cfg):
+    """Where the in-memory signal path writes memory-mapped envelopes when pyramids are enabled (else None)."""
+    return os.path.join(cfg.TIME_PYRAMID_DIR, 'envelopes') if cfg.TIME_PYRAMID_DIR else None
+
+def make_stage_keys(cfg, filepath=None):
+    """Returns the result-cache keys {stage_name: key}; each stage key chains the previous one."""
+    input_fingerprint = result_cache.fingerprint_input_file(filepath or cfg.MAT_FILE_PATH,
+                                                            cfg.RESULT_CACHE_HASH_INPUT_CONTENTS)
+    signal_key = result_cache.make_stage_key('signal', None, cfg, result_cache.SIGNAL_STAGE_CONFIG_KEYS,
+                                             extra=input_fingerprint)
+    detection_key = result_cache.make_stage_key('detections', signal_key, cfg, result_cache.DETECTION_STAGE_CONFIG_KEYS)
+    track_key = result_cache.make_stage_key('tracks', detection_key, cfg, result_cache.TRACK_STAGE_CONFIG_KEYS)
+    return {'signal': signal_key, 'detections': detection_key, 'tracks': track_key}
+
+def run_pipeline(cfg, filepath=None, stage_memory=None):
+    """
+    Runs load -> envelopes/phases -> tracks. With cfg.RESULT_CACHE_DIR set, each stage is first looked up
+    in the on-disk result cache and stored there after computing, so a restart with unchanged inputs
+    and config reuses it (changing only a tracking parameter recomputes only the tracks, and changing only
+    a linking parameter relinks them from the cached per-frame detections).
+    stage_memory: optional object whose stage(name) context manager wraps each stage (e.g. StageMemoryReport).
+    Returns (band_envelopes, all_phase_series, all_tracks, num_time_points).
+    """
+    with _stage(stage_memory, 'load'):
+        lfp_data, _, num_time_points = load_stage(cfg, filepath)
+    band_envelopes, all_phase_series, all_tracks = run_processing_stages(lfp_data, num_time_points, cfg,
+                                                                          filepath, stage_memory)
+    return band_envelopes, all_phase_series, all_tracks, num_time_points
+
+def run_processing_stages(lfp_data, num_time_points, cfg, filepath=None, stage_memory=None):
+    """The stages after loading (see run_pipeline). Returns (band_envelopes, all_phase_series, all_tracks)."""
+    cache, stage_keys = None, {}
+    if cfg.RESULT_CACHE_DIR:
+        cache = result_cache.ResultCache(cfg.RESULT_CACHE_DIR, cfg.RESULT_CACHE_MAX_BYTES)
+        stage_keys = make_stage_keys(cfg, filepath)
+
+    with _stage(stage_memory, 'envelopes_and_phases'):
+        signal_results = result_cache.load_envelopes_and_phases(cache, stage_keys['signal']) if cache else None
+        if signal_results is not None:
+            print(f"Envelopes and phases loaded from result cache ({stage_keys['signal']}).")
+        else:
+            signal_results = signal_stage(lfp_data, cfg)
+            if cache:
+                result_cache.store_envelopes_and_phases(cache, stage_keys['signal'], *signal_results)
+        band_envelopes, all_phase_series = signal_results
+
+    with _stage(stage_memory, 'tracks'):
+        all_tracks = result_cache.load_tracks(cache, stage_keys['tracks']) if cache else None
+        all_detections = result_cache.load_detections(cache, stage_keys['detections']) if cache else None
+        if all_detections is not None:
+            track_management.all_detections_cache.update(all_detections)
+        if all_tracks is not None:
+            print(f"Tracks loaded from result cache ({stage_keys['tracks']}).")
+            track_management.all_tracks_cache.update(all_tracks)
+        else:
+            if all_detections is not None: # Only a linking parameter changed: skip zoom and detection
+                print(f"Detections loaded from result cache ({stage_keys['detections']}); relinking tracks.")
+                all_tracks = relink_stage(all_detections, cfg)
+            else:
+                all_tracks = track_stage(all_phase_series, num_time_points, cfg)
+                if cache:
+                    result_cache.store_detections(cache, stage_keys['detections'],
+                                                  {condition_key: track_management.all_detections_cache[condition_key]
+                                                   for condition_key in all_tracks})
+            if cache:
+                result_cache.store_tracks(cache, stage_keys['tracks'], all_tracks)
+
+    return band_envelopes, all_phase_series, all_tracks
+
+@contextmanager
+def _stage(stage_memory, stage_name):
+    """Instrumentation span for the stage, plus stage_memory.stage() when a StageMemoryReport (or similar) is given."""
+    with instrumentation.span(f'stage.{stage_name}'):
+        if stage_memory is None:
+            yield
+        else:
+            with stage_memory.stage(stage_name):
+                yield
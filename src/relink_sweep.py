@@ -0,0 +1,131 @@
+# src/relink_sweep.py
+# Detect once, relink many: python -m src.relink_sweep results/session1 --distances 3 5 7 10 --modes greedy optimal -j 8
+# Relinks stored per-frame detections (detections_<condition>.npz, written by src.batch) for a grid of linking
+# parameters and summarizes the resulting tracks. MAX_POINTS_PER_TRACK_DEQUE only limits how much of each track
+# the GUI draws, so it needs no relinking.
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import config
+from .track_linking import LINKING_MODES
+from .track_management import link_detections
+from .track_store import DetectionStore, SPIRAL
+
+LIFETIME_BIN_EDGES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) # Frames; the last bin is open-ended
+
+_worker_detections = {} # label -> DetectionStore, loaded once per worker process
+
+def summarize_tracks(track_store):
+    """Track counts per type and the track lifetime distribution (in frames) of a TrackStore."""
+    lifetimes = track_store.track_lengths()
+    bin_counts = np.bincount(np.searchsorted(LIFETIME_BIN_EDGES, lifetimes, side='right') - 1,
+                             minlength=len(LIFETIME_BIN_EDGES))
+    bin_labels = [f'{low}-{high - 1}' if high - 1 > low else f'{low}'
+                  for low, high in zip(LIFETIME_BIN_EDGES[:-1], LIFETIME_BIN_EDGES[1:])] + [f'{LIFETIME_BIN_EDGES[-1]}+']
+    has_tracks = len(lifetimes) > 0
+    return {'num_tracks': len(track_store),
+            'num_spiral_tracks': int(np.sum(track_store.types == SPIRAL)),
+            'num_anti_spiral_tracks': int(np.sum(track_store.types != SPIRAL)),
+            'num_points': int(track_store.num_points),
+            'lifetime_mean': float(lifetimes.mean()) if has_tracks else float('nan'),
+            'lifetime_median': float(np.median(lifetimes)) if has_tracks else float('nan'),
+            'lifetime_p90': float(np.percentile(lifetimes, 90)) if has_tracks else float('nan'),
+            'lifetime_max': int(lifetimes.max(initial=0)),
+            'single_frame_fraction': float(np.mean(lifetimes == 1)) if has_tracks else float('nan'),
+            'lifetime_histogram': dict(zip(bin_labels, bin_counts.tolist()))}
+
+def relink_and_summarize(detection_store, max_displacement, linking_mode):
+    """Links detections with a maximum per-frame displacement (zoomed pixels) and summarizes the tracks."""
+    start_time = time.perf_counter()
+    track_store = link_detections(detection_store, max_displacement**2, linking_mode)
+    summary = summarize_tracks(track_store)
+    summary['seconds'] = time.perf_counter() - start_time
+    return summary
+
+def _load_detections(source):
+    return DetectionStore.load_npz(source) if isinstance(source, str) else source
+
+def _init_worker(detection_sources):
+    _worker_detections.update({label: _load_detections(source) for label, source in detection_sources.items()})
+
+def _run_sweep_point(label, max_displacement, linking_mode):
+    return relink_and_summarize(_worker_detections[label], max_displacement, linking_mode)
+
+def run_relink_sweep(detection_sources, max_displacements, linking_modes=('greedy',), num_workers=1):
+    """
+    Relinks every condition for every (max_displacement, linking_mode) pair.
+    detection_sources: {label: DetectionStore or path to a detections .npz file}; each worker loads them once.
+    Returns one record per sweep point ({'condition', 'max_displacement', 'linking_mode'} plus
+    summarize_tracks' statistics and the relinking time), in grid order.
+    """
+    unknown_modes = [linking_mode for linking_mode in linking_modes if linking_mode not in LINKING_MODES]
+    if unknown_modes:
+        raise ValueError(f"Unknown linking mode(s) {unknown_modes}. Expected one of {LINKING_MODES}.")
+    sweep_points = [(label, float(max_displacement), linking_mode) for label in detection_sources
+                    for linking_mode in linking_modes for max_displacement in max_displacements]
+    print(f"Relinking {len(detection_sources)} condition(s) x {len(max_displacements)} distance(s) x "
+          f"{len(linking_modes)} mode(s) = {len(sweep_points)} sweep points on {num_workers} worker(s)...")
+    if num_workers > 1 and len(sweep_points) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(sweep_points)), initializer=_init_worker,
+                                 initargs=(detection_sources,)) as executor:
+            summaries = list(executor.map(_run_sweep_point, *zip(*sweep_points)))
+    else:
+        all_detections = {label: _load_detections(source) for label, source in detection_sources.items()}
+        summaries = [relink_and_summarize(all_detections[label], max_displacement, linking_mode)
+                     for label, max_displacement, linking_mode in sweep_points]
+    return [dict({'condition': label, 'max_displacement': max_displacement, 'linking_mode': linking_mode}, **summary)
+            for (label, max_displacement, linking_mode), summary in zip(sweep_points, summaries)]
+
+def find_detection_files(inputs):
+    """{label: path} for detections_*.npz files given directly or inside session directories (label 'session/condition')."""
+    detection_files = {}
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            session_name = os.path.basename(os.path.normpath(input_path))
+            for filepath in sorted(glob.glob(os.path.join(input_path, 'detections_*.npz'))):
+                detection_files[f"{session_name}/{os.path.basename(filepath)[len('detections_'):-len('.npz')]}"] = filepath
+        else:
+            detection_files[os.path.splitext(os.path.basename(input_path))[0].replace('detections_', '', 1)] = input_path
+    return detection_files
+
+def print_sweep_table(records):
+    print(f"\n===== RELINK SWEEP ({len(records)} points) =====")
+    print(f"  {'condition':<24} {'mode':<8} {'max.disp':>8} {'tracks':>8} {'spiral':>7} {'anti':>7} "
+          f"{'life.mean':>9} {'median':>7} {'p90':>6} {'max':>6} {'1-frame':>8} {'seconds':>8}")
+    for record in records:
+        print(f"  {record['condition']:<24} {record['linking_mode']:<8} {record['max_displacement']:>8.2f} "
+              f"{record['num_tracks']:>8} {record['num_spiral_tracks']:>7} {record['num_anti_spiral_tracks']:>7} "
+              f"{record['lifetime_mean']:>9.2f} {record['lifetime_median']:>7.1f} {record['lifetime_p90']:>6.1f} "
+              f"{record['lifetime_max']:>6} {record['single_frame_fraction']:>8.3f} {record['seconds']:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.relink_sweep',
+                                     description="Relink stored singularity detections for a grid of linking parameters.")
+    parser.add_argument('inputs', nargs='+', help="Session directories written by src.batch, or detections_*.npz files.")
+    parser.add_argument('--distances', type=float, nargs='+',
+                        default=[config.MAX_PIXEL_DISPLACEMENT_FOR_TRACK_MATCHING_ZOOMED],
+                        help="Maximum per-frame displacements to try, in zoomed pixels "
+                             "(default: MAX_PIXEL_DISPLACEMENT_FOR_TRACK_MATCHING_ZOOMED).")
+    parser.add_argument('--modes', nargs='+', choices=LINKING_MODES, default=[config.TRACK_LINKING_MODE])
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="Sweep points linked in parallel.")
+    parser.add_argument('--output', help="Write all sweep records to this JSON file.")
+    args = parser.parse_args(argv)
+
+    detection_files = find_detection_files(args.inputs)
+    if not detection_files:
+        print("No detections_*.npz files found.")
+        return 1
+    records = run_relink_sweep(detection_files, args.distances, args.modes, max(1, args.workers))
+    print_sweep_table(records)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
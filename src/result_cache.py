@@ -0,0 +1,167 @@
+# src/result_cache.py
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from .track_store import TrackStore, DetectionStore
+
+CODE_VERSION = 'lfp-pipeline-1' # Bump when the cache entry format changes (invalidates every stage)
+
+# Per-stage algorithm versions, part of each stage key. Bump a stage's version, with a note, in the change that
+# alters its output for the same config; later stages chain on its key, so they are invalidated too.
+STAGE_VERSIONS = {
+    'signal': 2,     # 2: chunked mode gives blocks at the recording ends the other end as circular context
+    'detections': 2, # 2: SINGULARITY_DETECTION_MODE ('native_subpixel'), detections cached as their own stage
+    'tracks': 1,
+}
+
+# config values each stage depends on; a stage's key also includes its parent stage's key
+SIGNAL_STAGE_CONFIG_KEYS = ('VARIABLE_NAME', 'FS', 'FREQ_BANDS', 'FILTER_ORDER', 'SIGNAL_PROCESSING_METHOD',
+                            'ENVELOPE_STORAGE_DTYPE', 'PHASE_STORAGE_DTYPE', 'CHUNKED_OUTPUT_DIR', 'CHUNK_BLOCK_SIZE')
+DETECTION_STAGE_CONFIG_KEYS = ('GRID_DIM', 'UPSAMPLE_FACTOR', 'INTERPOLATION_ORDER_ZOOM', 'PHASE_TOLERANCE',
+                               'SINGULARITY_DETECTION_MODE')
+TRACK_STAGE_CONFIG_KEYS = ('MAX_TRACK_DISTANCE_SQ', 'TRACK_LINKING_MODE') # Chained on the detection key
+
+def fingerprint_input_file(filepath, hash_contents=False):
+    """Identifies an input file by path, size and mtime, or (slower, move-proof) by a SHA-256 of its contents."""
+    file_stat = os.stat(filepath)
+    if not hash_contents:
+        return {'path': os.path.abspath(filepath), 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+    content_hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            content_hash.update(block)
+    return {'size': file_stat.st_size, 'sha256': content_hash.hexdigest()}
+
+def make_stage_key(stage_name, parent_key, config_module, config_keys, extra=None):
+    """Content-addressed key: hash of stage name, parent key, the listed config values, CODE_VERSION and the stage version."""
+    key_material = {'stage': stage_name, 'parent': parent_key, 'code_version': CODE_VERSION,
+                    'stage_version': STAGE_VERSIONS.get(stage_name),
+                    'config': {name: getattr(config_module, name, None) for name in config_keys},
+                    'extra': extra}
+    serialized = json.dumps(key_material, sort_keys=True, default=repr, ensure_ascii=False)
+    return f"{stage_name}-{hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]}"
+
+class ResultCache:
+    """
+    On-disk cache of pipeline stage results. Each entry is a directory of .npy files (loaded back
+    memory-mapped) plus a meta.json. Total size is capped; least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir, max_size_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Returns (arrays, metadata) for a cached entry, or None. Arrays are read-only memory maps."""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            entry_meta = json.load(f)
+        arrays = {name: np.load(os.path.join(entry_dir, f'{name}.npy'), mmap_mode='r')
+                  for name in entry_meta['array_names']}
+        os.utime(meta_path) # meta.json mtime records the last access for LRU eviction
+        return arrays, entry_meta['metadata']
+
+    def put(self, key, arrays, metadata=None):
+        """Stores a dict of arrays under key (written to a temporary directory, then renamed into place)."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'array_names': list(arrays), 'metadata': metadata or {}, 'created': time.time()},
+                      f, ensure_ascii=False)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self.evict(keep_key=key)
+
+    def entries(self):
+        """Returns [(key, size_bytes, last_access)] of all complete entries."""
+        found = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self._entry_dir(key), 'meta.json')
+            if '.tmp-' in key or not os.path.exists(meta_path):
+                continue
+            entry_dir = self._entry_dir(key)
+            size_bytes = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            found.append((key, size_bytes, os.path.getmtime(meta_path)))
+        return found
+
+    def evict(self, keep_key=None):
+        """Removes least recently used entries until the cache fits in max_size_bytes."""
+        if self.max_size_bytes is None:
+            return
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total_bytes = sum(size_bytes for _, size_bytes, _ in entries)
+        for key, size_bytes, _ in entries:
+            if total_bytes <= self.max_size_bytes:
+                break
+            if key == keep_key:
+                continue
+            print(f"  Result cache: evicting {key} ({size_bytes / 1e6:.1f} MB)")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_bytes -= size_bytes
+
+# --- Stage-specific (de)serialization ---
+
+def store_envelopes_and_phases(cache, key, band_envelopes, all_phase_series):
+    arrays, band_names = {}, list(band_envelopes)
+    for band_idx, band_name in enumerate(band_names):
+        arrays[f'envelope_band{band_idx}'] = band_envelopes[band_name]
+        arrays[f'phase_band{band_idx}'] = all_phase_series[(True, band_name)]
+    arrays['phase_raw'] = all_phase_series[(False, None)]
+    cache.put(key, arrays, {'band_names': band_names})
+
+def load_envelopes_and_phases(cache, key):
+    """Returns ({band: envelope}, {(is_filtered, band): phase}) from the cache, or None."""
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    arrays, metadata = cached
+    band_envelopes = {band_name: arrays[f'envelope_band{band_idx}']
+                      for band_idx, band_name in enumerate(metadata['band_names'])}
+    all_phase_series = {(False, None): arrays['phase_raw']}
+    all_phase_series.update({(True, band_name): arrays[f'phase_band{band_idx}']
+                             for band_idx, band_name in enumerate(metadata['band_names'])})
+    return band_envelopes, all_phase_series
+
+def store_tracks(cache, key, all_tracks):
+    _store_per_condition(cache, key, all_tracks)
+
+def load_tracks(cache, key):
+    """Returns {(is_filtered, band): TrackStore} from the cache, or None."""
+    return _load_per_condition(cache, key, TrackStore)
+
+def store_detections(cache, key, all_detections):
+    _store_per_condition(cache, key, all_detections)
+
+def load_detections(cache, key):
+    """Returns {(is_filtered, band): DetectionStore} from the cache, or None."""
+    return _load_per_condition(cache, key, DetectionStore)
+
+def _store_per_condition(cache, key, condition_stores):
+    """Stores {(is_filtered, band): TrackStore or DetectionStore} as one entry."""
+    arrays, condition_keys = {}, list(condition_stores)
+    for condition_idx, condition_key in enumerate(condition_keys):
+        for name, array in condition_stores[condition_key].to_arrays().items():
+            arrays[f'condition{condition_idx}_{name}'] = array
+    cache.put(key, arrays, {'condition_keys': [list(condition_key) for condition_key in condition_keys]})
+
+def _load_per_condition(cache, key, store_class):
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    arrays, metadata = cached
+    return {tuple(condition_key): store_class.from_arrays({name: arrays[f'condition{condition_idx}_{name}']
+                                                           for name in store_class.ARRAY_NAMES})
+            for condition_idx, condition_key in enumerate(metadata['condition_keys'])}
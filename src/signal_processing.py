@@ -1,6 +1,52 @@
 # src/signal_processing.py
+import os
+import json
 import numpy as np
-from scipy.signal import butter, filtfilt, hilbert
+from numpy.lib.format import open_memmap
+from scipy.fft import rfft, ifft, rfftfreq
+from scipy.signal import butter, sosfilt, sosfiltfilt, hilbert, sosfreqz
+from . import instrumentation
+
+SIGNAL_PROCESSING_METHODS = ('filtfilt', 'fft_bank')
+ENVELOPE_STORAGE_DTYPES = ('float64', 'float32', 'float16')
+PHASE_STORAGE_DTYPES = ('float64', 'float32', 'float16', 'int16') # int16 = quantized angle
+PHASE_INT16_SCALE = 32767 / np.pi # int16 step of ~9.6e-5 rad
+
+def design_bandpass_filter(low_freq, high_freq, fs, filter_order):
+    """
+    Butterworth band-pass in second-order sections, with the band edges clipped into (0, nyquist).
+    SOS form keeps low bands stable: the (b, a) form of the Delta band has poles outside the unit circle.
+    """
+    nyquist_freq = 0.5 * fs
+    low = low_freq / nyquist_freq
+    high = high_freq / nyquist_freq
+    if high >= 1.0: high = 0.999
+    if low <= 0: low = 1e-5
+    return butter(filter_order, [low, high], btype='band', output='sos')
+
+def design_fir_hilbert(num_taps):
+    """
+    Blackman-windowed type III FIR Hilbert transformer (num_taps is made odd). Convolving a signal with it gives
+    the Hilbert transform delayed by (num_taps - 1) // 2 samples; longer filters are accurate to lower frequencies.
+    """
+    num_taps = int(num_taps) | 1
+    m = np.arange(num_taps) - (num_taps - 1) // 2
+    kernel = np.zeros(num_taps)
+    is_odd = m % 2 != 0
+    kernel[is_odd] = 2 / (np.pi * m[is_odd])
+    return kernel * np.blackman(num_taps)
+
+def fir_hilbert_num_taps(low_freq, fs, cycles, max_taps):
+    """Odd tap count spanning `cycles` periods of low_freq (None = max_taps), capped at max_taps."""
+    num_taps = max_taps if low_freq is None else min(max_taps, int(np.ceil(cycles * fs / low_freq)))
+    return max(7, int(num_taps) | 1)
+
+def group_delay_samples(sos, freq, fs):
+    """Group delay of an SOS filter at freq, in samples (from the phase slope around freq)."""
+    step = 1e-3 * fs
+    _, response = sosfreqz(sos, worN=[freq - step, freq + step], fs=fs)
+    phase_slope = np.diff(np.unwrap(np.angle(response)))[0] / (2 * np.pi * 2 * step / fs)
+    return float(-phase_slope)
 
 def calculate_amplitude_envelopes_and_filtered_lfp(lfp_data, freq_bands, fs, filter_order):
     """
@@ -15,19 +61,14 @@ def calculate_amplitude_envelopes_and_filtered_lfp(lfp_data, freq_bands, fs, fil
 
     for band_name, (low_freq, high_freq) in freq_bands.items():
         # print(f"  Processing band: {band_name} for amplitude and storing filtered LFP...")
-        nyquist_freq = 0.5 * fs
-        low = low_freq / nyquist_freq
-        high = high_freq / nyquist_freq
-        if high >= 1.0: high = 0.999
-        if low <= 0: low = 1e-5
-        
-        b, a = butter(filter_order, [low, high], btype='band')
-        _filtered_lfp = filtfilt(b, a, lfp_data, axis=1)
-        
-        filtered_lfp_storage[band_name] = _filtered_lfp # Store for potential on-demand phase
-        
-        analytic_signal_band = hilbert(_filtered_lfp, axis=1)
-        band_envelopes_all_channels[band_name] = np.abs(analytic_signal_band)
+        with instrumentation.span('signal.band', band=band_name, method='filtfilt'):
+            sos = design_bandpass_filter(low_freq, high_freq, fs, filter_order)
+            _filtered_lfp = sosfiltfilt(sos, lfp_data, axis=1)
+            
+            filtered_lfp_storage[band_name] = _filtered_lfp # Store for potential on-demand phase
+            
+            analytic_signal_band = hilbert(_filtered_lfp, axis=1)
+            band_envelopes_all_channels[band_name] = np.abs(analytic_signal_band)
     print("Amplitude envelopes and filtered LFP storage done.")
     return band_envelopes_all_channels, filtered_lfp_storage
 
@@ -41,19 +82,306 @@ def precompute_all_phase_series(lfp_data, filtered_lfp_storage, freq_bands, fs):
     print("Pre-calculating ALL phase time series (Raw and Filtered)...")
 
     # Raw LFP phase
-    analytic_signal_raw_lfp = hilbert(lfp_data, axis=1)
-    all_phase_series_cache[(False, None)] = np.angle(analytic_signal_raw_lfp)
+    with instrumentation.span('signal.phase', band=None):
+        analytic_signal_raw_lfp = hilbert(lfp_data, axis=1)
+        all_phase_series_cache[(False, None)] = np.angle(analytic_signal_raw_lfp)
     # print("  Raw LFP phase done.")
 
     # Filtered LFP phases
     for band_name in freq_bands.keys():
         # print(f"  Calculating phase for pre-stored filtered band: {band_name} (entire series)")
-        _filtered_lfp = filtered_lfp_storage[band_name] # Use pre-filtered LFP
-        analytic_signal_band_filt = hilbert(_filtered_lfp, axis=1)
-        all_phase_series_cache[(True, band_name)] = np.angle(analytic_signal_band_filt)
+        with instrumentation.span('signal.phase', band=band_name):
+            _filtered_lfp = filtered_lfp_storage[band_name] # Use pre-filtered LFP
+            analytic_signal_band_filt = hilbert(_filtered_lfp, axis=1)
+            all_phase_series_cache[(True, band_name)] = np.angle(analytic_signal_band_filt)
     print("All phase time series precomputation finished.")
     return all_phase_series_cache
 
+def compute_envelopes_and_phases(lfp_data, freq_bands, fs, filter_order, method='filtfilt',
+                                 envelope_dtype='float64', phase_dtype='float64', envelope_output_dir=None):
+    """
+    Computes amplitude envelopes and all phase series from one analytic signal per band.
+    lfp_data is channels x time, or trials x channels x time (filtered in one batched call per band).
+    method:
+        'filtfilt' - zero-phase sosfiltfilt + hilbert per band (same results as the two functions above).
+                     Filters are second-order sections, so outputs differ from the earlier (b, a) filtfilt,
+                     most in the Delta band, whose (b, a) form was unstable at FS = 1000
+        'fft_bank' - one rFFT of the raw data, zero-phase Butterworth magnitude applied per band
+                     and one inverse FFT per band (see fft_filter_bank_analytic_signals)
+    envelope_dtype: 'float64', 'float32' or 'float16' storage for envelopes
+    phase_dtype:    'float64', 'float32', 'float16', or 'int16' (quantized angle, see quantize_phase)
+    Each band's filtered signal and analytic signal are released as soon as its envelope and phase are stored.
+    envelope_output_dir: if given, each envelope is written there as envelope_band<i>.npy as soon as it is
+    computed and returned as a read-only memory map, so the envelopes are not all resident at once.
+    Returns:
+        band_envelopes_all_channels: {band_name: envelope_array}
+        all_phase_series_cache: {(is_filtered, band_name_or_None): phase_array_400xtp}
+    """
+    if method not in SIGNAL_PROCESSING_METHODS:
+        raise ValueError(f"Unknown signal processing method '{method}'. Expected one of {SIGNAL_PROCESSING_METHODS}.")
+    if envelope_dtype not in ENVELOPE_STORAGE_DTYPES:
+        raise ValueError(f"Unknown envelope dtype '{envelope_dtype}'. Expected one of {ENVELOPE_STORAGE_DTYPES}.")
+    if phase_dtype not in PHASE_STORAGE_DTYPES:
+        raise ValueError(f"Unknown phase dtype '{phase_dtype}'. Expected one of {PHASE_STORAGE_DTYPES}.")
+    print(f"Pre-calculating amplitude envelopes and phase series (method: {method})...")
+    if envelope_output_dir:
+        os.makedirs(envelope_output_dir, exist_ok=True)
+    lfp_data = np.asarray(lfp_data) # Read lazily loaded data once rather than once per band
+    band_envelopes_all_channels = {}
+    all_phase_series_cache = {}
+
+    if method == 'fft_bank':
+        analytic_signals = fft_filter_bank_analytic_signals(lfp_data, freq_bands, fs, filter_order)
+    else:
+        analytic_signals = _filtfilt_analytic_signals(lfp_data, freq_bands, fs, filter_order)
+    for band_name, analytic_signal in analytic_signals:
+        if band_name is not None:
+            envelope = np.abs(analytic_signal).astype(envelope_dtype, copy=False)
+            if envelope_output_dir:
+                envelope_path = os.path.join(envelope_output_dir, f'envelope_band{list(freq_bands).index(band_name)}.npy')
+                np.save(envelope_path, envelope)
+                envelope = np.load(envelope_path, mmap_mode='r')
+            band_envelopes_all_channels[band_name] = envelope
+            del envelope
+        all_phase_series_cache[(band_name is not None, band_name)] = _store_phase(np.angle(analytic_signal), phase_dtype)
+        del analytic_signal # Drop the complex intermediate before the next band is computed
+    print("Amplitude envelopes and phase series done.")
+    return band_envelopes_all_channels, all_phase_series_cache
+
+def compute_condition_envelope_and_phase(lfp_data, band_name, freq_bands, fs, filter_order, method='filtfilt',
+                                         envelope_dtype='float64', phase_dtype='float64'):
+    """
+    Single-condition version of compute_envelopes_and_phases, for on-demand computation.
+    band_name=None gives the raw-LFP phase (envelope is None). Returns (envelope, phase).
+    """
+    if method not in SIGNAL_PROCESSING_METHODS:
+        raise ValueError(f"Unknown signal processing method '{method}'. Expected one of {SIGNAL_PROCESSING_METHODS}.")
+    selected_bands = {} if band_name is None else {band_name: freq_bands[band_name]}
+    analytic_signals = (fft_filter_bank_analytic_signals if method == 'fft_bank' else _filtfilt_analytic_signals)(
+                            np.asarray(lfp_data), selected_bands, fs, filter_order, include_raw=band_name is None)
+    _, analytic_signal = next(iter(analytic_signals))
+    envelope = None if band_name is None else np.abs(analytic_signal).astype(envelope_dtype, copy=False)
+    return envelope, _store_phase(np.angle(analytic_signal), phase_dtype)
+
+def _store_phase(phase, phase_dtype):
+    return quantize_phase(phase) if phase_dtype == 'int16' else phase.astype(phase_dtype, copy=False)
+
+def quantize_phase(phase):
+    """Stores phase angles in [-pi, pi] as int16."""
+    return np.round(phase * PHASE_INT16_SCALE).astype(np.int16)
+
+def as_phase_radians(phase_block):
+    """Returns phase in radians (float64), dequantizing int16 storage and upcasting reduced-precision floats."""
+    if np.issubdtype(phase_block.dtype, np.integer):
+        return phase_block / PHASE_INT16_SCALE
+    return np.asarray(phase_block, dtype=np.float64)
+
+def _filtfilt_analytic_signals(lfp_data, freq_bands, fs, filter_order, taper=None, include_raw=True,
+                               wrap_before=None, wrap_after=None):
+    """
+    Yields (band_name_or_None, analytic_signal), raw LFP first, using filtfilt + hilbert along the last axis
+    (so a trials x channels x time block is filtered in one call per band). If given, `taper` multiplies each signal before the Hilbert transform (used on chunk padding).
+    wrap_before / wrap_after are optional (raw data, num_samples) pairs filtered on their own, whose last / first
+    num_samples are placed before / after the filtered block for the Hilbert transform (the analytic signal then
+    includes them). Chunked mode uses them to give blocks at a recording end the circular context the in-memory
+    Hilbert transform sees there: the other end of the recording.
+    """
+    def _analytic(filter_signal):
+        parts = [filter_signal(lfp_data)]
+        if wrap_before is not None:
+            parts.insert(0, filter_signal(wrap_before[0])[..., -wrap_before[1]:])
+        if wrap_after is not None:
+            parts.append(filter_signal(wrap_after[0])[..., :wrap_after[1]])
+        signal = parts[0] if len(parts) == 1 else np.concatenate(parts, axis=-1)
+        return hilbert(signal if taper is None else signal * taper, axis=-1)
+
+    if include_raw:
+        with instrumentation.span('signal.band', band=None, method='filtfilt'):
+            analytic_signal = _analytic(lambda data: data)
+        yield None, analytic_signal
+    for band_name, (low_freq, high_freq) in freq_bands.items():
+        with instrumentation.span('signal.band', band=band_name, method='filtfilt'):
+            sos = design_bandpass_filter(low_freq, high_freq, fs, filter_order)
+            analytic_signal = _analytic(lambda data: sosfiltfilt(sos, data, axis=-1))
+        yield band_name, analytic_signal
+
+def fft_filter_bank_analytic_signals(lfp_data, freq_bands, fs, filter_order, include_raw=True):
+    """
+    Frequency-domain filter bank. Takes one rFFT of the raw data, multiplies it by |H(f)|^2 of the
+    Butterworth band-pass (the magnitude response of filtfilt, with zero phase), keeps only the
+    non-negative frequencies and inverts once per band, which yields the analytic signal directly.
+    Filtering is circular, so samples near the recording ends differ from filtfilt's padded edges.
+    Yields (band_name_or_None, analytic_signal), raw LFP first. Time is the last axis.
+    """
+    num_time_points = lfp_data.shape[-1]
+    with instrumentation.span('signal.fft_bank_forward'):
+        spectrum = rfft(lfp_data, axis=-1)
+    freqs = rfftfreq(num_time_points, d=1.0 / fs)
+
+    # Same one-sided weighting as scipy.signal.hilbert: DC (and Nyquist for even lengths) x1, others x2
+    analytic_weights = np.full(len(freqs), 2.0)
+    analytic_weights[0] = 1.0
+    if num_time_points % 2 == 0: analytic_weights[-1] = 1.0
+
+    def _inverse(band_gain):
+        full_spectrum = np.zeros(lfp_data.shape[:-1] + (num_time_points,), dtype=np.complex128)
+        full_spectrum[..., :len(freqs)] = spectrum * (analytic_weights * band_gain)
+        return ifft(full_spectrum, axis=-1, overwrite_x=True)
+
+    if include_raw:
+        with instrumentation.span('signal.band', band=None, method='fft_bank'):
+            analytic_signal = _inverse(1.0)
+        yield None, analytic_signal
+    for band_name, (low_freq, high_freq) in freq_bands.items():
+        with instrumentation.span('signal.band', band=band_name, method='fft_bank'):
+            sos = design_bandpass_filter(low_freq, high_freq, fs, filter_order)
+            _, freq_response = sosfreqz(sos, worN=freqs, fs=fs)
+            analytic_signal = _inverse(np.abs(freq_response)**2)
+        yield band_name, analytic_signal
+
+def compare_fft_filter_bank_to_filtfilt(lfp_data, freq_bands, fs, filter_order, edge_samples=None):
+    """
+    Reports how far the 'fft_bank' method deviates from the filtfilt path, per band.
+    `edge_samples` at each end are excluded (default: two periods of the lowest band edge),
+    since the two paths treat the recording ends differently.
+    Returns {band_name_or_'raw': {'envelope_rel_rms', 'envelope_rel_max', 'phase_rms_rad', 'phase_max_rad'}}.
+    """
+    if edge_samples is None: edge_samples = int(2 * fs / min(low for low, _ in freq_bands.values()))
+    interior = slice(edge_samples, lfp_data.shape[1] - edge_samples)
+    deviations = {}
+    for (band_name, ref), (_, fft) in zip(_filtfilt_analytic_signals(lfp_data, freq_bands, fs, filter_order),
+                                          fft_filter_bank_analytic_signals(lfp_data, freq_bands, fs, filter_order)):
+        ref, fft = ref[:, interior], fft[:, interior]
+        env_ref, env_fft = np.abs(ref), np.abs(fft)
+        env_scale = np.sqrt(np.mean(env_ref**2))
+        phase_err = np.angle(fft * np.conj(ref)) # Wrapped phase difference
+        report_key = 'raw' if band_name is None else band_name
+        deviations[report_key] = {
+            'envelope_rel_rms': float(np.sqrt(np.mean((env_fft - env_ref)**2)) / env_scale),
+            'envelope_rel_max': float(np.max(np.abs(env_fft - env_ref)) / env_scale),
+            'phase_rms_rad': float(np.sqrt(np.mean(phase_err**2))),
+            'phase_max_rad': float(np.max(np.abs(phase_err))),
+        }
+        print(f"  {report_key}: envelope rel. RMS {deviations[report_key]['envelope_rel_rms']:.2e}, "
+              f"phase RMS {deviations[report_key]['phase_rms_rad']:.2e} rad")
+    return deviations
+
+def estimate_padding_samples(freq_bands, fs, filter_order, tail_energy_tolerance=1e-9, min_seconds=2.0):
+    """
+    Samples of context needed on each side of a block so chunked filtering matches the in-memory path:
+    the longest band impulse response, truncated where its remaining energy falls below
+    tail_energy_tolerance, and at least min_seconds for the Hilbert transform's slowly decaying kernel.
+    """
+    max_ir_len = 0
+    impulse_len = int(60 * fs)
+    impulse = np.zeros(impulse_len); impulse[0] = 1.0
+    for low_freq, high_freq in freq_bands.values():
+        impulse_response = sosfilt(design_bandpass_filter(low_freq, high_freq, fs, filter_order), impulse)
+        tail_energy = np.cumsum(impulse_response[::-1]**2)[::-1]
+        below_tolerance = np.nonzero(tail_energy < tail_energy_tolerance * tail_energy[0])[0]
+        max_ir_len = max(max_ir_len, below_tolerance[0] if len(below_tolerance) else impulse_len)
+    return int(max(max_ir_len, min_seconds * fs))
+
+def compute_envelopes_and_phases_chunked(lfp_data, freq_bands, fs, filter_order, output_dir,
+                                         block_size=60000, pad_samples=None,
+                                         envelope_dtype='float32', phase_dtype='float32'):
+    """
+    Out-of-core version of compute_envelopes_and_phases (filtfilt method). The time axis is processed
+    in blocks of block_size samples, each extended by pad_samples of real data on both sides
+    (default: estimate_padding_samples) and trimmed back after filtering and the Hilbert transform.
+    Only one padded block and its per-band results are in memory at a time; envelopes and phases are
+    written to .npy files in output_dir and returned as read-only memory maps.
+    Blocks at a recording end get the other end as context, like the in-memory path's circular Hilbert transform.
+    Tolerance vs. the in-memory path over the whole recording (default bands, 1/f-like LFP, checked by
+    tests/test_signal_processing.py): max analytic-signal error below 2e-2 (Delta) and 2e-3 (other bands)
+    relative to the band RMS. The remainder is the far field of the in-memory path's wrap-around at the ends,
+    which falls off as 1/distance and is not captured by a block's padding. The raw-LFP phase has no local
+    Hilbert kernel and matches only approximately (median error ~0.05 rad).
+    Accepts any array supporting lfp_data[:, start:stop] (ndarray, np.memmap, lazy loaders).
+    Returns the same ({band: envelope}, {(is_filtered, band): phase}) dictionaries as the in-memory path.
+    """
+    if pad_samples is None:
+        pad_samples = estimate_padding_samples(freq_bands, fs, filter_order)
+    num_channels, num_time_points = lfp_data.shape
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Chunked envelope/phase computation: blocks of {block_size} samples, padding {pad_samples} -> {output_dir}")
+
+    # One output file per band envelope and per phase condition; the manifest maps names to files
+    manifest = {'envelopes': {}, 'phases': {}, 'num_time_points': num_time_points}
+    envelope_outputs, phase_outputs = {}, {}
+    phase_storage_dtype = np.int16 if phase_dtype == 'int16' else phase_dtype
+    for band_idx, band_name in enumerate([None] + list(freq_bands.keys())):
+        phase_file = 'phase_raw.npy' if band_name is None else f'phase_band{band_idx - 1}.npy'
+        phase_outputs[band_name] = open_memmap(os.path.join(output_dir, phase_file), mode='w+',
+                                               dtype=phase_storage_dtype, shape=(num_channels, num_time_points))
+        manifest['phases'][json.dumps([band_name is not None, band_name])] = phase_file
+        if band_name is not None:
+            envelope_file = f'envelope_band{band_idx - 1}.npy'
+            envelope_outputs[band_name] = open_memmap(os.path.join(output_dir, envelope_file), mode='w+',
+                                                      dtype=envelope_dtype, shape=(num_channels, num_time_points))
+            manifest['envelopes'][band_name] = envelope_file
+
+    for block_start in range(0, num_time_points, block_size):
+        block_stop = min(block_start + block_size, num_time_points)
+        read_start, read_stop = max(0, block_start - pad_samples), min(num_time_points, block_stop + pad_samples)
+        padded_block = _read_block(lfp_data, read_start, read_stop)
+        # A block reaching a recording end gets the other end as context, as in the in-memory circular Hilbert
+        # transform. That end is filtered on its own (2 * pad_samples, so filtfilt settles) and pad_samples kept.
+        wrap_before = wrap_after = None
+        if read_start == 0 and read_stop < num_time_points:
+            wrap_before = (_read_block(lfp_data, max(0, num_time_points - 2 * pad_samples), num_time_points),
+                           min(pad_samples, num_time_points))
+        if read_stop == num_time_points and read_start > 0:
+            wrap_after = (_read_block(lfp_data, 0, min(num_time_points, 2 * pad_samples)),
+                          min(pad_samples, num_time_points))
+        left_pad = block_start - read_start + (wrap_before[1] if wrap_before else 0)
+        right_pad = read_stop - block_stop + (wrap_after[1] if wrap_after else 0)
+        keep = slice(left_pad, left_pad + block_stop - block_start)
+        taper = _padding_taper(left_pad + block_stop - block_start + right_pad, left_pad, right_pad)
+        for band_name, analytic_signal in _filtfilt_analytic_signals(padded_block, freq_bands, fs, filter_order, taper,
+                                                                     wrap_before=wrap_before, wrap_after=wrap_after):
+            analytic_signal = analytic_signal[:, keep]
+            if band_name is not None:
+                envelope_outputs[band_name][:, block_start:block_stop] = np.abs(analytic_signal)
+            phase_outputs[band_name][:, block_start:block_stop] = _store_phase(np.angle(analytic_signal), phase_dtype)
+            del analytic_signal
+        instrumentation.count('samples_processed', block_stop - block_start)
+        print(f"    Processed samples {block_start}-{block_stop} of {num_time_points}")
+
+    for output in list(envelope_outputs.values()) + list(phase_outputs.values()):
+        output.flush()
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    del envelope_outputs, phase_outputs
+    return load_chunked_envelopes_and_phases(output_dir)
+
+def _read_block(lfp_data, start, stop):
+    with instrumentation.span('signal.chunk_read', start=start, stop=stop):
+        return np.asarray(lfp_data[:, start:stop], dtype=np.float64)
+
+def _padding_taper(length, left_pad, right_pad):
+    """
+    Window that is 1 over the kept block and the inner half of each padding, and falls to 0 with a
+    half-Hann ramp over the outer half. Removes the wrap-around jump the FFT-based Hilbert transform
+    would otherwise see at the block edges.
+    """
+    taper = np.ones(length)
+    for pad, side in ((left_pad, slice(None)), (right_pad, slice(None, None, -1))):
+        ramp_len = pad // 2
+        if ramp_len > 0:
+            taper[side][:ramp_len] = 0.5 - 0.5 * np.cos(np.pi * np.arange(ramp_len) / ramp_len)
+    return taper
+
+def load_chunked_envelopes_and_phases(output_dir):
+    """Reopens the outputs of compute_envelopes_and_phases_chunked as read-only memory maps."""
+    with open(os.path.join(output_dir, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    band_envelopes_all_channels = {band_name: np.load(os.path.join(output_dir, filename), mmap_mode='r')
+                                   for band_name, filename in manifest['envelopes'].items()}
+    all_phase_series_cache = {tuple(json.loads(key)): np.load(os.path.join(output_dir, filename), mmap_mode='r')
+                              for key, filename in manifest['phases'].items()}
+    return band_envelopes_all_channels, all_phase_series_cache
+
 def correct_phase_diff(diff): # Also used by singularity detection
     """Ensures phase difference is in [-pi, pi]."""
     return (diff + np.pi) % (2 * np.pi) - np.pi
\ No newline at end of file
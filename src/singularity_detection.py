@@ -1,31 +1,120 @@
 # src/singularity_detection.py
 import numpy as np
+from functools import lru_cache
+from numpy.lib.format import open_memmap
 from scipy.ndimage import zoom
-from .signal_processing import correct_phase_diff # Assuming correct_phase_diff is here or in utils
+from .signal_processing import correct_phase_diff, as_phase_radians # Assuming correct_phase_diff is here or in utils
+
+DETECTION_MODES = ('upsampled', 'native_subpixel') # Winding numbers on the zoomed grid, or on the native grid + sub-pixel refinement
 
 def detect_singularities(phase_grid_zoomed, phase_tolerance):
     """Detects singularities on a (potentially zoomed) phase grid."""
-    r_max, c_max = phase_grid_zoomed.shape
-    s_list, a_list = [], []
-    for r_idx in range(r_max - 1):
-        for c_idx in range(c_max - 1):
-            p1 = phase_grid_zoomed[r_idx, c_idx]
-            p2 = phase_grid_zoomed[r_idx, c_idx + 1]
-            p3 = phase_grid_zoomed[r_idx + 1, c_idx + 1]
-            p4 = phase_grid_zoomed[r_idx + 1, c_idx]
-            
-            diffs = [correct_phase_diff(p2 - p1),
-                     correct_phase_diff(p3 - p2),
-                     correct_phase_diff(p4 - p3),
-                     correct_phase_diff(p1 - p4)]
-            total_phase_change = sum(diffs)
-            
-            if np.abs(total_phase_change - 2 * np.pi) < phase_tolerance:
-                s_list.append((r_idx, c_idx)) # Store as (row, col) in the given grid's coordinate
-            elif np.abs(total_phase_change + 2 * np.pi) < phase_tolerance:
-                a_list.append((r_idx, c_idx))
+    s_rc, _, a_rc, _ = detect_singularities_batch(phase_grid_zoomed[np.newaxis], phase_tolerance)
+    s_list = [tuple(rc) for rc in s_rc.tolist()] # Store as (row, col) in the given grid's coordinate
+    a_list = [tuple(rc) for rc in a_rc.tolist()]
     return s_list, a_list
 
+def detect_singularities_batch(phase_volume, phase_tolerance, chunk_size=1000):
+    """
+    Detects singularities on every frame of a (T, H, W) phase volume at once.
+    Winding numbers are summed over all 2x2 plaquettes of up to `chunk_size` frames per pass,
+    so peak memory stays bounded by the chunk rather than the recording length.
+    Returns:
+        spiral_rc (N_s, 2), spiral_frames (N_s,), anti_rc (N_a, 2), anti_frames (N_a,)
+        Coordinates are (row, col) plaquette indices, ordered by frame, then row, then column.
+    """
+    num_frames = phase_volume.shape[0]
+    chunk_size = max(1, int(chunk_size))
+    s_rc_parts, s_t_parts, a_rc_parts, a_t_parts = [], [], [], []
+    for start in range(0, num_frames, chunk_size):
+        chunk = phase_volume[start:start + chunk_size]
+        p1 = chunk[:, :-1, :-1]
+        p2 = chunk[:, :-1, 1:]
+        p3 = chunk[:, 1:, 1:]
+        p4 = chunk[:, 1:, :-1]
+        total_phase_change = correct_phase_diff(p2 - p1)
+        total_phase_change += correct_phase_diff(p3 - p2)
+        total_phase_change += correct_phase_diff(p4 - p3)
+        total_phase_change += correct_phase_diff(p1 - p4)
+
+        is_spiral = np.abs(total_phase_change - 2 * np.pi) < phase_tolerance
+        is_anti = np.abs(total_phase_change + 2 * np.pi) < phase_tolerance
+        is_anti &= ~is_spiral # Same precedence as the per-plaquette if/elif
+
+        t_s, r_s, c_s = np.nonzero(is_spiral)
+        t_a, r_a, c_a = np.nonzero(is_anti)
+        s_rc_parts.append(np.stack((r_s, c_s), axis=1)); s_t_parts.append(t_s + start)
+        a_rc_parts.append(np.stack((r_a, c_a), axis=1)); a_t_parts.append(t_a + start)
+
+    if not s_rc_parts: # Empty volume
+        empty_rc, empty_t = np.empty((0, 2), dtype=np.intp), np.empty(0, dtype=np.intp)
+        return empty_rc, empty_t, empty_rc.copy(), empty_t.copy()
+    return (np.concatenate(s_rc_parts), np.concatenate(s_t_parts),
+            np.concatenate(a_rc_parts), np.concatenate(a_t_parts))
+
+def refine_singularities_subpixel(phase_volume, frames, plaquettes_rc):
+    """
+    Sub-pixel core positions of detected plaquettes: the zero of the bilinearly interpolated unit phasor field
+    exp(i * phase) inside each plaquette. A winding number of +/-1 guarantees such a zero; if the solve fails
+    numerically the plaquette centre is used. Returns (N, 2) float (row, col) in the grid's own pixel units.
+    """
+    plaquettes_rc = np.asarray(plaquettes_rc).reshape((-1, 2))
+    rows, cols = plaquettes_rc[:, 0], plaquettes_rc[:, 1]
+    p1 = np.exp(1j * phase_volume[frames, rows, cols])
+    p2 = np.exp(1j * phase_volume[frames, rows, cols + 1])
+    p3 = np.exp(1j * phase_volume[frames, rows + 1, cols + 1])
+    p4 = np.exp(1j * phase_volume[frames, rows + 1, cols])
+    # z(u, v) = a + b*u + c*v + d*u*v with u along columns, v along rows. v = -(a + b*u) / (c + d*u) is real
+    # where Im[(a + b*u) * conj(c + d*u)] = 0, a quadratic q2*u^2 + q1*u + q0 = 0.
+    a, b, c, d = p1, p2 - p1, p4 - p1, p1 - p2 + p3 - p4
+    q2 = np.imag(b * np.conj(d))
+    q1 = np.imag(a * np.conj(d)) + np.imag(b * np.conj(c))
+    q0 = np.imag(a * np.conj(c))
+    offsets_vu = np.full((len(plaquettes_rc), 2), 0.5)
+    found = np.zeros(len(plaquettes_rc), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_disc = np.sqrt(np.maximum(q1**2 - 4 * q2 * q0, 0))
+        is_linear = np.abs(q2) < 1e-12
+        candidates = (np.where(is_linear, -q0 / q1, (-q1 + sqrt_disc) / (2 * q2)),
+                      np.where(is_linear, np.nan, (-q1 - sqrt_disc) / (2 * q2)))
+        for u in candidates:
+            v = np.real(-(a + b * u) / (c + d * u))
+            valid = ~found & (u >= -1e-6) & (u <= 1 + 1e-6) & (v >= -1e-6) & (v <= 1 + 1e-6)
+            offsets_vu[valid] = np.stack((v[valid], u[valid]), axis=1)
+            found |= valid
+    return plaquettes_rc + np.clip(offsets_vu, 0.0, 1.0)
+
+def native_to_zoomed_coordinates(points_rc, grid_dim, upsample_factor):
+    """
+    Native-grid (row, col) positions -> the coordinate frame of upsampled detections (zoomed plaquette indices,
+    plaquette q centred on zoomed position q + 0.5; zooming maps native p to p * (zoomed_dim - 1) / (grid_dim - 1)).
+    """
+    zoomed_dim = int(round(grid_dim * upsample_factor))
+    return np.asarray(points_rc, dtype=np.float64) * (zoomed_dim - 1) / (grid_dim - 1) - 0.5
+
+def detect_singularities_from_series(start_idx, stop_idx, full_phase_series_400xtp, grid_dim, upsample_factor,
+                                     interpolation_order, phase_tolerance, detection_mode='upsampled', chunk_size=1000):
+    """
+    Detects singularities in frames [start_idx, stop_idx) of a (channels x time) phase series.
+    detection_mode:
+        'upsampled'       - winding numbers on the zoomed grid; integer plaquette indices
+        'native_subpixel' - winding numbers on the native grid (upsample_factor^2 fewer plaquettes, no zoom),
+                            refined by refine_singularities_subpixel and mapped to the zoomed coordinate frame
+    Returns detect_singularities_batch's (spiral_rc, spiral_frames, anti_rc, anti_frames), frames relative
+    to start_idx, so tracks and the GUI use the same coordinates in both modes.
+    """
+    if detection_mode == 'upsampled':
+        phase_volume = get_zoomed_phase_grids_from_series(start_idx, stop_idx, full_phase_series_400xtp,
+                                                          grid_dim, upsample_factor, interpolation_order)
+        return detect_singularities_batch(phase_volume, phase_tolerance, chunk_size)
+    if detection_mode == 'native_subpixel':
+        phase_volume = as_phase_radians(full_phase_series_400xtp[:, start_idx:stop_idx]).T.reshape((-1, grid_dim, grid_dim))
+        s_rc, s_frames, a_rc, a_frames = detect_singularities_batch(phase_volume, phase_tolerance, chunk_size)
+        s_rc = native_to_zoomed_coordinates(refine_singularities_subpixel(phase_volume, s_frames, s_rc), grid_dim, upsample_factor)
+        a_rc = native_to_zoomed_coordinates(refine_singularities_subpixel(phase_volume, a_frames, a_rc), grid_dim, upsample_factor)
+        return s_rc, s_frames, a_rc, a_frames
+    raise ValueError(f"Unknown detection mode '{detection_mode}'. Expected one of {DETECTION_MODES}.")
+
 def get_zoomed_phase_grid_from_series(time_idx, 
                                       full_phase_series_400xtp, 
                                       grid_dim, 
@@ -34,12 +123,64 @@ def get_zoomed_phase_grid_from_series(time_idx,
     """
     Extracts phase for a time_idx from a full series, reshapes, and zooms.
     """
-    phase_data_flat = full_phase_series_400xtp[:, time_idx]
-    phase_grid_original_20x20 = phase_data_flat.reshape((grid_dim, grid_dim))
-    
-    # Interpolate complex representation for phase
-    cos_phi = np.cos(phase_grid_original_20x20)
-    sin_phi = np.sin(phase_grid_original_20x20)
-    zoomed_cos_phi = zoom(cos_phi, upsample_factor, order=interpolation_order)
-    zoomed_sin_phi = zoom(sin_phi, upsample_factor, order=interpolation_order)
-    return np.arctan2(zoomed_sin_phi, zoomed_cos_phi)
\ No newline at end of file
+    return get_zoomed_phase_grids_from_series(time_idx, time_idx + 1, full_phase_series_400xtp,
+                                              grid_dim, upsample_factor, interpolation_order)[0]
+
+@lru_cache(maxsize=None)
+def get_zoom_operator(grid_dim, upsample_factor, interpolation_order):
+    """
+    Returns the (zoomed_dim x grid_dim) matrix M such that M @ grid @ M.T equals
+    scipy.ndimage.zoom(grid, upsample_factor, order=interpolation_order).
+    Built by zooming each unit vector, so it follows zoom's own coordinate mapping exactly.
+    """
+    identity = np.eye(grid_dim)
+    operator = np.stack([zoom(identity[j], upsample_factor, order=interpolation_order)
+                         for j in range(grid_dim)], axis=1)
+    operator.flags.writeable = False # Shared between callers through the cache
+    return operator
+
+def upsample_grid_frames(frames_flat, grid_dim, upsample_factor, interpolation_order, out=None):
+    """
+    Upsamples a block of flattened grid frames (T x grid_dim^2) to (T x zoomed_dim x zoomed_dim)
+    in one pass using the separable zoom operator. Accepts real or complex input.
+    If given, `out` (e.g. a np.memmap slice) receives the result.
+    """
+    operator = get_zoom_operator(grid_dim, upsample_factor, interpolation_order)
+    frames = np.asarray(frames_flat).reshape((-1, grid_dim, grid_dim))
+    rows_zoomed = np.matmul(operator, frames) # (T, zoomed_dim, grid_dim)
+    return np.matmul(rows_zoomed, operator.T, out=out)
+
+def get_zoomed_phase_grids_from_series(start_idx, stop_idx,
+                                       full_phase_series_400xtp,
+                                       grid_dim,
+                                       upsample_factor,
+                                       interpolation_order,
+                                       out=None):
+    """
+    Batched version of get_zoomed_phase_grid_from_series for frames [start_idx, stop_idx).
+    Phase is interpolated through its complex representation, as in the per-frame version.
+    Returns a (T, zoomed_dim, zoomed_dim) phase volume, written into `out` if given.
+    """
+    phase_block = as_phase_radians(full_phase_series_400xtp[:, start_idx:stop_idx]).T # (T, grid_dim^2)
+    zoomed_complex = upsample_grid_frames(np.exp(1j * phase_block), grid_dim,
+                                          upsample_factor, interpolation_order)
+    return np.arctan2(zoomed_complex.imag, zoomed_complex.real, out=out)
+
+def upsample_phase_series_to_memmap(full_phase_series_400xtp, output_path,
+                                    grid_dim, upsample_factor, interpolation_order,
+                                    block_size=1000, dtype=np.float32):
+    """
+    Upsamples a whole phase series block by block into a memory-mapped .npy file
+    of shape (T, zoomed_dim, zoomed_dim), so it can be computed once and reused.
+    """
+    num_time_points = full_phase_series_400xtp.shape[1]
+    zoomed_dim = get_zoom_operator(grid_dim, upsample_factor, interpolation_order).shape[0]
+    zoomed_volume = open_memmap(output_path, mode='w+', dtype=dtype,
+                                shape=(num_time_points, zoomed_dim, zoomed_dim))
+    for start in range(0, num_time_points, block_size):
+        stop = min(start + block_size, num_time_points)
+        get_zoomed_phase_grids_from_series(start, stop, full_phase_series_400xtp,
+                                           grid_dim, upsample_factor, interpolation_order,
+                                           out=zoomed_volume[start:stop])
+    zoomed_volume.flush()
+    return zoomed_volume
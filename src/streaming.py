@@ -0,0 +1,329 @@
+# src/streaming.py
+# Real-time mode: causal envelope/phase, singularity detection and track linking, block by block.
+# python -m src.streaming [recording.mat] [--block-size 50] [--realtime] [--synthetic SECONDS]
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+from scipy.signal import sosfilt, sosfilt_zi
+from . import config
+from . import data_loader
+from . import instrumentation
+from .signal_processing import design_bandpass_filter, design_fir_hilbert, fir_hilbert_num_taps, group_delay_samples
+from .singularity_detection import detect_singularities_from_series
+from .track_linking import TrackLinker
+
+class RingBuffer:
+    """
+    The last `capacity` samples of (channels x time) data. Samples never written read as zeros.
+    Absolute time indices count every sample appended since creation.
+    """
+    def __init__(self, num_channels, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.data = np.zeros((num_channels, self.capacity), dtype=dtype)
+        self.num_written = 0
+
+    def append(self, block):
+        num_new = block.shape[1]
+        kept = block[:, -self.capacity:] if num_new > self.capacity else block
+        positions = (self.num_written + num_new - kept.shape[1] + np.arange(kept.shape[1])) % self.capacity
+        self.data[:, positions] = kept
+        self.num_written += num_new
+
+    def latest(self, num_samples):
+        """The last num_samples (<= capacity) samples in time order, zero-filled before the first append."""
+        return self.data[:, (self.num_written - num_samples + np.arange(num_samples)) % self.capacity]
+
+    def get(self, start_idx, stop_idx):
+        """Samples [start_idx, stop_idx) by absolute index; they must still be in the buffer."""
+        if start_idx < self.num_written - self.capacity or stop_idx > self.num_written:
+            raise IndexError(f"Samples {start_idx}-{stop_idx} are outside the buffered range "
+                             f"{max(0, self.num_written - self.capacity)}-{self.num_written}.")
+        return self.data[:, np.arange(start_idx, stop_idx) % self.capacity]
+
+class FileReplaySource:
+    """
+    Block source replaying a channels x time recording (any array supporting [:, start:stop], e.g. from
+    data_loader.open_lfp_data). With realtime=True each block is released only once it would have been fully
+    recorded, pacing the replay at the sampling rate. Any iterable yielding (channels, samples) blocks can be
+    used as a source instead, e.g. a wrapper around an acquisition system's API.
+    """
+    def __init__(self, lfp_data, block_size, fs, realtime=False):
+        self.lfp_data = lfp_data
+        self.block_size = int(block_size)
+        self.fs = fs
+        self.realtime = realtime
+
+    def __iter__(self):
+        num_time_points = self.lfp_data.shape[1]
+        start_time = time.perf_counter()
+        for block_start in range(0, num_time_points, self.block_size):
+            block_stop = min(block_start + self.block_size, num_time_points)
+            if self.realtime:
+                time.sleep(max(0.0, start_time + block_stop / self.fs - time.perf_counter()))
+            yield np.asarray(self.lfp_data[:, block_start:block_stop], dtype=np.float64)
+
+class CausalAnalyticFilter:
+    """
+    Causal analytic signal of one condition: sosfilt band-pass (sos=None for raw LFP) with its state kept
+    between blocks, then an FIR Hilbert transformer over a ring buffer of the last num_taps - 1 filtered samples,
+    applied by FFT with the kernel spectrum cached per block length. process() returns one analytic sample per
+    input sample, each describing the input delay_samples earlier.
+    """
+    def __init__(self, num_channels, sos, hilbert_num_taps, center_freq=None, fs=None):
+        self.sos = sos
+        self.filter_state = None # Initialised from the first sample to avoid a start-up step response
+        self.hilbert_kernel = design_fir_hilbert(hilbert_num_taps)
+        self.fir_delay = (len(self.hilbert_kernel) - 1) // 2
+        self.history = RingBuffer(num_channels, len(self.hilbert_kernel) - 1)
+        self._kernel_spectra = {} # FFT length -> rfft of the kernel
+        # Envelope (and thus the singularity pattern) lags by the band-pass group delay plus the FIR delay
+        iir_delay = 0 if sos is None else max(0, int(round(group_delay_samples(sos, center_freq, fs))))
+        self.delay_samples = self.fir_delay + iir_delay
+
+    def process(self, block):
+        if self.sos is not None:
+            if self.filter_state is None:
+                self.filter_state = sosfilt_zi(self.sos)[:, np.newaxis, :] * block[np.newaxis, :, 0, np.newaxis]
+            block, self.filter_state = sosfilt(self.sos, block, axis=1, zi=self.filter_state)
+        extended = np.concatenate((self.history.latest(self.history.capacity), block), axis=1)
+        self.history.append(block)
+        num_samples, history_len = block.shape[1], self.history.capacity
+        fft_len = next_fast_len(extended.shape[1], real=True)
+        if fft_len not in self._kernel_spectra:
+            self._kernel_spectra[fft_len] = rfft(self.hilbert_kernel, fft_len)
+        # Circular convolution; the last num_samples outputs only see the buffered history and the block
+        imag = irfft(rfft(extended, fft_len, axis=1) * self._kernel_spectra[fft_len], fft_len, axis=1)
+        real = extended[:, history_len - self.fir_delay:][:, :num_samples]
+        return real + 1j * imag[:, history_len:history_len + num_samples]
+
+class StreamingEngine:
+    """
+    Incremental version of the offline pipeline for one array: feed raw sample blocks to process_block() as
+    they arrive. Per condition it keeps a CausalAnalyticFilter, ring buffers of the latest envelope and phase
+    frames and a TrackLinker stepped frame by frame, so detections and active tracks are available as soon as
+    a block is processed. Frames are labelled with the time they describe, i.e. block time minus each
+    condition's delay_samples. With num_threads > 1 conditions are processed concurrently (the FFT, zoom and
+    detection steps release the GIL). finish() returns the TrackStore of every condition.
+    """
+    def __init__(self, num_channels, freq_bands, fs, filter_order, grid_dim, upsample_factor, interpolation_order,
+                 max_track_distance_sq, phase_tolerance, linking_mode='greedy', conditions=None,
+                 hilbert_cycles=3, hilbert_max_taps=1001, ring_buffer_frames=2000, num_threads=1,
+                 detection_mode='upsampled'):
+        self.fs = fs
+        self.grid_dim, self.upsample_factor, self.interpolation_order = grid_dim, upsample_factor, interpolation_order
+        self.phase_tolerance, self.detection_mode = phase_tolerance, detection_mode
+        if conditions is None:
+            conditions = [(False, None)] + [(True, band_name) for band_name in freq_bands]
+        self.filters, self.linkers, self.envelopes, self.phases = {}, {}, {}, {}
+        for condition_key in conditions:
+            _, band_name = condition_key
+            if band_name is None:
+                sos, low_freq, center_freq = None, None, None
+            else:
+                low_freq, high_freq = freq_bands[band_name]
+                sos, center_freq = design_bandpass_filter(low_freq, high_freq, fs, filter_order), (low_freq + high_freq) / 2
+            num_taps = fir_hilbert_num_taps(low_freq, fs, hilbert_cycles, hilbert_max_taps)
+            self.filters[condition_key] = CausalAnalyticFilter(num_channels, sos, num_taps, center_freq, fs)
+            self.linkers[condition_key] = TrackLinker(max_track_distance_sq, linking_mode)
+            self.phases[condition_key] = RingBuffer(num_channels, ring_buffer_frames, np.float32)
+            if band_name is not None:
+                self.envelopes[condition_key] = RingBuffer(num_channels, ring_buffer_frames, np.float32)
+        self.executor = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+        self.num_samples_received = 0
+        self.block_latencies = [] # (arrival-to-done seconds, processing seconds, samples) per block
+
+    def delay_samples(self, condition_key):
+        return self.filters[condition_key].delay_samples
+
+    def next_frame(self, condition_key):
+        """Time index of the next frame the condition will produce (frames before it are available)."""
+        return self.num_samples_received - self.filters[condition_key].delay_samples
+
+    def process_block(self, block, arrival_time=None):
+        """
+        Processes one (channels, samples) block of raw LFP. arrival_time (time.perf_counter()) is when the
+        block became available; latency is measured from it, so time spent waiting to be processed counts too.
+        Returns {condition_key: (first_frame, spiral_rc, spiral_frames, anti_rc, anti_frames)} for the new frames,
+        with absolute frame indices.
+        """
+        arrival_time = time.perf_counter() if arrival_time is None else arrival_time
+        start_time = time.perf_counter()
+        block = np.asarray(block, dtype=np.float64)
+        block_start, num_samples = self.num_samples_received, block.shape[1]
+        with instrumentation.span('stream.block', start=block_start, samples=num_samples):
+            map_conditions = map if self.executor is None else self.executor.map
+            num_conditions = len(self.filters)
+            condition_results = map_conditions(self._process_condition, self.filters,
+                                               [block] * num_conditions, [block_start] * num_conditions)
+            detections = {condition_key: result for condition_key, result in zip(self.filters, condition_results)
+                          if result is not None}
+            self.num_samples_received += num_samples
+            instrumentation.count('stream_samples_processed', num_samples)
+        done_time = time.perf_counter()
+        self.block_latencies.append((done_time - arrival_time, done_time - start_time, num_samples))
+        return detections
+
+    def _process_condition(self, condition_key, block, block_start):
+        causal_filter = self.filters[condition_key]
+        analytic_signal = causal_filter.process(block)
+        first_frame = block_start - causal_filter.delay_samples
+        if first_frame < 0: # Frames before the recording started
+            analytic_signal = analytic_signal[:, -first_frame:]
+            first_frame = 0
+        if analytic_signal.shape[1] == 0:
+            return None
+        phase = np.angle(analytic_signal)
+        self.phases[condition_key].append(phase)
+        if condition_key in self.envelopes:
+            self.envelopes[condition_key].append(np.abs(analytic_signal))
+        return self._detect_and_link(condition_key, phase, first_frame)
+
+    def _detect_and_link(self, condition_key, phase, first_frame):
+        num_frames = phase.shape[1]
+        s_rc, s_frames, a_rc, a_frames = detect_singularities_from_series(0, num_frames, phase, self.grid_dim,
+                                                                          self.upsample_factor, self.interpolation_order,
+                                                                          self.phase_tolerance, self.detection_mode)
+        s_bounds = np.searchsorted(s_frames, np.arange(num_frames + 1))
+        a_bounds = np.searchsorted(a_frames, np.arange(num_frames + 1))
+        linker = self.linkers[condition_key]
+        for frame_in_block in range(num_frames):
+            linker.step(first_frame + frame_in_block,
+                        s_rc[s_bounds[frame_in_block]:s_bounds[frame_in_block + 1]],
+                        a_rc[a_bounds[frame_in_block]:a_bounds[frame_in_block + 1]])
+        instrumentation.count('spirals_detected', len(s_rc))
+        instrumentation.count('anti_spirals_detected', len(a_rc))
+        return first_frame, s_rc, s_frames + first_frame, a_rc, a_frames + first_frame
+
+    def active_tracks(self, condition_key):
+        """{track_type: (track_ids, last_points_rc)} of the tracks still being extended."""
+        return self.linkers[condition_key].active_tracks
+
+    def latest_frames(self, condition_key, num_frames):
+        """(envelope or None, phase) of the last num_frames frames, channels x frames, plus the first frame index."""
+        first_frame = self.next_frame(condition_key) - num_frames
+        envelope_buffer = self.envelopes.get(condition_key)
+        envelope = None if envelope_buffer is None else envelope_buffer.get(first_frame, first_frame + num_frames)
+        return envelope, self.phases[condition_key].get(first_frame, first_frame + num_frames), first_frame
+
+    def finish(self):
+        """Closes all tracks and returns {condition_key: TrackStore}."""
+        if self.executor is not None:
+            self.executor.shutdown()
+        return {condition_key: linker.finish() for condition_key, linker in self.linkers.items()}
+
+    def latency_report(self):
+        """
+        Per-block latency statistics (ms): arrival-to-done ('latency') and compute only ('processing'), the
+        block duration, the real-time factor (processing / block duration) and the number of blocks whose
+        processing took longer than their duration. Per condition, 'delay_ms' is the algorithmic delay
+        added by the causal filters, on top of the block latency.
+        """
+        latencies = np.array(self.block_latencies).reshape((-1, 3))
+        block_seconds = latencies[:, 2] / self.fs
+        report = {'num_blocks': len(latencies), 'samples': int(latencies[:, 2].sum()),
+                  'block_ms': float(np.mean(block_seconds) * 1e3) if len(latencies) else float('nan'),
+                  'overruns': int(np.sum(latencies[:, 1] > block_seconds)),
+                  'realtime_factor': float(latencies[:, 1].sum() / max(block_seconds.sum(), 1e-12)),
+                  'delay_ms': {condition_key: causal_filter.delay_samples / self.fs * 1e3
+                               for condition_key, causal_filter in self.filters.items()}}
+        for column, name in ((0, 'latency'), (1, 'processing')):
+            values_ms = latencies[:, column] * 1e3
+            stats = [np.mean(values_ms), *np.percentile(values_ms, [50, 95, 99]), np.max(values_ms)] if len(values_ms) \
+                    else [float('nan')] * 5
+            for stat_name, value in zip(('mean', 'p50', 'p95', 'p99', 'max'), stats):
+                report[f'{name}_{stat_name}_ms'] = float(value)
+        return report
+
+def print_latency_report(report):
+    print(f"\n===== STREAMING LATENCY ({report['num_blocks']} blocks of ~{report['block_ms']:.1f} ms, "
+          f"{report['samples']} samples) =====")
+    for name in ('latency', 'processing'):
+        print(f"  {name:<11} mean {report[f'{name}_mean_ms']:7.2f} ms  p50 {report[f'{name}_p50_ms']:7.2f}  "
+              f"p95 {report[f'{name}_p95_ms']:7.2f}  p99 {report[f'{name}_p99_ms']:7.2f}  max {report[f'{name}_max_ms']:7.2f}")
+    print(f"  real-time factor {report['realtime_factor']:.3f} (processing / recorded time), "
+          f"{report['overruns']} block(s) slower than real time")
+    print("  algorithmic delay per condition (band-pass group delay + FIR Hilbert delay):")
+    for condition_key, delay_ms in report['delay_ms'].items():
+        print(f"    {condition_key}: {delay_ms:.0f} ms")
+
+def make_engine(cfg, num_channels, conditions=None, num_threads=None):
+    """StreamingEngine configured from the config module (or a batch-style config snapshot)."""
+    return StreamingEngine(num_channels, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER,
+                           cfg.GRID_DIM, cfg.UPSAMPLE_FACTOR, cfg.INTERPOLATION_ORDER_ZOOM,
+                           cfg.MAX_TRACK_DISTANCE_SQ, cfg.PHASE_TOLERANCE, cfg.TRACK_LINKING_MODE, conditions,
+                           cfg.STREAM_HILBERT_CYCLES, cfg.STREAM_HILBERT_MAX_TAPS, cfg.STREAM_RING_BUFFER_FRAMES,
+                           cfg.STREAM_NUM_THREADS if num_threads is None else num_threads, cfg.SINGULARITY_DETECTION_MODE)
+
+def run_stream(source, engine, on_block=None):
+    """
+    Feeds every block of source to engine, timing each from the moment the source yields it.
+    on_block(engine, detections) is called after each block (e.g. to update a display).
+    Returns {condition_key: TrackStore}.
+    """
+    for block in source:
+        detections = engine.process_block(block, arrival_time=time.perf_counter())
+        if on_block is not None:
+            on_block(engine, detections)
+    return engine.finish()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.streaming',
+                                     description="Replay a recording through the causal streaming engine and report per-block latency.")
+    parser.add_argument('input', nargs='?', help="LFP file to replay (default: MAT_FILE_PATH).")
+    parser.add_argument('--variable-name', help="MATLAB variable holding the LFP (default: VARIABLE_NAME).")
+    parser.add_argument('--block-size', type=int, default=config.STREAM_BLOCK_SIZE, help="Samples per block.")
+    parser.add_argument('--realtime', action='store_true', help="Pace the replay at the sampling rate.")
+    parser.add_argument('--synthetic', type=float, metavar='SECONDS',
+                        help="Replay this many seconds of synthetic spiral-wave LFP instead of a file.")
+    parser.add_argument('--band', action='append', metavar='BAND',
+                        help="Only process this band (a FREQ_BANDS name, or 'raw'). Repeatable; default: all conditions.")
+    parser.add_argument('--threads', type=int, default=config.STREAM_NUM_THREADS,
+                        help="Conditions processed concurrently per block (default: STREAM_NUM_THREADS).")
+    parser.add_argument('--output-dir', help="Save the tracks of each condition here as tracks_<condition>.npz.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.synthetic:
+        from . import synthetic
+        lfp_data, _ = synthetic.generate_spiral_lfp(config.GRID_DIM, int(args.synthetic * config.FS), config.FS,
+                                                    background_bands=config.FREQ_BANDS, seed=0)
+    else:
+        try:
+            lfp_data = data_loader.open_lfp_data(args.input or config.MAT_FILE_PATH, args.variable_name or config.VARIABLE_NAME,
+                                                 num_expected_channels=config.GRID_DIM * config.GRID_DIM)
+            data_loader.verify_grid_compatibility(lfp_data.shape[0], config.GRID_DIM)
+        except (FileNotFoundError, KeyError, ValueError, ImportError) as e:
+            print(f"Error: {type(e).__name__}: {e}")
+            return 1
+    conditions = None
+    if args.band:
+        unknown = [band_name for band_name in args.band if band_name != 'raw' and band_name not in config.FREQ_BANDS]
+        if unknown:
+            print(f"Unknown band(s) {unknown}. Expected 'raw' or one of {list(config.FREQ_BANDS)}.")
+            return 1
+        conditions = [(False, None) if band_name == 'raw' else (True, band_name) for band_name in args.band]
+
+    engine = make_engine(config, lfp_data.shape[0], conditions, max(1, args.threads))
+    source = FileReplaySource(lfp_data, args.block_size, config.FS, realtime=args.realtime)
+    print(f"Streaming {lfp_data.shape[1]} samples in blocks of {args.block_size} ({len(engine.filters)} condition(s))...")
+    all_tracks = run_stream(source, engine)
+    for condition_key, track_store in all_tracks.items():
+        print(f"  {condition_key}: {len(track_store)} track segments")
+    print_latency_report(engine.latency_report())
+
+    if args.output_dir:
+        from .batch import band_file_label, condition_file_label
+        os.makedirs(args.output_dir, exist_ok=True)
+        band_labels = {band_name: band_file_label(band_name, band_idx) for band_idx, band_name in enumerate(config.FREQ_BANDS)}
+        for condition_key, track_store in all_tracks.items():
+            track_store.save_npz(os.path.join(args.output_dir, f'tracks_{condition_file_label(condition_key, band_labels)}.npz'),
+                                 compressed=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# src/synthetic.py
+# Synthetic spiral-wave LFP with known singularity trajectories, and scoring of detections/tracks against it.
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from .track_store import SPIRAL, ANTI_SPIRAL
+
+def generate_spiral_lfp(grid_dim=20, num_time_points=4000, fs=1000,
+                        spiral_freq=10.0, num_spirals=2, num_anti_spirals=2,
+                        speed=2.0, lifetime_range_s=(0.5, 2.0), core_radius=1.0,
+                        background_bands=None, background_amplitude=0.3, noise_std=0.2,
+                        seed=None, block_size=1000):
+    """
+    Generates (grid_dim^2 x num_time_points) LFP, channels in row-major grid order, containing a rotating
+    wave at spiral_freq whose phase winds by +2*pi around each spiral and -2*pi around each anti-spiral:
+        phase(r, c, t) = 2*pi*spiral_freq*t/fs + sum_k polarity_k * atan2(r - r_k(t), c - c_k(t))
+    Amplitude vanishes towards each core (tanh(distance / core_radius)). Each singularity is born and
+    dies at random frames and drifts at `speed` grid units per second, reflecting off the array border.
+    background_bands ({name: (low, high)}) add plane waves at the band centres, plus white noise.
+    Returns (lfp, ground_truth) with ground_truth:
+        'positions_rc': (K, T, 2) native-grid (row, col), NaN outside the singularity's lifetime
+        'types': (K,) SPIRAL / ANTI_SPIRAL, 'birth_frames' / 'death_frames': (K,) (death exclusive)
+        plus the generation parameters.
+    """
+    rng = np.random.default_rng(seed)
+    num_singularities = num_spirals + num_anti_spirals
+    types = np.array([SPIRAL] * num_spirals + [ANTI_SPIRAL] * num_anti_spirals, dtype=np.int8)
+
+    # Lifetimes and trajectories
+    min_life, max_life = (int(seconds * fs) for seconds in lifetime_range_s)
+    lifetimes = rng.integers(min(min_life, num_time_points), min(max_life, num_time_points) + 1, size=num_singularities)
+    birth_frames = rng.integers(0, num_time_points - lifetimes + 1)
+    death_frames = birth_frames + lifetimes
+    low, high = 1.5, grid_dim - 2.5 # Keep cores inside the array so every plaquette around them exists
+    start_rc = rng.uniform(low, high, size=(num_singularities, 2))
+    headings = rng.uniform(0, 2 * np.pi, size=num_singularities)
+    velocity_rc = speed / fs * np.stack((np.sin(headings), np.cos(headings)), axis=1) # grid units per frame
+    frames = np.arange(num_time_points)
+    positions_rc = start_rc[:, None, :] + (frames[None, :, None] - birth_frames[:, None, None]) * velocity_rc[:, None, :]
+    positions_rc = _reflect_into_range(positions_rc, low, high)
+    is_alive = (frames[None, :] >= birth_frames[:, None]) & (frames[None, :] < death_frames[:, None])
+    positions_rc[~is_alive] = np.nan
+
+    # Background plane waves (one per band, skipping the band carrying the spiral wave)
+    plane_waves = []
+    for low_freq, high_freq in (background_bands or {}).values():
+        if low_freq <= spiral_freq <= high_freq:
+            continue
+        direction = rng.uniform(0, 2 * np.pi)
+        wavenumber = rng.uniform(0.1, 0.5) # rad per grid unit
+        plane_waves.append(((low_freq + high_freq) / 2, wavenumber * np.cos(direction), wavenumber * np.sin(direction),
+                            rng.uniform(0, 2 * np.pi)))
+
+    grid_r, grid_c = np.divmod(np.arange(grid_dim * grid_dim), grid_dim) # Row-major channel order
+    polarities = np.where(types == SPIRAL, 1.0, -1.0)
+    lfp = np.empty((grid_dim * grid_dim, num_time_points))
+    for start in range(0, num_time_points, block_size):
+        t = frames[start:start + block_size]
+        phase = np.repeat(2 * np.pi * spiral_freq * t[:, None] / fs, grid_dim * grid_dim, axis=1) # (T_block, channels)
+        amplitude = np.ones_like(phase)
+        for k in range(num_singularities):
+            alive = is_alive[k, t]
+            if not alive.any():
+                continue
+            d_r = grid_r[None, :] - positions_rc[k, t[alive], 0][:, None]
+            d_c = grid_c[None, :] - positions_rc[k, t[alive], 1][:, None]
+            phase[alive] += polarities[k] * np.arctan2(d_r, d_c)
+            amplitude[alive] *= np.tanh(np.hypot(d_r, d_c) / core_radius)
+        block = amplitude * np.cos(phase)
+        for freq, k_r, k_c, phase_offset in plane_waves:
+            block += background_amplitude * np.cos(2 * np.pi * freq * t[:, None] / fs
+                                                   + k_r * grid_r[None, :] + k_c * grid_c[None, :] + phase_offset)
+        block += noise_std * rng.standard_normal(block.shape)
+        lfp[:, start:start + block_size] = block.T
+
+    ground_truth = {'positions_rc': positions_rc, 'types': types,
+                    'birth_frames': birth_frames, 'death_frames': death_frames,
+                    'grid_dim': grid_dim, 'fs': fs, 'spiral_freq': spiral_freq}
+    return lfp, ground_truth
+
+def _reflect_into_range(values, low, high):
+    """Folds unbounded coordinates back into [low, high] as if bouncing off the borders."""
+    span = high - low
+    folded = np.mod(values - low, 2 * span)
+    return low + np.where(folded > span, 2 * span - folded, folded)
+
+def zoomed_to_native(points_rc_zoomed, grid_dim, upsample_factor):
+    """
+    Converts detector/track coordinates (plaquette indices on the zoomed grid) to native grid units.
+    A plaquette (r, c) is centred on r + 0.5, and zooming maps native p to p * (zoomed_dim - 1) / (grid_dim - 1).
+    """
+    zoomed_dim = grid_dim * upsample_factor
+    return (np.asarray(points_rc_zoomed, dtype=np.float64) + 0.5) * (grid_dim - 1) / (zoomed_dim - 1)
+
+def match_points_to_ground_truth(ground_truth, frames, points_rc, types, match_radius=1.0):
+    """
+    Matches detected points (native-grid (row, col), with frames and types) one-to-one to the ground-truth
+    singularities of the same type alive in the same frame, within match_radius grid units.
+    Returns (matched ground-truth index per point or -1, distance per point or NaN).
+    """
+    frames, points_rc, types = np.asarray(frames), np.asarray(points_rc, dtype=np.float64).reshape((-1, 2)), np.asarray(types)
+    matched_truth = np.full(len(frames), -1, dtype=np.intp)
+    distances = np.full(len(frames), np.nan)
+    truth_positions, truth_types = ground_truth['positions_rc'], ground_truth['types']
+    order = np.lexsort((types, frames))
+    group_starts = np.flatnonzero(np.r_[True, (np.diff(frames[order]) != 0) | (np.diff(types[order]) != 0)])
+    for group_start, group_stop in zip(group_starts, np.r_[group_starts[1:], len(order)]):
+        point_indices = order[group_start:group_stop]
+        frame, point_type = frames[point_indices[0]], types[point_indices[0]]
+        candidates = np.flatnonzero((truth_types == point_type) & ~np.isnan(truth_positions[:, frame, 0]))
+        if len(candidates) == 0:
+            continue
+        dist = np.linalg.norm(points_rc[point_indices][:, None, :] - truth_positions[candidates, frame][None, :, :], axis=2)
+        rows, cols = linear_sum_assignment(np.where(dist <= match_radius, dist, 1e9))
+        accepted = dist[rows, cols] <= match_radius
+        matched_truth[point_indices[rows[accepted]]] = candidates[cols[accepted]]
+        distances[point_indices[rows[accepted]]] = dist[rows[accepted], cols[accepted]]
+    return matched_truth, distances
+
+def _frames_in_scope(ground_truth, exclude_edge_frames):
+    num_time_points = ground_truth['positions_rc'].shape[1]
+    return exclude_edge_frames, num_time_points - exclude_edge_frames
+
+def score_detections(ground_truth, frames, points_rc, types, match_radius=1.0, exclude_edge_frames=0):
+    """
+    Detection precision/recall/F1 and mean localization error (grid units) of native-grid detections.
+    exclude_edge_frames ignores that many frames at both ends (Hilbert transform edge effects).
+    """
+    first_frame, stop_frame = _frames_in_scope(ground_truth, exclude_edge_frames)
+    frames = np.asarray(frames)
+    in_scope = (frames >= first_frame) & (frames < stop_frame)
+    matched_truth, distances = match_points_to_ground_truth(ground_truth, frames[in_scope],
+                                                            np.asarray(points_rc).reshape((-1, 2))[in_scope],
+                                                            np.asarray(types)[in_scope], match_radius)
+    true_positives = int(np.sum(matched_truth >= 0))
+    false_positives = int(np.sum(matched_truth < 0))
+    num_truth = int(np.sum(~np.isnan(ground_truth['positions_rc'][:, first_frame:stop_frame, 0])))
+    false_negatives = num_truth - true_positives
+    precision = true_positives / max(1, true_positives + false_positives)
+    recall = true_positives / max(1, num_truth)
+    return {'true_positives': true_positives, 'false_positives': false_positives, 'false_negatives': false_negatives,
+            'precision': precision, 'recall': recall,
+            'f1': 2 * precision * recall / max(1e-12, precision + recall),
+            'mean_localization_error': float(np.nanmean(distances)) if true_positives else float('nan')}
+
+def score_tracks(ground_truth, track_store, grid_dim, upsample_factor, match_radius=1.0, exclude_edge_frames=0):
+    """
+    Tracking accuracy of a TrackStore against the ground truth. Per true singularity:
+        coverage: fraction of its lifetime covered by its single best-matching track
+        fragments: number of distinct tracks matched to it; id_switches: changes of matched track over time
+    plus the number of spurious tracks (fewer than half of their points match any true singularity).
+    Detection scores over all track points are included (tracks hold every detection).
+    """
+    first_frame, stop_frame = _frames_in_scope(ground_truth, exclude_edge_frames)
+    point_track_idx = np.repeat(np.arange(len(track_store)), track_store.track_lengths())
+    frames = np.asarray(track_store.time_indices)
+    in_scope = (frames >= first_frame) & (frames < stop_frame)
+    point_track_idx, frames = point_track_idx[in_scope], frames[in_scope]
+    points_rc = zoomed_to_native(track_store.points_rc_zoomed[in_scope], grid_dim, upsample_factor)
+    point_types = np.asarray(track_store.types)[point_track_idx]
+    matched_truth, _ = match_points_to_ground_truth(ground_truth, frames, points_rc, point_types, match_radius)
+
+    coverages, fragments, id_switches = [], [], 0
+    positions = ground_truth['positions_rc']
+    for truth_idx in range(len(ground_truth['types'])):
+        frames_alive = np.sum(~np.isnan(positions[truth_idx, first_frame:stop_frame, 0]))
+        if frames_alive == 0:
+            continue
+        is_match = matched_truth == truth_idx
+        matched_tracks = point_track_idx[is_match][np.argsort(frames[is_match], kind='stable')]
+        if len(matched_tracks) == 0:
+            coverages.append(0.0); fragments.append(0)
+            continue
+        coverages.append(np.bincount(matched_tracks).max() / frames_alive)
+        fragments.append(len(np.unique(matched_tracks)))
+        id_switches += int(np.sum(np.diff(matched_tracks) != 0))
+
+    matched_per_track = np.bincount(point_track_idx[matched_truth >= 0], minlength=len(track_store))
+    points_per_track = np.bincount(point_track_idx, minlength=len(track_store))
+    has_points = points_per_track > 0
+    spurious_tracks = int(np.sum(has_points & (matched_per_track < 0.5 * points_per_track)))
+
+    scores = score_detections(ground_truth, frames, points_rc, point_types, match_radius, exclude_edge_frames)
+    scores.update({'num_tracks': int(np.sum(has_points)), 'spurious_tracks': spurious_tracks,
+                   'mean_coverage': float(np.mean(coverages)) if coverages else float('nan'),
+                   'mean_fragments': float(np.mean(fragments)) if fragments else float('nan'),
+                   'id_switches': id_switches})
+    return scores
@@ -0,0 +1,150 @@
+# src/time_pyramid.py
+# Multi-resolution time pyramid of the band envelopes, for overview and scrubbing of long recordings.
+# Level k >= 1 of a band holds, per channel and bin of factor**k samples, the min / mean / max of the envelope
+# ((3, channels, bins) float32) plus the mean band power (envelope^2 averaged over channels and the bin).
+# Each level is built from the previous one a block at a time, so the envelope is read once and never has to
+# be resident; levels are written as .npy files and reopened memory-mapped. Level 0 is the envelope itself.
+# Each band has its own index file (<label>.json, written last), so bands can be built independently, e.g. on
+# demand by lazy_conditions. Bin sizes depend only on the recording length and settings (pyramid_bin_sizes).
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+from . import instrumentation
+
+PYRAMID_STATISTICS = ('min', 'mean', 'max')
+
+class EnvelopePyramid:
+    """
+    Memory-mapped pyramid of one band. levels[k - 1] = (bin_size, stats (3, channels, bins), power (bins,))
+    for level k; level 0 stands for the full-resolution envelope (bin size 1).
+    """
+    def __init__(self, num_time_points, levels):
+        self.num_time_points = num_time_points
+        self.levels = levels
+
+    @property
+    def num_levels(self):
+        return len(self.levels) + 1
+
+    def bin_size(self, level):
+        return 1 if level == 0 else self.levels[level - 1][0]
+
+    def level_for_window(self, window_length, max_steps):
+        return level_for_window([self.bin_size(level) for level in range(self.num_levels)], window_length, max_steps)
+
+    def frame_series(self, level, statistic='mean'):
+        """channels x bins series of one statistic at level >= 1."""
+        return self.levels[level - 1][1][PYRAMID_STATISTICS.index(statistic)]
+
+    def overview(self, max_points):
+        """(bin start times, mean band power) at the finest level with at most max_points bins."""
+        for bin_size, _, power in self.levels:
+            if len(power) <= max_points:
+                break
+        return np.arange(len(power)) * bin_size, np.asarray(power)
+
+def pyramid_bin_sizes(num_time_points, factor=4, min_bins=500):
+    """Bin sizes of levels 0, 1, ... of a pyramid over num_time_points samples (level 0 = 1 sample)."""
+    factor = max(2, int(factor))
+    bin_sizes, num_bins = [1], num_time_points
+    while True:
+        num_bins = -(-num_bins // factor)
+        bin_sizes.append(bin_sizes[-1] * factor)
+        if num_bins <= min_bins:
+            return bin_sizes
+
+def level_for_window(bin_sizes, window_length, max_steps):
+    """Finest level with at most max_steps bins in a window of window_length samples (the coarsest if none)."""
+    for level, bin_size in enumerate(bin_sizes):
+        if -(-window_length // bin_size) <= max_steps:
+            return level
+    return len(bin_sizes) - 1
+
+def _decimate(stats, power, counts, factor):
+    """Merges groups of `factor` bins: min of mins, count-weighted means, max of maxes. Returns (stats, power, counts)."""
+    bin_starts = np.arange(0, stats.shape[-1], factor)
+    merged_counts = np.add.reduceat(counts, bin_starts)
+    merged_stats = np.empty(stats.shape[:2] + (len(bin_starts),))
+    merged_stats[0] = np.minimum.reduceat(stats[0], bin_starts, axis=1)
+    merged_stats[1] = np.add.reduceat(stats[1] * counts, bin_starts, axis=1) / merged_counts
+    merged_stats[2] = np.maximum.reduceat(stats[2], bin_starts, axis=1)
+    merged_power = np.add.reduceat(power * counts, bin_starts) / merged_counts
+    return merged_stats, merged_power, merged_counts
+
+def build_envelope_pyramid(envelope, output_dir, label, factor=4, min_bins=500, block_size=65536):
+    """
+    Builds the levels of one channels x time envelope (ndarray or memory map) into output_dir as
+    <label>_L<k>.npy and <label>_L<k>_power.npy, adding levels until one has at most min_bins bins.
+    block_size bins of the previous level are processed per pass. Returns [(bin_size, stats_file, power_file)].
+    """
+    factor = max(2, int(factor))
+    block_size = max(factor, block_size - block_size % factor) # Bins must not straddle blocks
+    num_channels, num_time_points = envelope.shape
+    level_files, previous, previous_length, bin_size = [], None, num_time_points, 1
+    while True:
+        bin_size *= factor
+        num_bins = -(-previous_length // factor)
+        stats_file, power_file = f'{label}_L{len(level_files) + 1}.npy', f'{label}_L{len(level_files) + 1}_power.npy'
+        stats_out = open_memmap(os.path.join(output_dir, stats_file), mode='w+', dtype=np.float32,
+                                shape=(len(PYRAMID_STATISTICS), num_channels, num_bins))
+        power_out = open_memmap(os.path.join(output_dir, power_file), mode='w+', dtype=np.float64, shape=(num_bins,))
+        with instrumentation.span('pyramid.level', label=label, bin_size=bin_size):
+            for block_start in range(0, previous_length, block_size):
+                block_stop = min(block_start + block_size, previous_length)
+                if previous is None: # Level 1 from the envelope: every sample is its own min, mean and max
+                    block = np.asarray(envelope[:, block_start:block_stop], dtype=np.float64)
+                    stats, power, counts = np.broadcast_to(block, (3,) + block.shape), (block**2).mean(axis=0), np.ones(block.shape[1])
+                else:
+                    previous_stats, previous_power, previous_bin_size = previous
+                    stats = np.asarray(previous_stats[:, :, block_start:block_stop], dtype=np.float64)
+                    power = np.asarray(previous_power[block_start:block_stop])
+                    counts = np.minimum(previous_bin_size, num_time_points - np.arange(block_start, block_stop) * previous_bin_size)
+                stats, power, _ = _decimate(stats, power, counts.astype(np.float64), factor)
+                stats_out[:, :, block_start // factor:block_start // factor + stats.shape[-1]] = stats
+                power_out[block_start // factor:block_start // factor + len(power)] = power
+        stats_out.flush(); power_out.flush()
+        level_files.append((bin_size, stats_file, power_file))
+        previous, previous_length = (stats_out, power_out, bin_size), num_bins
+        if num_bins <= min_bins:
+            return level_files
+
+def load_band_pyramid(output_dir, label):
+    """Reopens the pyramid written by build_or_load_band_pyramid: (EnvelopePyramid, index record), or None."""
+    index_path = os.path.join(output_dir, f'{label}.json')
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, encoding='utf-8') as f:
+        index = json.load(f)
+    levels = [(bin_size, np.load(os.path.join(output_dir, stats_file), mmap_mode='r'),
+               np.load(os.path.join(output_dir, power_file), mmap_mode='r'))
+              for bin_size, stats_file, power_file in index['levels']]
+    return EnvelopePyramid(index['num_time_points'], levels), index
+
+def build_or_load_band_pyramid(envelope, output_dir, label, source_key, factor=4, min_bins=500, block_size=65536):
+    """
+    EnvelopePyramid of one channels x time envelope (read a block at a time), stored in output_dir under label.
+    A pyramid already there is reused when it was built from the same source_key (e.g. the pipeline's signal
+    stage key) and settings.
+    """
+    settings = {'source_key': source_key, 'factor': factor, 'min_bins': min_bins, 'num_time_points': envelope.shape[1]}
+    loaded = load_band_pyramid(output_dir, label)
+    if loaded is not None and loaded[1]['settings'] == settings:
+        return loaded[0]
+    os.makedirs(output_dir, exist_ok=True)
+    with instrumentation.span('pyramid.band', label=label):
+        levels = build_envelope_pyramid(envelope, output_dir, label, factor, min_bins, block_size)
+    with open(os.path.join(output_dir, f'{label}.json'), 'w', encoding='utf-8') as f: # Written last
+        json.dump({'settings': settings, 'num_time_points': envelope.shape[1], 'levels': levels}, f, indent=1)
+    print(f"  Envelope time pyramid {label}: {len(levels)} level(s), coarsest bin {levels[-1][0]} samples")
+    return load_band_pyramid(output_dir, label)[0]
+
+def build_or_load_pyramids(band_envelopes, output_dir, source_key, factor=4, min_bins=500, block_size=65536):
+    """{band: EnvelopePyramid} for every band of band_envelopes (see build_or_load_band_pyramid), in output_dir."""
+    print(f"Envelope time pyramids (factor {factor}) in {output_dir}...")
+    return {band_name: build_or_load_band_pyramid(envelope, output_dir, pyramid_label(band_idx), source_key,
+                                                  factor, min_bins, block_size)
+            for band_idx, (band_name, envelope) in enumerate(band_envelopes.items())}
+
+def pyramid_label(band_idx):
+    return f'band{band_idx}'
@@ -0,0 +1,117 @@
+# src/track_linking.py
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from .track_store import TrackStoreBuilder, SPIRAL, ANTI_SPIRAL
+
+LINKING_MODES = ('greedy', 'optimal') # greedy = original track-order matching, optimal = Hungarian
+KDTREE_MIN_PAIRS = 4096 # Use a KD-tree instead of the dense distance matrix above this many track x detection pairs
+
+def find_candidate_pairs(last_points_rc, detections_rc, max_track_distance_sq):
+    """
+    Finds all (track, detection) pairs within max_track_distance_sq.
+    Returns (track_indices, detection_indices, dist_sq) arrays.
+    """
+    last_points_rc = np.asarray(last_points_rc, dtype=np.float64).reshape((-1, 2))
+    detections_rc = np.asarray(detections_rc, dtype=np.float64).reshape((-1, 2))
+    if len(last_points_rc) == 0 or len(detections_rc) == 0:
+        empty_idx = np.empty(0, dtype=np.intp)
+        return empty_idx, empty_idx.copy(), np.empty(0)
+
+    if len(last_points_rc) * len(detections_rc) <= KDTREE_MIN_PAIRS:
+        dist_sq_matrix = ((last_points_rc[:, np.newaxis, :] - detections_rc[np.newaxis, :, :])**2).sum(axis=2)
+        track_indices, detection_indices = np.nonzero(dist_sq_matrix <= max_track_distance_sq)
+    else:
+        # Query slightly past the radius, then filter on exact squared distances as the dense path does
+        radius = np.sqrt(max_track_distance_sq) * (1 + 1e-9)
+        neighbour_lists = cKDTree(detections_rc).query_ball_point(last_points_rc, radius)
+        track_indices = np.repeat(np.arange(len(last_points_rc)), [len(n) for n in neighbour_lists])
+        detection_indices = np.fromiter((j for n in neighbour_lists for j in n), dtype=np.intp,
+                                        count=len(track_indices))
+    dist_sq = ((last_points_rc[track_indices] - detections_rc[detection_indices])**2).sum(axis=1)
+    within = dist_sq <= max_track_distance_sq
+    return track_indices[within], detection_indices[within], dist_sq[within]
+
+def _match_greedy(track_indices, detection_indices, dist_sq, num_tracks, num_detections):
+    """Each track, in order, takes its nearest still-unmatched detection (ties go to the lower index)."""
+    matches = np.full(num_tracks, -1, dtype=np.intp)
+    detection_taken = np.zeros(num_detections, dtype=bool)
+    order = np.lexsort((detection_indices, dist_sq, track_indices))
+    for track_idx, detection_idx in zip(track_indices[order].tolist(), detection_indices[order].tolist()):
+        if matches[track_idx] == -1 and not detection_taken[detection_idx]:
+            matches[track_idx] = detection_idx
+            detection_taken[detection_idx] = True
+    return matches
+
+def _match_optimal(track_indices, detection_indices, dist_sq, num_tracks, num_detections):
+    """Hungarian assignment: maximises the number of links, then minimises their total squared distance."""
+    matches = np.full(num_tracks, -1, dtype=np.intp)
+    if len(track_indices) == 0:
+        return matches
+    # Restrict the cost matrix to tracks and detections that have at least one candidate
+    rows, row_of_track = np.unique(track_indices, return_inverse=True)
+    cols, col_of_detection = np.unique(detection_indices, return_inverse=True)
+    infeasible_cost = (dist_sq.max() + 1) * (min(len(rows), len(cols)) + 1)
+    cost = np.full((len(rows), len(cols)), infeasible_cost)
+    cost[row_of_track, col_of_detection] = dist_sq
+    assigned_rows, assigned_cols = linear_sum_assignment(cost)
+    feasible = cost[assigned_rows, assigned_cols] < infeasible_cost
+    matches[rows[assigned_rows[feasible]]] = cols[assigned_cols[feasible]]
+    return matches
+
+def link_frame(last_points_rc, detections_rc, max_track_distance_sq, linking_mode='greedy'):
+    """
+    Matches the last points of active tracks to the detections of the next frame.
+    Returns an array with, for each track, the matched detection index or -1.
+    """
+    candidates = find_candidate_pairs(last_points_rc, detections_rc, max_track_distance_sq)
+    num_tracks, num_detections = len(last_points_rc), len(detections_rc)
+    if linking_mode == 'greedy':
+        return _match_greedy(*candidates, num_tracks, num_detections)
+    elif linking_mode == 'optimal':
+        return _match_optimal(*candidates, num_tracks, num_detections)
+    raise ValueError(f"Unknown linking mode '{linking_mode}'. Expected one of {LINKING_MODES}.")
+
+class TrackLinker:
+    """
+    Frame-by-frame linker shared by both polarities. Feed detections with step(),
+    then call finish() to get the TrackStore of all segments.
+    """
+    def __init__(self, max_track_distance_sq, linking_mode='greedy'):
+        if linking_mode not in LINKING_MODES:
+            raise ValueError(f"Unknown linking mode '{linking_mode}'. Expected one of {LINKING_MODES}.")
+        self.max_track_distance_sq = max_track_distance_sq
+        self.linking_mode = linking_mode
+        self.track_builder = TrackStoreBuilder()
+        empty_active = (np.empty(0, dtype=np.intp), np.empty((0, 2)))
+        self.active_tracks = {SPIRAL: empty_active, ANTI_SPIRAL: empty_active} # type -> (track_ids, last_points_rc)
+        self.num_tracks_opened = 0
+        self.num_tracks_closed = 0
+
+    def step(self, time_idx, spiral_rc, anti_spiral_rc):
+        """Links one frame's spiral and anti-spiral detections ((N, 2) row/col arrays)."""
+        self._advance(SPIRAL, time_idx, spiral_rc)
+        self._advance(ANTI_SPIRAL, time_idx, anti_spiral_rc)
+
+    def _advance(self, track_type, time_idx, detections_rc):
+        detections_rc = np.asarray(detections_rc).reshape((-1, 2))
+        active_ids, last_points_rc = self.active_tracks[track_type]
+        matches = link_frame(last_points_rc, detections_rc, self.max_track_distance_sq, self.linking_mode)
+
+        is_matched = matches >= 0
+        continued_ids, matched_detections = active_ids[is_matched], matches[is_matched]
+        self.track_builder.extend_tracks(continued_ids, time_idx, detections_rc[matched_detections])
+
+        detection_unmatched = np.ones(len(detections_rc), dtype=bool)
+        detection_unmatched[matched_detections] = False
+        new_ids = self.track_builder.open_tracks(track_type, time_idx, detections_rc[detection_unmatched])
+        self.num_tracks_opened += len(new_ids)
+        self.num_tracks_closed += len(active_ids) - len(continued_ids)
+
+        # Unmatched tracks end here; continued tracks keep their order ahead of the new ones
+        self.active_tracks[track_type] = (np.concatenate((continued_ids, new_ids)),
+                                          np.concatenate((detections_rc[matched_detections],
+                                                          detections_rc[detection_unmatched])))
+
+    def finish(self):
+        return self.track_builder.build()
@@ -1,20 +1,32 @@
 # src/track_management.py
 import numpy as np
-from collections import deque
-import uuid
-import time # For timing precomputation
-from .singularity_detection import detect_singularities, get_zoomed_phase_grid_from_series
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from . import instrumentation
+from .singularity_detection import detect_singularities_batch, detect_singularities_from_series
+from .track_linking import TrackLinker
+from .track_store import DetectionStore
 
-all_tracks_cache = {} # Global cache for fully computed track lists for different conditions
+all_tracks_cache = {} # Global cache of TrackStore objects for different conditions
+all_detections_cache = {} # DetectionStore per condition, for relinking with other parameters (see relink_sweep)
 
 def precompute_all_tracks_for_condition(full_phase_time_series, 
                                         condition_key_tuple,
                                         num_time_points, # Added num_time_points
                                         grid_dim, upsample_factor, interpolation_order, # for get_zoomed_phase_grid
                                         max_track_distance_sq, phase_tolerance, # for detection & matching
-                                        max_points_per_track_deque): # for deque
+                                        max_points_per_track_deque=None, # Deprecated and ignored
+                                        *,
+                                        detection_chunk_size=1000, # frames per vectorized detection pass
+                                        linking_mode='greedy', # 'greedy' or 'optimal' (Hungarian) frame-to-frame matching
+                                        detection_mode='upsampled', # 'upsampled' or 'native_subpixel'
+                                        zoomed_phase_volume=None): # optional precomputed (T, H, W) upsampled phase
     """
     Precomputes all track segments using a given full phase time series.
+    Returns a TrackStore holding the full trajectory of every segment; max_points_per_track_deque is kept
+    for existing positional callers only (the GUI limits drawn track length with MAX_POINTS_PER_TRACK_DEQUE).
+    If `zoomed_phase_volume` is given (e.g. from upsample_phase_series_to_memmap), frames are
+    read from it instead of being upsampled again ('upsampled' detection mode only).
     """
     global all_tracks_cache # Allow modification of the global cache
     
@@ -23,113 +35,152 @@ def precompute_all_tracks_for_condition(full_phase_time_series,
     #     print(f"  Tracks already in cache for {condition_key_tuple}. Returning cached.")
     #     return all_tracks_cache[condition_key_tuple]
 
-    print(f"\n--- Precomputing All Tracks for Condition: {condition_key_tuple} ---")
-    start_comp_time = time.time()
+    # Timing and segment counts are in the instrumentation summary (span 'tracks.condition', counter 'tracks_opened')
+    with instrumentation.span('tracks.condition', condition=repr(condition_key_tuple), num_time_points=num_time_points):
+        condition_detections = detect_condition_singularities(full_phase_time_series, num_time_points,
+                                                              grid_dim, upsample_factor, interpolation_order,
+                                                              phase_tolerance, detection_chunk_size, detection_mode,
+                                                              zoomed_phase_volume)
+        condition_specific_tracks = link_detections(condition_detections, max_track_distance_sq, linking_mode)
     
-    condition_specific_tracks = []
-    current_active_spirals = [] 
-    current_active_anti = []    
+    all_detections_cache[condition_key_tuple] = condition_detections
+    all_tracks_cache[condition_key_tuple] = condition_specific_tracks
+    return condition_specific_tracks
 
-    for t in range(num_time_points):
-        if t % 500 == 0 and t > 0: 
-            print(f"    Precomputing tracks at frame {t}/{num_time_points} for {condition_key_tuple}...")
-        
-        phase_grid_zoomed = get_zoomed_phase_grid_from_series(
-                                t, full_phase_time_series, grid_dim, 
-                                upsample_factor, interpolation_order
-                            )
-        s_t, a_t = detect_singularities(phase_grid_zoomed, phase_tolerance)
+def detect_condition_singularities(full_phase_time_series, num_time_points, grid_dim, upsample_factor, interpolation_order,
+                                   phase_tolerance, detection_chunk_size=1000, detection_mode='upsampled',
+                                   zoomed_phase_volume=None):
+    """Detects the singularities of every frame, a chunk of frames per vectorized pass. Returns a DetectionStore."""
+    chunks = []
+    for chunk_start in range(0, num_time_points, detection_chunk_size):
+        chunk_stop = min(chunk_start + detection_chunk_size, num_time_points)
+        with instrumentation.span('tracks.zoom_and_detect_chunk', start=chunk_start, stop=chunk_stop):
+            if zoomed_phase_volume is not None and detection_mode == 'upsampled':
+                s_rc, s_frames, a_rc, a_frames = detect_singularities_batch(
+                                                    zoomed_phase_volume[chunk_start:chunk_stop], phase_tolerance, detection_chunk_size)
+            else:
+                s_rc, s_frames, a_rc, a_frames = detect_singularities_from_series(
+                                                    chunk_start, chunk_stop, full_phase_time_series, grid_dim, upsample_factor,
+                                                    interpolation_order, phase_tolerance, detection_mode, detection_chunk_size)
+        instrumentation.count('spirals_detected', len(s_rc))
+        instrumentation.count('anti_spirals_detected', len(a_rc))
+        chunks.append((chunk_start, s_rc, s_frames, a_rc, a_frames))
+    return DetectionStore.from_chunks(chunks, num_time_points)
 
-        # Manage Spiral Tracks
-        newly_active_s = []; s_t_matched_status = [False] * len(s_t)
-        for track_dict in current_active_spirals:
-            last_r_z, last_c_z = track_dict['points_rc_zoomed'][-1]
-            best_match_idx = -1; min_dist_sq = float('inf')
-            for i, (curr_r_z, curr_c_z) in enumerate(s_t):
-                if not s_t_matched_status[i]:
-                    dist_sq = (curr_r_z - last_r_z)**2 + (curr_c_z - last_c_z)**2
-                    if dist_sq <= max_track_distance_sq:
-                        if dist_sq < min_dist_sq: min_dist_sq = dist_sq; best_match_idx = i
-            if best_match_idx != -1:
-                track_dict['points_rc_zoomed'].append(s_t[best_match_idx])
-                track_dict['time_indices'].append(t); track_dict['end_time'] = t
-                newly_active_s.append(track_dict); s_t_matched_status[best_match_idx] = True
-            else: condition_specific_tracks.append(track_dict) 
-        for i, pt_s in enumerate(s_t):
-            if not s_t_matched_status[i]:
-                newly_active_s.append({'id':uuid.uuid4(), 'type':'spiral', 
-                                     'points_rc_zoomed':deque([pt_s], maxlen=max_points_per_track_deque), 
-                                     'time_indices':deque([t], maxlen=max_points_per_track_deque),
-                                     'start_time':t, 'end_time':t})
-        current_active_spirals = newly_active_s
+def link_detections(detection_store, max_track_distance_sq, linking_mode='greedy'):
+    """Frame-by-frame linking of a DetectionStore into a TrackStore; adds progress to the instrumentation counters."""
+    track_linker = TrackLinker(max_track_distance_sq, linking_mode)
+    for t in range(detection_store.num_frames):
+        track_linker.step(t, *detection_store.frame_detections(t))
+    instrumentation.count('frames_processed', detection_store.num_frames)
+    instrumentation.count('tracks_opened', track_linker.num_tracks_opened)
+    num_still_active = sum(len(track_ids) for track_ids, _ in track_linker.active_tracks.values())
+    instrumentation.count('tracks_closed', track_linker.num_tracks_closed + num_still_active)
+    return track_linker.finish()
 
-        # Manage Anti-Spiral Tracks
-        newly_active_as = []; a_t_matched_status = [False] * len(a_t)
-        for track_dict in current_active_anti:
-            last_r_z, last_c_z = track_dict['points_rc_zoomed'][-1]
-            best_match_idx = -1; min_dist_sq = float('inf')
-            for i, (curr_r_z, curr_c_z) in enumerate(a_t):
-                if not a_t_matched_status[i]:
-                    dist_sq = (curr_r_z - last_r_z)**2 + (curr_c_z - last_c_z)**2
-                    if dist_sq <= max_track_distance_sq:
-                        if dist_sq < min_dist_sq: min_dist_sq = dist_sq; best_match_idx = i
-            if best_match_idx != -1:
-                track_dict['points_rc_zoomed'].append(a_t[best_match_idx])
-                track_dict['time_indices'].append(t); track_dict['end_time'] = t
-                newly_active_as.append(track_dict); a_t_matched_status[best_match_idx] = True
-            else: condition_specific_tracks.append(track_dict)
-        for i, pt_a in enumerate(a_t):
-            if not a_t_matched_status[i]:
-                newly_active_as.append({'id':uuid.uuid4(), 'type':'anti_spiral', 
-                                      'points_rc_zoomed':deque([pt_a], maxlen=max_points_per_track_deque), 
-                                      'time_indices':deque([t], maxlen=max_points_per_track_deque),
-                                      'start_time':t, 'end_time':t})
-        current_active_anti = newly_active_as
-    
-    condition_specific_tracks.extend(current_active_spirals)
-    condition_specific_tracks.extend(current_active_anti)
-    
-    all_tracks_cache[condition_key_tuple] = condition_specific_tracks
-    end_comp_time = time.time()
-    tdiff = end_comp_time - start_comp_time
-    print(f"--- Finished Precomputing Tracks for {condition_key_tuple}. Found {len(condition_specific_tracks)} segments. Took {tdiff:.2f}s ---")
-    return condition_specific_tracks
+def _precompute_tracks_from_shared_memory(shm_name, series_shape, series_dtype_str,
+                                          condition_key_tuple, precompute_kwargs, instrumentation_settings):
+    """Worker entry point: attaches to a phase series in shared memory and precomputes its tracks."""
+    recorder = instrumentation.configure(**instrumentation_settings)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        full_phase_time_series = np.ndarray(series_shape, dtype=np.dtype(series_dtype_str), buffer=shm.buf)
+        condition_tracks = precompute_all_tracks_for_condition(full_phase_time_series, condition_key_tuple,
+                                                               **precompute_kwargs)
+        del full_phase_time_series # Release the view before closing the shared block
+    finally:
+        shm.close()
+    return condition_key_tuple, condition_tracks, all_detections_cache.pop(condition_key_tuple), recorder.drain()
+
+def _precompute_tracks_from_npy_file(npy_path, condition_key_tuple, precompute_kwargs, instrumentation_settings):
+    """Worker entry point for phase series already on disk: memory-maps the .npy file and reads it block by block."""
+    recorder = instrumentation.configure(**instrumentation_settings)
+    full_phase_time_series = np.load(npy_path, mmap_mode='r')
+    condition_tracks = precompute_all_tracks_for_condition(full_phase_time_series, condition_key_tuple, **precompute_kwargs)
+    return condition_key_tuple, condition_tracks, all_detections_cache.pop(condition_key_tuple), recorder.drain()
+
+def _precompute_conditions_in_parallel(all_phase_series_cache_data, condition_keys, precompute_kwargs, num_workers):
+    """
+    Runs one worker process per condition. In-memory phase series are handed over through shared memory;
+    memory-mapped .npy series (chunked mode) are reopened by the worker from their file.
+    """
+    shared_blocks, npy_files = {}, {}
+    try:
+        for condition_key in condition_keys:
+            phase_series = all_phase_series_cache_data[condition_key]
+            if isinstance(phase_series, np.memmap) and phase_series.filename and phase_series.filename.endswith('.npy'):
+                npy_files[condition_key] = phase_series.filename
+                continue
+            phase_series = np.ascontiguousarray(phase_series)
+            shm = shared_memory.SharedMemory(create=True, size=max(phase_series.nbytes, 1))
+            np.ndarray(phase_series.shape, dtype=phase_series.dtype, buffer=shm.buf)[...] = phase_series
+            shared_blocks[condition_key] = (shm, phase_series.shape, phase_series.dtype.str)
+
+        results = {}
+        recorder = instrumentation.get_recorder() # Workers record with the same settings; events are merged back
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(condition_keys))) as executor:
+            futures = [executor.submit(_precompute_tracks_from_shared_memory, shm.name, shape, dtype_str,
+                                       condition_key, precompute_kwargs, recorder.settings())
+                       for condition_key, (shm, shape, dtype_str) in shared_blocks.items()]
+            futures += [executor.submit(_precompute_tracks_from_npy_file, npy_path, condition_key, precompute_kwargs,
+                                        recorder.settings())
+                        for condition_key, npy_path in npy_files.items()]
+            for future in as_completed(futures):
+                condition_key, condition_tracks, condition_detections, worker_instrumentation = future.result()
+                results[condition_key] = (condition_tracks, condition_detections)
+                recorder.merge(worker_instrumentation)
+    finally:
+        for shm, _, _ in shared_blocks.values():
+            shm.close(); shm.unlink()
+
+    for condition_key in condition_keys: # Merge in the same order as the serial path
+        all_tracks_cache[condition_key], all_detections_cache[condition_key] = results[condition_key]
 
 def perform_all_track_precomputations(all_phase_series_cache_data, freq_bands_config, 
                                       grid_dim_config, upsample_factor_config, 
                                       interpolation_order_config, max_track_distance_sq_config,
-                                      phase_tolerance_config, max_points_per_track_deque_config,
-                                      num_time_points_data): # Added num_time_points
-    """Main loop to call precompute_all_tracks_for_condition for all conditions."""
-    print("\n===== STARTING ALL TRACK PRECOMPUTATIONS (via track_management) =====")
-    start_total_precomp_time = time.time()
-    
-    # 1. For Raw LFP phase
-    raw_phase_key = (False, None)
-    if raw_phase_key in all_phase_series_cache_data:
-        precompute_all_tracks_for_condition(
-            all_phase_series_cache_data[raw_phase_key], raw_phase_key,
-            num_time_points_data, grid_dim_config, upsample_factor_config,
-            interpolation_order_config, max_track_distance_sq_config,
-            phase_tolerance_config, max_points_per_track_deque_config
-        )
-    else:
-        print(f"Error: Raw phase series not found in cache for key {raw_phase_key}")
+                                      phase_tolerance_config,
+                                      max_points_per_track_deque_config, # Deprecated and ignored
+                                      num_time_points_data, # Added num_time_points
+                                      *,
+                                      detection_chunk_size_config=1000,
+                                      linking_mode_config='greedy',
+                                      num_workers_config=1, # >1 runs conditions in parallel processes
+                                      detection_mode_config='upsampled'):
+    """
+    Main loop to call precompute_all_tracks_for_condition for all conditions.
+    max_points_per_track_deque_config is kept for existing callers; drawn track length is now limited by the
+    GUI (MAX_POINTS_PER_TRACK_DEQUE at draw time), not at precomputation.
+    """
+    with instrumentation.span('tracks.all_conditions', num_workers=num_workers_config):
+        _precompute_all_conditions(all_phase_series_cache_data, freq_bands_config, grid_dim_config,
+                                   upsample_factor_config, interpolation_order_config, max_track_distance_sq_config,
+                                   phase_tolerance_config, num_time_points_data, detection_chunk_size_config,
+                                   linking_mode_config, num_workers_config, detection_mode_config)
+    return all_tracks_cache # Return the populated cache
 
-    # 2. For each filtered band's phase
-    for band_name_iter in freq_bands_config.keys():
-        filtered_phase_key = (True, band_name_iter)
-        if filtered_phase_key in all_phase_series_cache_data:
-            precompute_all_tracks_for_condition(
-                all_phase_series_cache_data[filtered_phase_key], filtered_phase_key,
-                num_time_points_data, grid_dim_config, upsample_factor_config,
-                interpolation_order_config, max_track_distance_sq_config,
-                phase_tolerance_config, max_points_per_track_deque_config
-            )
+def _precompute_all_conditions(all_phase_series_cache_data, freq_bands_config, grid_dim_config, upsample_factor_config,
+                               interpolation_order_config, max_track_distance_sq_config, phase_tolerance_config,
+                               num_time_points_data, detection_chunk_size_config, linking_mode_config, num_workers_config,
+                               detection_mode_config):
+    # 1. Raw LFP phase, then 2. each filtered band's phase
+    condition_keys = []
+    for phase_key in [(False, None)] + [(True, band_name_iter) for band_name_iter in freq_bands_config.keys()]:
+        if phase_key in all_phase_series_cache_data:
+            condition_keys.append(phase_key)
         else:
-            print(f"Error: Filtered phase series not found in cache for key {filtered_phase_key}")
-            
-    end_total_precomp_time = time.time()
-    tdiff_total = end_total_precomp_time - start_total_precomp_time
-    print(f"===== ALL TRACK PRECOMPUTATIONS FINISHED in {tdiff_total:.2f}s (via track_management) =====")
-    return all_tracks_cache # Return the populated cache
\ No newline at end of file
+            print(f"Error: Phase series not found in cache for key {phase_key}")
+
+    precompute_kwargs = dict(num_time_points=num_time_points_data, grid_dim=grid_dim_config,
+                             upsample_factor=upsample_factor_config, interpolation_order=interpolation_order_config,
+                             max_track_distance_sq=max_track_distance_sq_config, phase_tolerance=phase_tolerance_config,
+                             detection_chunk_size=detection_chunk_size_config, linking_mode=linking_mode_config,
+                             detection_mode=detection_mode_config)
+    if num_workers_config and num_workers_config > 1 and len(condition_keys) > 1:
+        print(f"  Running {len(condition_keys)} conditions on up to {num_workers_config} worker processes...")
+        _precompute_conditions_in_parallel(all_phase_series_cache_data, condition_keys,
+                                           precompute_kwargs, num_workers_config)
+    else:
+        for phase_key in condition_keys:
+            precompute_all_tracks_for_condition(all_phase_series_cache_data[phase_key], phase_key,
+                                                **precompute_kwargs)
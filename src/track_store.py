@@ -0,0 +1,255 @@
+# src/track_store.py
+import numpy as np
+
+SPIRAL, ANTI_SPIRAL = 0, 1 # Values of the per-track type flag
+TRACK_TYPE_NAMES = ('spiral', 'anti_spiral')
+
+class TrackStore:
+    """
+    Array-backed collection of track segments for one condition.
+    Track i owns points_rc_zoomed[offsets[i]:offsets[i+1]] and the matching time_indices,
+    with full trajectories kept (no truncation). Per-track columns:
+        track_ids, types (SPIRAL / ANTI_SPIRAL), start_times, end_times
+    """
+    ARRAY_NAMES = ('track_ids', 'types', 'start_times', 'end_times',
+                   'offsets', 'points_rc_zoomed', 'time_indices')
+
+    def __init__(self, track_ids, types, start_times, end_times, offsets, points_rc_zoomed, time_indices):
+        self.track_ids = track_ids
+        self.types = types
+        self.start_times = start_times
+        self.end_times = end_times
+        self.offsets = offsets
+        self.points_rc_zoomed = points_rc_zoomed
+        self.time_indices = time_indices
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    @property
+    def num_points(self):
+        return len(self.time_indices)
+
+    def track_slice(self, track_idx):
+        return slice(self.offsets[track_idx], self.offsets[track_idx + 1])
+
+    def track_points(self, track_idx):
+        """Returns ((N, 2) row/col points, (N,) time indices) of one track."""
+        sl = self.track_slice(track_idx)
+        return self.points_rc_zoomed[sl], self.time_indices[sl]
+
+    def track_points_up_to(self, track_idx, time_idx, max_points=None):
+        """Returns the points of one track with time <= time_idx (at most the last `max_points`)."""
+        points_rc, time_indices = self.track_points(track_idx)
+        num_up_to = np.searchsorted(time_indices, time_idx, side='right')
+        first = 0 if max_points is None else max(0, num_up_to - max_points)
+        return points_rc[first:num_up_to]
+
+    def points_at(self, track_indices, time_idx):
+        """
+        Returns ((N, 2) row/col points, (N,) types) of the given tracks at time_idx, i.e. the singularities
+        detected in that frame. Tracks have one point per frame, so all given tracks must be active at time_idx.
+        """
+        track_indices = np.asarray(track_indices, dtype=np.intp)
+        point_indices = self.offsets[track_indices] + (time_idx - self.start_times[track_indices])
+        return self.points_rc_zoomed[point_indices], self.types[track_indices]
+
+    def track_lengths(self):
+        return np.diff(self.offsets)
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAY_NAMES}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(arrays[name] for name in cls.ARRAY_NAMES))
+
+    @classmethod
+    def empty(cls):
+        return TrackStoreBuilder().build()
+
+    def save_npz(self, filepath, compressed=False):
+        (np.savez_compressed if compressed else np.savez)(filepath, **self.to_arrays())
+
+    @classmethod
+    def load_npz(cls, filepath):
+        with np.load(filepath) as npz_contents:
+            return cls.from_arrays({name: npz_contents[name] for name in cls.ARRAY_NAMES})
+
+class DetectionStore:
+    """
+    Per-frame singularity detections of one condition, before linking: one row per detection with
+    frames, points_rc_zoomed (zoomed-grid row/col) and polarities (SPIRAL / ANTI_SPIRAL), sorted by frame.
+    The detections of frame t are rows frame_offsets[t]:frame_offsets[t+1]. Tracks for any linking
+    parameters can be rebuilt from it without repeating zoom and detection.
+    """
+    ARRAY_NAMES = ('frames', 'points_rc_zoomed', 'polarities', 'frame_offsets')
+
+    def __init__(self, frames, points_rc_zoomed, polarities, frame_offsets):
+        self.frames = frames
+        self.points_rc_zoomed = points_rc_zoomed
+        self.polarities = polarities
+        self.frame_offsets = frame_offsets
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def num_frames(self):
+        return len(self.frame_offsets) - 1
+
+    def frame_detections(self, time_idx):
+        """Returns ((N_s, 2) spiral, (N_a, 2) anti-spiral) row/col points of one frame."""
+        sl = slice(self.frame_offsets[time_idx], self.frame_offsets[time_idx + 1])
+        points_rc, polarities = self.points_rc_zoomed[sl], self.polarities[sl]
+        return points_rc[polarities == SPIRAL], points_rc[polarities == ANTI_SPIRAL]
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAY_NAMES}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(arrays[name] for name in cls.ARRAY_NAMES))
+
+    @classmethod
+    def from_chunks(cls, chunks, num_frames):
+        """
+        Builds the store from detect_singularities_batch-style chunks
+        [(first_frame, spiral_rc, spiral_frames, anti_rc, anti_frames), ...] (frames relative to first_frame).
+        """
+        frames = [np.empty(0, dtype=np.int32)]
+        points_rc = [np.empty((0, 2), dtype=np.float32)]
+        polarities = [np.empty(0, dtype=np.int8)]
+        for first_frame, s_rc, s_frames, a_rc, a_frames in chunks:
+            for rc, chunk_frames, polarity in ((s_rc, s_frames, SPIRAL), (a_rc, a_frames, ANTI_SPIRAL)):
+                frames.append(np.asarray(chunk_frames, dtype=np.int32) + first_frame)
+                points_rc.append(np.asarray(rc, dtype=np.float32).reshape((-1, 2)))
+                polarities.append(np.full(len(chunk_frames), polarity, dtype=np.int8))
+        frames = np.concatenate(frames)
+        order = np.argsort(frames, kind='stable') # Spirals before anti-spirals within a frame, in detector order
+        frame_offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        np.cumsum(np.bincount(frames, minlength=num_frames)[:num_frames], out=frame_offsets[1:])
+        return cls(frames[order], np.concatenate(points_rc)[order], np.concatenate(polarities)[order], frame_offsets)
+
+    def save_npz(self, filepath, compressed=False):
+        (np.savez_compressed if compressed else np.savez)(filepath, **self.to_arrays())
+
+    @classmethod
+    def load_npz(cls, filepath):
+        with np.load(filepath) as npz_contents:
+            return cls.from_arrays({name: npz_contents[name] for name in cls.ARRAY_NAMES})
+
+def save_trial_stores(filepath, stores, compressed=True):
+    """Writes one TrackStore or DetectionStore per trial into a single .npz (arrays prefixed 'trial<i>_')."""
+    arrays = {'num_trials': np.array(len(stores))}
+    for trial_idx, store in enumerate(stores):
+        arrays.update({f'trial{trial_idx}_{name}': array for name, array in store.to_arrays().items()})
+    (np.savez_compressed if compressed else np.savez)(filepath, **arrays)
+
+def load_trial_stores(filepath, store_class=TrackStore):
+    """Reads the per-trial list written by save_trial_stores."""
+    with np.load(filepath) as npz_contents:
+        return [store_class.from_arrays({name: npz_contents[f'trial{trial_idx}_{name}'] for name in store_class.ARRAY_NAMES})
+                for trial_idx in range(int(npz_contents['num_trials']))]
+
+class _GrowableColumn:
+    """Append-only numpy column (rows of row_shape) whose capacity doubles when full."""
+    def __init__(self, dtype, row_shape=(), initial_capacity=1024):
+        self._data = np.empty((initial_capacity,) + row_shape, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype).reshape((-1,) + self._data.shape[1:])
+        new_size = self._size + len(values)
+        if new_size > len(self._data):
+            grown = np.empty((max(new_size, 2 * len(self._data)),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:new_size] = values
+        self._size = new_size
+
+    def view(self):
+        return self._data[:self._size]
+
+class TrackStoreBuilder:
+    """
+    Accumulates track points during linking as flat per-point records in growable
+    numpy columns and groups them into a TrackStore once at the end.
+    """
+    def __init__(self):
+        self._point_track_ids = _GrowableColumn(np.int64)
+        self._point_times = _GrowableColumn(np.int32)
+        self._points_rc = _GrowableColumn(np.float32, (2,))
+        self._types = _GrowableColumn(np.int8)
+        self._start_times = _GrowableColumn(np.int32)
+        self._end_times = _GrowableColumn(np.int32)
+
+    def __len__(self):
+        return len(self._types)
+
+    def open_tracks(self, track_type, time_idx, points_rc):
+        """Starts one new track per row of points_rc and returns their IDs."""
+        first_id, num_new = len(self._types), len(points_rc)
+        self._types.extend(np.full(num_new, track_type))
+        self._start_times.extend(np.full(num_new, time_idx))
+        self._end_times.extend(np.full(num_new, time_idx))
+        new_ids = np.arange(first_id, first_id + num_new)
+        self._add_points(new_ids, time_idx, points_rc)
+        return new_ids
+
+    def extend_tracks(self, track_ids, time_idx, points_rc):
+        """Appends one point at time_idx to each of the given tracks."""
+        self._end_times.view()[track_ids] = time_idx
+        self._add_points(track_ids, time_idx, points_rc)
+
+    def _add_points(self, track_ids, time_idx, points_rc):
+        self._point_track_ids.extend(track_ids)
+        self._point_times.extend(np.full(len(track_ids), time_idx))
+        self._points_rc.extend(points_rc)
+
+    def build(self):
+        num_tracks = len(self._types)
+        point_track_ids = self._point_track_ids.view()
+        order = np.argsort(point_track_ids, kind='stable') # Points of a track stay in time order
+        offsets = np.zeros(num_tracks + 1, dtype=np.int64)
+        np.cumsum(np.bincount(point_track_ids, minlength=num_tracks), out=offsets[1:])
+        return TrackStore(track_ids=np.arange(num_tracks, dtype=np.int32),
+                          types=self._types.view().copy(),
+                          start_times=self._start_times.view().copy(),
+                          end_times=self._end_times.view().copy(),
+                          offsets=offsets,
+                          points_rc_zoomed=self._points_rc.view()[order],
+                          time_indices=self._point_times.view()[order])
+
+class TrackIntervalIndex:
+    """
+    Time-bucketed interval index over the [start_time, end_time] spans of a TrackStore.
+    Each track is registered in every bucket of `bucket_size` frames it overlaps, so the
+    tracks active at t are found by scanning a single bucket instead of every track.
+    """
+    def __init__(self, track_store, bucket_size=256):
+        self.bucket_size = int(bucket_size)
+        self.start_times = np.asarray(track_store.start_times)
+        self.end_times = np.asarray(track_store.end_times)
+        first_buckets = self.start_times // self.bucket_size
+        buckets_per_track = self.end_times // self.bucket_size - first_buckets + 1
+        track_entries = np.repeat(np.arange(len(self.start_times)), buckets_per_track)
+        entry_offsets = np.repeat(np.cumsum(buckets_per_track) - buckets_per_track, buckets_per_track)
+        bucket_entries = first_buckets[track_entries] + (np.arange(len(track_entries)) - entry_offsets)
+        order = np.argsort(bucket_entries, kind='stable') # Tracks stay in index order within a bucket
+        self.bucket_track_indices = track_entries[order]
+        num_buckets = int(bucket_entries.max()) + 1 if len(bucket_entries) else 0
+        self.bucket_offsets = np.zeros(num_buckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(bucket_entries, minlength=num_buckets), out=self.bucket_offsets[1:])
+
+    def active_at(self, time_idx):
+        """Returns the indices of tracks with start_time <= time_idx <= end_time, in ascending order."""
+        bucket = time_idx // self.bucket_size
+        if time_idx < 0 or bucket >= len(self.bucket_offsets) - 1:
+            return np.empty(0, dtype=np.intp)
+        candidates = self.bucket_track_indices[self.bucket_offsets[bucket]:self.bucket_offsets[bucket + 1]]
+        is_active = (self.start_times[candidates] <= time_idx) & (self.end_times[candidates] >= time_idx)
+        return candidates[is_active]
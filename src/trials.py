@@ -0,0 +1,249 @@
+# src/trials.py
+# Epoched (multi-trial) mode: python -m src.trials epochs.mat -o results/epochs -j 8 --gui
+# Input is trials x channels x time (see data_loader.open_lfp_trials). Trials are split into contiguous batches of
+# TRIAL_BATCH_SIZE and distributed over worker processes, each opening the input once and reading only the trials
+# of its batches (.npy is memory-mapped, MATLAB v7.3 is read through h5py). A worker filters its batch
+# with one batched filtfilt/hilbert call per band (filters are designed once per batch, not per trial), then
+# detects and links the singularities of every trial and condition. Outputs in the output directory:
+#   envelope_<band>.npy              trials x channels x time envelopes (memory-mapped, written by the workers)
+#   envelope_mean_<band>.npy         trial-averaged envelope, channels x time
+#   tracks_<raw|band>.npz            one TrackStore per trial (track_store.load_trial_stores)
+#   singularity_counts_<raw|band>.npy  trials x 2 x time spiral / anti-spiral counts per frame
+#   trials.json                      file index and summary, written last
+import os
+import sys
+import ast
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from numpy.lib.format import open_memmap
+from . import config
+from . import data_loader
+from . import instrumentation
+from . import signal_processing
+from .batch import band_file_label, condition_file_label, make_session_config
+from .track_management import detect_condition_singularities, link_detections
+from .track_store import TrackStore, SPIRAL, ANTI_SPIRAL, save_trial_stores, load_trial_stores
+
+TRIALS_RECORD_NAME = 'trials.json'
+
+_worker_trials = None # trials x channels x time input, opened once per worker process
+
+def open_trial_source(trial_source, cfg):
+    """trial_source is an input file path (opened with cfg.VARIABLE_NAME / TRIAL_LAYOUT) or a trials x channels x time array."""
+    if isinstance(trial_source, str):
+        return data_loader.open_lfp_trials(trial_source, cfg.VARIABLE_NAME, cfg.GRID_DIM * cfg.GRID_DIM, cfg.TRIAL_LAYOUT)
+    return trial_source
+
+def _init_worker(trial_source, cfg, instrumentation_settings):
+    global _worker_trials
+    instrumentation.configure(**instrumentation_settings)
+    _worker_trials = open_trial_source(trial_source, cfg)
+
+def singularity_counts(detection_store):
+    """2 x time spiral / anti-spiral counts per frame of a DetectionStore."""
+    return np.stack([np.bincount(detection_store.frames[detection_store.polarities == polarity],
+                                 minlength=detection_store.num_frames)
+                     for polarity in (SPIRAL, ANTI_SPIRAL)]).astype(np.int32)
+
+def process_trial_batch(batch_start, batch_stop, cfg, envelope_paths):
+    """
+    Worker task for trials batch_start:batch_stop: batched envelopes/phases, written into the envelope
+    memory maps, then per-trial detection and linking for every condition.
+    Returns (batch_start, {condition: [TrackStore per trial]}, {condition: trials x 2 x time counts},
+             {band: envelope sum over the batch's trials}, instrumentation events).
+    """
+    with instrumentation.span('trials.batch', start=batch_start, stop=batch_stop):
+        lfp_block = np.asarray(_worker_trials[batch_start:batch_stop], dtype=np.float64)
+        num_time_points = lfp_block.shape[-1]
+        band_envelopes, all_phase_series = signal_processing.compute_envelopes_and_phases(
+                                                lfp_block, cfg.FREQ_BANDS, cfg.FS, cfg.FILTER_ORDER,
+                                                cfg.SIGNAL_PROCESSING_METHOD,
+                                                cfg.ENVELOPE_STORAGE_DTYPE,
+                                                cfg.PHASE_STORAGE_DTYPE)
+        del lfp_block
+        envelope_sums = {}
+        for band_name, envelopes in band_envelopes.items():
+            envelope_output = np.load(envelope_paths[band_name], mmap_mode='r+')
+            envelope_output[batch_start:batch_stop] = envelopes
+            envelope_output.flush()
+            del envelope_output
+            envelope_sums[band_name] = envelopes.sum(axis=0, dtype=np.float64)
+        del band_envelopes
+
+        trial_tracks, trial_counts = {}, {}
+        for condition_key, phase_series in all_phase_series.items():
+            trial_tracks[condition_key], counts = [], []
+            for trial_phase_series in phase_series:
+                detection_store = detect_condition_singularities(trial_phase_series, num_time_points, cfg.GRID_DIM,
+                                                                 cfg.UPSAMPLE_FACTOR, cfg.INTERPOLATION_ORDER_ZOOM,
+                                                                 cfg.PHASE_TOLERANCE, cfg.SINGULARITY_DETECTION_CHUNK_SIZE,
+                                                                 cfg.SINGULARITY_DETECTION_MODE)
+                trial_tracks[condition_key].append(link_detections(detection_store, cfg.MAX_TRACK_DISTANCE_SQ,
+                                                                   cfg.TRACK_LINKING_MODE))
+                counts.append(singularity_counts(detection_store))
+            trial_counts[condition_key] = np.stack(counts)
+        instrumentation.count('trials_processed', batch_stop - batch_start)
+    return batch_start, trial_tracks, trial_counts, envelope_sums, instrumentation.get_recorder().drain()
+
+def run_trials(trial_source, output_dir, cfg, num_workers=1):
+    """
+    Processes every trial of trial_source (input path or trials x channels x time array) into output_dir
+    (see the module header) using num_workers processes. Returns the record written to trials.json.
+    """
+    global _worker_trials
+    start_time = time.time()
+    lfp_trials = open_trial_source(trial_source, cfg)
+    num_trials, num_channels, num_time_points = lfp_trials.shape
+    if num_channels != cfg.GRID_DIM * cfg.GRID_DIM:
+        raise ValueError(f"Number of channels ({num_channels}) does not match GRID_DIM^2 ({cfg.GRID_DIM * cfg.GRID_DIM}).")
+    if not isinstance(trial_source, str):
+        trial_source = lfp_trials # Handed to each worker once, by the pool initializer
+    else:
+        del lfp_trials # Workers open the file themselves
+    os.makedirs(output_dir, exist_ok=True)
+
+    band_labels = {band_name: band_file_label(band_name, band_idx) for band_idx, band_name in enumerate(cfg.FREQ_BANDS)}
+    files = {'envelopes': {}, 'envelope_means': {}, 'tracks': {}, 'singularity_counts': {}}
+    envelope_paths = {}
+    for band_name, label in band_labels.items():
+        files['envelopes'][band_name] = f'envelope_{label}.npy'
+        envelope_paths[band_name] = os.path.join(output_dir, files['envelopes'][band_name])
+        envelope_output = open_memmap(envelope_paths[band_name], mode='w+', dtype=cfg.ENVELOPE_STORAGE_DTYPE,
+                                      shape=(num_trials, num_channels, num_time_points))
+        del envelope_output # Workers reopen the file and fill their own trials
+
+    batches = [(batch_start, min(batch_start + cfg.TRIAL_BATCH_SIZE, num_trials))
+               for batch_start in range(0, num_trials, cfg.TRIAL_BATCH_SIZE)]
+    num_workers = max(1, min(num_workers, len(batches)))
+    print(f"===== TRIALS: {num_trials} trials x {num_channels} channels x {num_time_points} samples, "
+          f"{len(batches)} batch(es) on {num_workers} worker(s), output in {output_dir} =====")
+
+    recorder = instrumentation.get_recorder()
+    batch_results = []
+    def _report(result):
+        batch_results.append(result)
+        batch_start, trial_tracks, _, _, worker_instrumentation = result
+        recorder.merge(worker_instrumentation)
+        num_batch_trials = len(next(iter(trial_tracks.values())))
+        print(f"  [{len(batch_results)}/{len(batches)}] trials {batch_start}-{batch_start + num_batch_trials - 1} done "
+              f"({time.time() - start_time:.1f}s)")
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                 initargs=(trial_source, cfg, recorder.settings())) as executor:
+            futures = [executor.submit(process_trial_batch, batch_start, batch_stop, cfg, envelope_paths)
+                       for batch_start, batch_stop in batches]
+            for future in as_completed(futures):
+                _report(future.result())
+    else:
+        _worker_trials = open_trial_source(trial_source, cfg)
+        try:
+            for batch_start, batch_stop in batches:
+                _report(process_trial_batch(batch_start, batch_stop, cfg, envelope_paths))
+        finally:
+            _worker_trials = None
+
+    # Trial-aggregated outputs, assembled in trial order
+    batch_results.sort(key=lambda result: result[0])
+    all_trial_tracks, all_trial_counts, envelope_sums = {}, {}, {}
+    for _, trial_tracks, trial_counts, batch_envelope_sums, _ in batch_results:
+        for condition_key, track_stores in trial_tracks.items():
+            all_trial_tracks.setdefault(condition_key, []).extend(track_stores)
+            all_trial_counts.setdefault(condition_key, []).append(trial_counts[condition_key])
+        for band_name, envelope_sum in batch_envelope_sums.items():
+            envelope_sums[band_name] = envelope_sums.get(band_name, 0) + envelope_sum
+    for band_name, envelope_sum in envelope_sums.items():
+        files['envelope_means'][band_name] = f'envelope_mean_{band_labels[band_name]}.npy'
+        np.save(os.path.join(output_dir, files['envelope_means'][band_name]),
+                (envelope_sum / num_trials).astype(cfg.ENVELOPE_STORAGE_DTYPE))
+    for condition_key, track_stores in all_trial_tracks.items():
+        condition_label = condition_file_label(condition_key, band_labels)
+        files['tracks'][repr(condition_key)] = f'tracks_{condition_label}.npz'
+        save_trial_stores(os.path.join(output_dir, files['tracks'][repr(condition_key)]), track_stores)
+        files['singularity_counts'][repr(condition_key)] = f'singularity_counts_{condition_label}.npy'
+        np.save(os.path.join(output_dir, files['singularity_counts'][repr(condition_key)]),
+                np.concatenate(all_trial_counts[condition_key]))
+
+    record = {'input': trial_source if isinstance(trial_source, str) else None, 'status': 'done',
+              'num_trials': num_trials, 'num_channels': num_channels, 'num_time_points': num_time_points,
+              'files': files, 'seconds': time.time() - start_time,
+              'mean_tracks_per_trial': {repr(condition_key): float(np.mean([len(store) for store in track_stores]))
+                                        for condition_key, track_stores in all_trial_tracks.items()}}
+    with open(os.path.join(output_dir, TRIALS_RECORD_NAME), 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+    print(f"===== TRIALS FINISHED in {record['seconds']:.1f}s =====")
+    for condition_key, mean_tracks in record['mean_tracks_per_trial'].items():
+        print(f"  {condition_key:<24} {mean_tracks:>9.1f} tracks per trial")
+    return record
+
+class TrialResults:
+    """
+    The outputs of run_trials reopened from output_dir, in the form the GUI's trial selector reads:
+    per-trial envelopes are memory-mapped (a trial is read when viewed), per-trial tracks are loaded.
+    """
+    def __init__(self, output_dir):
+        with open(os.path.join(output_dir, TRIALS_RECORD_NAME), encoding='utf-8') as f:
+            record = json.load(f)
+        files = record['files']
+        self.num_trials = record['num_trials']
+        self.num_time_points = record['num_time_points']
+        self.envelopes = {band_name: np.load(os.path.join(output_dir, filename), mmap_mode='r')
+                          for band_name, filename in files['envelopes'].items()}
+        self.mean_envelopes = {band_name: np.load(os.path.join(output_dir, filename), mmap_mode='r')
+                               for band_name, filename in files['envelope_means'].items()}
+        self.tracks = {ast.literal_eval(key): load_trial_stores(os.path.join(output_dir, filename))
+                       for key, filename in files['tracks'].items()}
+        self.singularity_counts = {ast.literal_eval(key): np.load(os.path.join(output_dir, filename), mmap_mode='r')
+                                   for key, filename in files['singularity_counts'].items()}
+
+    def trial_envelopes(self, trial_idx):
+        return {band_name: envelopes[trial_idx] for band_name, envelopes in self.envelopes.items()}
+
+    def trial_tracks(self, trial_idx):
+        return {condition_key: track_stores[trial_idx] for condition_key, track_stores in self.tracks.items()}
+
+    def average_tracks(self):
+        """Singularities of different trials are not linked, so the trial average has no tracks."""
+        return {condition_key: TrackStore.empty() for condition_key in self.tracks}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.trials',
+                                     description="Envelopes and per-trial singularity tracks of epoched (trials x channels x time) LFP.")
+    parser.add_argument('input', help="Epoched .mat/.npy file, or an output directory of an earlier run (with --gui).")
+    parser.add_argument('-o', '--output-dir', help="Output directory (required unless input is one).")
+    parser.add_argument('-j', '--workers', type=int, default=config.TRIAL_NUM_WORKERS or os.cpu_count(),
+                        help="Trial batches processed in parallel (default: TRIAL_NUM_WORKERS, or all CPUs).")
+    parser.add_argument('--variable-name', help="MATLAB variable holding the LFP (default: VARIABLE_NAME).")
+    parser.add_argument('--layout', help="Stored axis order, e.g. trials_channels_time (default: TRIAL_LAYOUT).")
+    parser.add_argument('--gui', action='store_true', help="Open the results in the GUI with a trial selector.")
+    args = parser.parse_args(argv)
+
+    output_dir = args.output_dir
+    if os.path.isdir(args.input) and os.path.exists(os.path.join(args.input, TRIALS_RECORD_NAME)):
+        output_dir = args.input
+    elif output_dir is None:
+        parser.error("--output-dir is required to process an input file.")
+    else:
+        overrides = {name: value for name, value in (('VARIABLE_NAME', args.variable_name), ('TRIAL_LAYOUT', args.layout))
+                     if value}
+        cfg = make_session_config(overrides)
+        instrumentation.configure_from_config(cfg)
+        try:
+            run_trials(os.path.abspath(args.input), output_dir, cfg, max(1, args.workers))
+        except (FileNotFoundError, KeyError, ValueError, ImportError) as e:
+            print(f"Error: {type(e).__name__}: {e}")
+            return 1
+        instrumentation.get_recorder().print_summary()
+
+    if args.gui:
+        from . import visualization
+        trial_results = TrialResults(output_dir)
+        visualization.launch_gui(trial_results.trial_envelopes(0), {}, trial_results.trial_tracks(0), config,
+                                 trial_results.num_time_points, trial_results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
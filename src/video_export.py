@@ -0,0 +1,227 @@
+# src/video_export.py
+# Headless movie export: python -m src.video_export results/session1 --band "Sigma (σ)" --filter-phase -o sigma.mp4 -j 8
+# Renders what the GUI shows for one band and filter-phase condition (envelope image, spiral/anti-spiral
+# markers and track lines) over a time range. Frame ranges are rendered in worker processes into MP4 segments
+# (joined with ffmpeg's concat demuxer, no re-encoding) or into one numbered PNG sequence. Inputs are the
+# precomputed outputs of src.batch (or pipeline results in memory): envelopes are zoomed a block at a time,
+# markers come from the stored detections (or the track points) and lines from the tracks; nothing is re-detected.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from matplotlib import animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from . import config
+from .batch import SESSION_RECORD_NAME, band_file_label, condition_file_label, make_session_config
+from .track_store import TrackStore, DetectionStore, TrackIntervalIndex, SPIRAL
+from .visualization import (UpsampledFrameCache, create_frame_artists, envelope_clim, points_to_display_offsets,
+                            track_segments_at)
+
+EXPORT_FORMATS = ('mp4', 'png')
+PNG_FRAME_PATTERN = 'frame_{:06d}.png'
+
+def load_session_sources(session_dir, band_name, filter_phase):
+    """
+    {'band_name', 'envelope', 'tracks', 'detections'} file paths of one condition in a src.batch session directory.
+    band_name may also be the band's file label (e.g. 'sigma'). Detections are None for sessions written without them.
+    """
+    record_path = os.path.join(session_dir, SESSION_RECORD_NAME)
+    if not os.path.exists(record_path):
+        raise FileNotFoundError(f"{record_path} not found; export needs a finished src.batch session directory.")
+    with open(record_path, encoding='utf-8') as f:
+        files = json.load(f)['files']
+    band_labels = {name: band_file_label(name, band_idx) for band_idx, name in enumerate(files['envelopes'])}
+    matching_bands = [name for name, label in band_labels.items() if band_name in (name, label)]
+    if not matching_bands:
+        raise ValueError(f"Band '{band_name}' not found in {session_dir}. Available: {list(band_labels)}.")
+    band_name = matching_bands[0]
+    condition_key = (filter_phase, band_name if filter_phase else None)
+    tracks_file = files['tracks'].get(repr(condition_key))
+    if tracks_file is None or not tracks_file.endswith('.npz'):
+        raise ValueError(f"No per-condition tracks_{condition_file_label(condition_key, band_labels)}.npz in "
+                         f"{session_dir} (export needs sessions written with --track-format npz).")
+    detections_file = files.get('detections', {}).get(repr(condition_key))
+    return {'band_name': band_name,
+            'envelope': os.path.join(session_dir, files['envelopes'][band_name]),
+            'tracks': os.path.join(session_dir, tracks_file),
+            'detections': os.path.join(session_dir, detections_file) if detections_file else None}
+
+def _load_sources(sources):
+    """Opens file sources (envelopes memory-mapped, so a worker only reads its own frame range); objects pass through."""
+    envelope, tracks, detections = sources['envelope'], sources['tracks'], sources.get('detections')
+    if isinstance(envelope, str):
+        envelope = np.load(envelope, mmap_mode='r')
+    if isinstance(tracks, str):
+        tracks = TrackStore.load_npz(tracks)
+    if isinstance(detections, str):
+        detections = DetectionStore.load_npz(detections)
+    return envelope, tracks, detections
+
+def split_time_range(time_indices, num_segments):
+    """Contiguous, near-equal segments of time_indices (fewer when there are fewer frames than segments)."""
+    return [segment for segment in np.array_split(np.asarray(time_indices), max(1, num_segments)) if len(segment)]
+
+def render_segment(sources, cfg, time_indices, first_frame_number, output_format, output_path,
+                   show_singularities=True, show_tracks=True):
+    """
+    Renders the frames of time_indices (one worker's range) into output_path: an MP4 segment, or for 'png'
+    a directory receiving PNG_FRAME_PATTERN files numbered from first_frame_number. Returns (frames, seconds).
+    """
+    start_time = time.perf_counter()
+    envelope, tracks, detections = _load_sources(sources)
+    band_name = sources['band_name']
+    frame_cache = UpsampledFrameCache(cfg.GRID_DIM, cfg.UPSAMPLE_FACTOR, cfg.INTERPOLATION_ORDER_ZOOM,
+                                      cfg.GUI_FRAME_CACHE_BLOCK_SIZE, max_blocks=2) # Frames are visited in order
+    interval_index = TrackIntervalIndex(tracks)
+
+    fig = Figure(figsize=cfg.VIDEO_EXPORT_FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    first_frame = frame_cache.frame(band_name, envelope, int(time_indices[0]))[0]
+    img_display, _, spiral_scatter, anti_spiral_scatter, legend_singularities, track_line_collection = \
+        create_frame_artists(fig, ax, cfg, first_frame)
+    for artist in (spiral_scatter, anti_spiral_scatter, legend_singularities):
+        artist.set_visible(show_singularities)
+    track_line_collection.set_visible(show_tracks)
+
+    writer = None
+    if output_format == 'mp4':
+        writer = animation.FFMpegWriter(fps=cfg.VIDEO_EXPORT_FPS, bitrate=cfg.VIDEO_EXPORT_BITRATE)
+        writer.setup(fig, output_path, dpi=cfg.VIDEO_EXPORT_DPI)
+    try:
+        for frame_number, time_idx in enumerate(time_indices, start=first_frame_number):
+            time_idx = int(time_idx)
+            # Same drawing as update_plot_gui: envelope image, instantaneous markers, trailing track lines
+            zoomed_amp_data, min_amp, max_amp = frame_cache.frame(band_name, envelope, time_idx)
+            img_display.set_data(zoomed_amp_data)
+            img_display.set_clim(*envelope_clim(min_amp, max_amp))
+            if show_singularities:
+                if detections is not None:
+                    spiral_rc, anti_rc = detections.frame_detections(time_idx)
+                else: # Tracks hold every detected singularity (one point per frame)
+                    points_rc, types = tracks.points_at(interval_index.active_at(time_idx), time_idx)
+                    spiral_rc, anti_rc = points_rc[types == SPIRAL], points_rc[types != SPIRAL]
+                spiral_scatter.set_offsets(points_to_display_offsets(spiral_rc))
+                anti_spiral_scatter.set_offsets(points_to_display_offsets(anti_rc))
+            if show_tracks:
+                segments, segment_colors = track_segments_at(tracks, interval_index, time_idx, cfg)
+                track_line_collection.set_segments(segments)
+                track_line_collection.set_color(segment_colors)
+            ax.set_title(f'Amp: {band_name} @T: {time_idx}')
+            if writer is not None:
+                writer.grab_frame()
+            else:
+                fig.savefig(os.path.join(output_path, PNG_FRAME_PATTERN.format(frame_number)), dpi=cfg.VIDEO_EXPORT_DPI,
+                            pil_kwargs={'compress_level': 1}) # zlib at its default level dominates render time
+    finally:
+        if writer is not None:
+            writer.finish()
+    return len(time_indices), time.perf_counter() - start_time
+
+def concatenate_mp4_segments(segment_paths, output_path):
+    """Joins MP4 segments encoded with the same settings, without re-encoding (ffmpeg concat demuxer)."""
+    if len(segment_paths) == 1:
+        shutil.move(segment_paths[0], output_path)
+        return
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), 'segments.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.writelines(f"file '{os.path.abspath(path)}'\n" for path in segment_paths)
+    subprocess.run([animation.FFMpegWriter.bin_path(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                    '-i', list_path, '-c', 'copy', output_path], check=True)
+
+def export_video(sources, cfg, output_path, start_idx=0, stop_idx=None, time_step=1, output_format=None,
+                 num_workers=1, show_singularities=True, show_tracks=True):
+    """
+    Renders time points start_idx:stop_idx:time_step of one condition to output_path (an .mp4 file, or a
+    directory of PNG frames), splitting the range into one contiguous segment per worker.
+    sources: {'band_name', 'envelope', 'tracks', 'detections'} as paths (see load_session_sources) or in-memory
+    arrays/TrackStore/DetectionStore (these are pickled to each worker). cfg must be picklable
+    (batch.make_session_config). output_format defaults to 'mp4' for *.mp4 paths, else 'png'.
+    """
+    output_format = output_format or ('mp4' if output_path.lower().endswith('.mp4') else 'png')
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{output_format}'. Expected one of {EXPORT_FORMATS}.")
+    if output_format == 'mp4' and not animation.writers.is_available('ffmpeg'):
+        raise RuntimeError("MP4 export requires ffmpeg on the PATH (or rcParams['animation.ffmpeg_path']); "
+                           "export a PNG sequence instead.")
+    envelope, _, _ = _load_sources({'envelope': sources['envelope'], 'tracks': TrackStore.empty()})
+    if envelope.shape[0] != cfg.GRID_DIM * cfg.GRID_DIM:
+        raise ValueError(f"Envelope has {envelope.shape[0]} channels, but GRID_DIM^2 is {cfg.GRID_DIM * cfg.GRID_DIM}.")
+    time_indices = np.arange(start_idx, envelope.shape[1] if stop_idx is None else min(stop_idx, envelope.shape[1]),
+                             max(1, time_step))
+    if len(time_indices) == 0:
+        raise ValueError(f"Empty time range {start_idx}:{stop_idx} (recording has {envelope.shape[1]} time points).")
+    segments = split_time_range(time_indices, num_workers)
+    first_frame_numbers = np.cumsum([0] + [len(segment) for segment in segments[:-1]])
+    print(f"Exporting {len(time_indices)} frames of '{sources['band_name']}' ({output_format}) "
+          f"in {len(segments)} segment(s) to {output_path}...")
+
+    start_time = time.perf_counter()
+    segment_dir = None
+    if output_format == 'mp4':
+        segment_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+        segment_paths = [os.path.join(segment_dir, f'segment_{segment_idx:04d}.mp4') for segment_idx in range(len(segments))]
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        segment_paths = [output_path] * len(segments)
+    job_args = [(sources, cfg, segment, int(first_frame_number), output_format, segment_path,
+                 show_singularities, show_tracks)
+                for segment, first_frame_number, segment_path in zip(segments, first_frame_numbers, segment_paths)]
+    try:
+        if len(job_args) == 1:
+            num_frames, seconds = render_segment(*job_args[0])
+            print(f"  [1/1] {num_frames} frames in {seconds:.1f}s")
+        else:
+            with ProcessPoolExecutor(max_workers=len(job_args)) as executor:
+                futures = [executor.submit(render_segment, *args) for args in job_args]
+                for num_done, future in enumerate(as_completed(futures), start=1):
+                    num_frames, seconds = future.result()
+                    print(f"  [{num_done}/{len(futures)}] {num_frames} frames in {seconds:.1f}s")
+        if output_format == 'mp4':
+            concatenate_mp4_segments(segment_paths, output_path)
+    finally:
+        if segment_dir is not None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - start_time
+    print(f"Exported {len(time_indices)} frames in {elapsed:.1f}s ({len(time_indices) / max(elapsed, 1e-9):.1f} frames/s).")
+    return output_path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.video_export',
+                                     description="Render the GUI's envelope, singularity and track overlay to MP4 or PNG frames.")
+    parser.add_argument('session_dir', help="Session directory written by src.batch (tracks in npz format).")
+    parser.add_argument('-o', '--output', required=True, help="Output .mp4 file, or a directory for PNG frames.")
+    parser.add_argument('--band', default=list(config.FREQ_BANDS)[0], help="Band name or file label (e.g. sigma).")
+    parser.add_argument('--filter-phase', action='store_true',
+                        help="Use the band-filtered phase condition's detections and tracks (default: raw phase).")
+    parser.add_argument('--start', type=int, default=0, help="First time point.")
+    parser.add_argument('--stop', type=int, help="Time point after the last one (default: end of the recording).")
+    parser.add_argument('--step', type=int, default=config.VIDEO_EXPORT_TIME_STEP, help="Time points per frame.")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help="Default: mp4 for *.mp4 outputs, else png.")
+    parser.add_argument('--fps', type=float, default=config.VIDEO_EXPORT_FPS)
+    parser.add_argument('--dpi', type=float, default=config.VIDEO_EXPORT_DPI)
+    parser.add_argument('-j', '--workers', type=int, default=config.VIDEO_EXPORT_NUM_WORKERS or os.cpu_count(),
+                        help="Frame ranges rendered in parallel (default: VIDEO_EXPORT_NUM_WORKERS, or all CPUs).")
+    parser.add_argument('--no-singularities', action='store_true', help="Do not draw spiral/anti-spiral markers.")
+    parser.add_argument('--no-tracks', action='store_true', help="Do not draw track lines.")
+    args = parser.parse_args(argv)
+
+    cfg = make_session_config({'VIDEO_EXPORT_FPS': args.fps, 'VIDEO_EXPORT_DPI': args.dpi})
+    try:
+        sources = load_session_sources(args.session_dir, args.band, args.filter_phase)
+        export_video(sources, cfg, args.output, args.start, args.stop, args.step, args.format, max(1, args.workers),
+                     not args.no_singularities, not args.no_tracks)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
 # src/visualization.py
+import time
+from collections import OrderedDict, deque
 import matplotlib.pyplot as plt
-from matplotlib.widgets import Slider, RadioButtons, CheckButtons
+from matplotlib.widgets import Slider, RadioButtons, CheckButtons, Button, SpanSelector
+from matplotlib.collections import LineCollection
 import numpy as np
-from scipy.ndimage import zoom # For amplitude display
-from .singularity_detection import detect_singularities, get_zoomed_phase_grid_from_series # For instantaneous sings
+from .singularity_detection import detect_singularities_from_series, upsample_grid_frames # For instantaneous sings
+from .time_pyramid import pyramid_bin_sizes, level_for_window
+from .track_store import TrackStore, TrackIntervalIndex, SPIRAL
 
 # --- Global variables for GUI state and Matplotlib objects (can be refactored into a class) ---
 fig, ax = None, None
@@ -13,7 +17,11 @@ legend_singularities = None
 cbar = None
 
 time_slider, band_radio = None, None
+trial_slider, check_trial_average = None, None # Only created for epoched data (src.trials)
 check_singularities, check_filter_phase, check_show_tracks = None, None, None
+play_button, fps_text = None, None
+overview_ax, overview_power_line, overview_window_span, overview_time_line = None, None, None, None # Pyramid mode only
+overview_span_selector, zoom_out_button = None, None
 
 # Data holders (will be passed from main)
 config_module = None # To hold the config object/module
@@ -21,6 +29,10 @@ band_envelopes_data = None
 all_phase_series_data_cache = None # The full cache of raw and filtered phase series
 all_tracks_data_cache = None       # The full cache of precomputed tracks
 num_time_points_data = 0
+trial_results_data = None          # trials.TrialResults for epoched data, else None
+envelope_pyramids_data = None      # {band: time_pyramid.EnvelopePyramid} for long recordings, else None
+pyramid_level_bin_sizes = [1]      # Bin size per pyramid level (shared by all bands, known before any pyramid is built)
+overview_band_shown = None         # Band whose power curve the overview strip shows (None while pending)
 
 # View state
 current_selected_band_view = ""
@@ -28,17 +40,46 @@ current_display_time_idx_view = 0
 current_show_singularities_view = False
 current_filter_phase_view = False # For instantaneous singularity phase source
 current_show_tracks_view = False
-current_tracks_for_display_plot = [] # Tracks for the current (filter_phase, band) condition
-track_lines_plots_display = []       # Matplotlib Line2D objects for tracks
+current_trial_view, current_trial_average_view = 0, False
+current_view_window = (0, 0)         # [start, stop) time points spanned by the time slider
+current_pyramid_level = 0            # 0 = full-resolution frames; k >= 1 = pyramid bins of the visible window
+current_tracks_for_display_plot = TrackStore.empty() # Tracks for the current (filter_phase, band) condition
+current_track_interval_index = TrackIntervalIndex(current_tracks_for_display_plot)
+track_interval_indices = {}          # Per-condition TrackIntervalIndex, built when a condition's tracks are loaded
+track_line_collection = None         # Single reused LineCollection drawing all visible tracks
+computing_poll_timer = None          # Re-runs update_plot_gui while lazily computed data is pending
+COMPUTING_POLL_INTERVAL_MS = 300
+envelope_frame_cache = None          # UpsampledFrameCache of zoomed envelope frames and their min/max
 
-def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_time_points):
-    """Initializes and shows the Matplotlib GUI."""
+# Blitting and playback state
+blitting_active = False              # Time-dependent artists are animated and redrawn over a cached background
+blit_background = None
+playback_timer = None
+playback_active = False              # Real-time playback is running (the Play/Pause label follows it)
+playback_start_wall_time, playback_start_time_idx = 0.0, 0
+playback_frame_times = deque(maxlen=30) # Wall-clock times of recently rendered playback frames
+slider_dragging = False
+
+def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_time_points, _trial_results=None,
+               _envelope_pyramids=None):
+    """
+    Initializes and shows the Matplotlib GUI. For epoched data, _trial_results (trials.TrialResults) adds a
+    trial selector; the other data arguments then hold the initially shown trial (trial 0).
+    _envelope_pyramids ({band: time_pyramid.EnvelopePyramid}) adds an overview strip for zooming into long
+    recordings; wide windows are shown from the pyramid, full-resolution data only in short windows.
+    Like the other data arguments it may be a lazy provider (lazy_conditions.LazyConditionMapping).
+    """
     global fig, ax, img_display, spiral_scatter, anti_spiral_scatter, legend_singularities, cbar
     global time_slider, band_radio, check_singularities, check_filter_phase, check_show_tracks
+    global play_button, fps_text, envelope_frame_cache, playback_timer, playback_active, trial_slider, check_trial_average
     global config_module, band_envelopes_data, all_phase_series_data_cache, all_tracks_data_cache, num_time_points_data
+    global trial_results_data, current_trial_view, current_trial_average_view
+    global envelope_pyramids_data, current_view_window, current_pyramid_level, zoom_out_button, pyramid_level_bin_sizes
+    global overview_band_shown
     global current_selected_band_view, current_display_time_idx_view, \
            current_show_singularities_view, current_filter_phase_view, \
-           current_show_tracks_view, current_tracks_for_display_plot, track_lines_plots_display
+           current_show_tracks_view, current_tracks_for_display_plot, track_line_collection, \
+           track_interval_indices
 
 
     # Store passed data
@@ -47,11 +88,24 @@ def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_ti
     all_phase_series_data_cache = _all_phase_series
     all_tracks_data_cache = _all_tracks
     num_time_points_data = _num_time_points
-    track_lines_plots_display = []
+    trial_results_data = _trial_results
+    current_trial_view, current_trial_average_view = 0, False
+    playback_active = False
+    envelope_pyramids_data = _envelope_pyramids
+    if envelope_pyramids_data is not None:
+        pyramid_level_bin_sizes = pyramid_bin_sizes(num_time_points_data, config_module.TIME_PYRAMID_FACTOR,
+                                                    config_module.TIME_PYRAMID_MIN_BINS)
+    current_view_window, current_pyramid_level = (0, num_time_points_data), 0
+    overview_band_shown = None
+    track_interval_indices = {}
+    envelope_frame_cache = UpsampledFrameCache(config_module.GRID_DIM, config_module.UPSAMPLE_FACTOR,
+                                               config_module.INTERPOLATION_ORDER_ZOOM,
+                                               config_module.GUI_FRAME_CACHE_BLOCK_SIZE,
+                                               config_module.GUI_FRAME_CACHE_MAX_BLOCKS)
 
 
     fig, ax = plt.subplots(figsize=(10, 7))
-    plt.subplots_adjust(left=0.30, bottom=0.25, right=0.90, top=0.9)
+    plt.subplots_adjust(left=0.30, bottom=0.25 if envelope_pyramids_data is None else 0.32, right=0.90, top=0.9)
 
     # Initial state values for widgets and logic
     current_display_time_idx_view = config_module.INITIAL_TIME_IDX
@@ -60,19 +114,17 @@ def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_ti
     current_filter_phase_view = config_module.INITIAL_FILTER_PHASE_FOR_SINGULARITIES # For instantaneous sings
     current_show_tracks_view = config_module.INITIAL_SHOW_TRACKS
 
-    # Initial plot setup
-    initial_envelope_data = band_envelopes_data[current_selected_band_view][:, current_display_time_idx_view]
-    initial_env_grid_orig = initial_envelope_data.reshape((config_module.GRID_DIM, config_module.GRID_DIM))
-    initial_zoomed_env = zoom(initial_env_grid_orig, config_module.UPSAMPLE_FACTOR, order=config_module.INTERPOLATION_ORDER_ZOOM)
+    # Initial plot setup (blank until the envelope is available when data is computed lazily)
+    if request_condition(band_envelopes_data, current_selected_band_view):
+        initial_envelope_data = band_envelopes_data[current_selected_band_view][:, current_display_time_idx_view]
+    else:
+        initial_envelope_data = np.zeros(config_module.GRID_DIM * config_module.GRID_DIM)
+    initial_zoomed_env = upsample_grid_frames(initial_envelope_data, config_module.GRID_DIM, # Also handles float16 storage
+                                              config_module.UPSAMPLE_FACTOR, config_module.INTERPOLATION_ORDER_ZOOM)[0]
     
-    img_display = ax.imshow(initial_zoomed_env, cmap=config_module.AMPLITUDE_CMAP, vmin=0, interpolation='bilinear')
+    img_display, cbar, spiral_scatter, anti_spiral_scatter, legend_singularities, track_line_collection = \
+        create_frame_artists(fig, ax, config_module, initial_zoomed_env)
     ax.set_title(f'Amplitude: {current_selected_band_view} at Time: {current_display_time_idx_view}')
-    ax.set_xticks([]); ax.set_yticks([])
-    cbar = fig.colorbar(img_display, ax=ax, fraction=0.046, pad=0.04); cbar.set_label('Amp. Env.')
-    
-    spiral_scatter = ax.scatter([],[],s=config_module.SINGULARITY_MARKER_SIZE,facecolors='none',edgecolors=config_module.SINGULARITY_EDGE_COLOR,lw=1.5,label='Spirals', zorder=10)
-    anti_spiral_scatter = ax.scatter([],[],s=config_module.SINGULARITY_MARKER_SIZE,marker='x',c=config_module.SINGULARITY_ANTI_EDGE_COLOR,lw=1.5,label='Anti-spirals', zorder=10)
-    legend_singularities = ax.legend(handles=[spiral_scatter,anti_spiral_scatter],loc='upper left',fontsize='small',facecolor='gray',framealpha=0.5)
     legend_singularities.set_visible(current_show_singularities_view)
 
     # Controls
@@ -92,6 +144,24 @@ def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_ti
     
     ax_check_show_tracks = plt.axes([0.05,0.25,0.20,0.08]); 
     check_show_tracks = CheckButtons(ax_check_show_tracks, ['Show Tracks'], [current_show_tracks_view])
+
+    ax_play_button = plt.axes([0.05,0.09,0.20,0.05]);
+    play_button = Button(ax_play_button, playback_button_label())
+    fps_text = fig.text(0.30, 0.05, '', fontsize='small')
+    if trial_results_data is not None:
+        ax_slider_trial = plt.axes([0.30, 0.15, 0.55, 0.03])
+        trial_slider = Slider(ax_slider_trial, 'Trial', 0, trial_results_data.num_trials - 1, valinit=0, valstep=1)
+        ax_check_trial_average = plt.axes([0.05, 0.15, 0.20, 0.08])
+        check_trial_average = CheckButtons(ax_check_trial_average, ['Trial Average'], [False])
+        trial_slider.on_changed(lambda val: update_plot_gui("trial_slider"))
+        check_trial_average.on_clicked(lambda label: update_plot_gui("check_trial_average"))
+    if envelope_pyramids_data is not None:
+        create_overview_strip(plt.axes([0.30, 0.20, 0.55, 0.07]))
+        ax_zoom_out_button = plt.axes([0.05, 0.02, 0.20, 0.05])
+        zoom_out_button = Button(ax_zoom_out_button, 'Zoom Out')
+        zoom_out_button.on_clicked(lambda event: set_view_window(0, num_time_points_data))
+    playback_timer = fig.canvas.new_timer(interval=max(1, int(1000 / config_module.PLAYBACK_TARGET_FPS)))
+    playback_timer.add_callback(advance_playback)
     print("Plot and controls initialized by visualization module.")
 
     # Connect Callbacks
@@ -100,16 +170,23 @@ def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_ti
     check_singularities.on_clicked(lambda label: update_plot_gui("check_singularities"))
     check_filter_phase.on_clicked(lambda label: update_plot_gui("check_filter_phase")) # Affects instantaneous sings AND track set choice
     check_show_tracks.on_clicked(lambda label: update_plot_gui("check_show_tracks"))
+    play_button.on_clicked(lambda event: toggle_playback())
+    fig.canvas.mpl_connect('draw_event', on_canvas_draw)
+    fig.canvas.mpl_connect('button_press_event', on_mouse_press)
+    fig.canvas.mpl_connect('button_release_event', on_mouse_release)
     print("Widget callbacks connected by visualization module.")
 
     # Initial track set loading
     initial_track_cond_key = (current_filter_phase_view, 
                               current_selected_band_view if current_filter_phase_view else None)
-    if initial_track_cond_key in all_tracks_data_cache:
-        current_tracks_for_display_plot = all_tracks_data_cache[initial_track_cond_key]
-    else:
+    if initial_track_cond_key not in all_tracks_data_cache:
         print(f"CRITICAL ERROR in GUI: Initial track condition {initial_track_cond_key} not found in cache!")
-        current_tracks_for_display_plot = []
+    if not (current_show_tracks_view or current_show_singularities_view) \
+            or not request_condition(all_tracks_data_cache, initial_track_cond_key):
+        initial_track_cond_key = None # Loaded by update_plot_gui once tracks are needed and available
+    select_tracks_for_display(initial_track_cond_key)
+    if envelope_pyramids_data is not None:
+        set_view_window(0, num_time_points_data, redraw=False) # Starts at the level fitting the whole recording
 
 
     update_plot_gui("initial_call") # Draw initial plot
@@ -117,95 +194,392 @@ def launch_gui(_band_envelopes, _all_phase_series, _all_tracks, _config, _num_ti
     plt.show()
 
 
+def create_frame_artists(fig, ax, cfg, initial_image):
+    """
+    Creates the artists of one displayed frame on ax: envelope image with colorbar, spiral/anti-spiral
+    markers with their legend and the track lines. Shared by the GUI and src.video_export.
+    Returns (image, colorbar, spiral_scatter, anti_spiral_scatter, legend, track_line_collection).
+    """
+    image = ax.imshow(initial_image, cmap=cfg.AMPLITUDE_CMAP, vmin=0, interpolation='bilinear')
+    ax.set_xticks([]); ax.set_yticks([])
+    colorbar = fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04); colorbar.set_label('Amp. Env.')
+
+    spirals = ax.scatter([],[],s=cfg.SINGULARITY_MARKER_SIZE,facecolors='none',edgecolors=cfg.SINGULARITY_EDGE_COLOR,lw=1.5,label='Spirals', zorder=10)
+    anti_spirals = ax.scatter([],[],s=cfg.SINGULARITY_MARKER_SIZE,marker='x',c=cfg.SINGULARITY_ANTI_EDGE_COLOR,lw=1.5,label='Anti-spirals', zorder=10)
+    legend = ax.legend(handles=[spirals,anti_spirals],loc='upper left',fontsize='small',facecolor='gray',framealpha=0.5)
+    track_lines = LineCollection([], linewidths=cfg.TRACK_LINEWIDTH, alpha=0.7, zorder=5)
+    ax.add_collection(track_lines, autolim=False)
+    return image, colorbar, spirals, anti_spirals, legend, track_lines
+
+def envelope_clim(min_amp, max_amp):
+    """Color limits of an envelope frame, widened around the value for flat data."""
+    if max_amp > min_amp:
+        return min_amp, max_amp
+    val=max_amp
+    if np.isclose(val,0): return -0.05, 0.05
+    abs_v=np.abs(val)
+    clim_min=val - abs_v*0.05 if val!=0 else -0.01
+    clim_max=val + abs_v*0.05 if val!=0 else 0.01
+    if np.isclose(clim_min,clim_max) and not np.isclose(clim_min,-0.05): clim_min-=0.01; clim_max+=0.01
+    return clim_min, clim_max
+
+def points_to_display_offsets(points_rc):
+    """Zoomed (row, col) points -> (x, y) scatter offsets at pixel centres."""
+    return np.asarray(points_rc, dtype=float).reshape((-1, 2))[:, ::-1] + 0.5
+
+def track_segments_at(tracks, interval_index, time_idx, cfg):
+    """Returns (segments, colors) of the tracks active at time_idx, truncated at time_idx."""
+    segments, segment_colors = [], []
+    for track_idx in interval_index.active_at(time_idx):
+        points_to_draw_rc_z = tracks.track_points_up_to(track_idx, time_idx, cfg.MAX_POINTS_PER_TRACK_DEQUE)
+        if len(points_to_draw_rc_z) > 1:
+            segments.append(points_to_display_offsets(points_to_draw_rc_z))
+            segment_colors.append(cfg.SINGULARITY_EDGE_COLOR if tracks.types[track_idx] == SPIRAL
+                                  else cfg.SINGULARITY_ANTI_EDGE_COLOR)
+    return segments, segment_colors
+
+def request_condition(data_holder, key):
+    """
+    True if data_holder[key] can be read without waiting. Plain dicts always can; lazy providers
+    (lazy_conditions.LazyConditionMapping) start computing the key in the background instead of blocking.
+    """
+    request = getattr(data_holder, 'request', None)
+    return True if request is None else request(key)
+
+class UpsampledFrameCache:
+    """
+    LRU cache of upsampled envelope frames. Frames are zoomed a block at a time (one batched
+    matrix product) together with their per-frame min/max, so scrubbing and playback mostly
+    read already upsampled frames instead of zooming one frame per event.
+    """
+    def __init__(self, grid_dim, upsample_factor, interpolation_order, block_size=128, max_blocks=16):
+        self.grid_dim = grid_dim
+        self.upsample_factor = upsample_factor
+        self.interpolation_order = interpolation_order
+        self.block_size = max(1, int(block_size))
+        self.max_blocks = max(1, int(max_blocks))
+        self.blocks = OrderedDict() # (band_name, block_idx) -> (frames, frame_mins, frame_maxs)
+
+    def frame(self, band_name, envelope_series, time_idx):
+        """Returns (zoomed frame, min, max) of envelope_series (channels x time) at time_idx."""
+        block_idx, frame_in_block = divmod(time_idx, self.block_size)
+        block_key = (band_name, block_idx)
+        if block_key in self.blocks:
+            self.blocks.move_to_end(block_key)
+        else:
+            start = block_idx * self.block_size
+            block_frames = np.asarray(envelope_series[:, start:start + self.block_size], dtype=np.float64).T
+            zoomed = upsample_grid_frames(block_frames, self.grid_dim, self.upsample_factor,
+                                          self.interpolation_order).astype(np.float32)
+            self.blocks[block_key] = (zoomed, zoomed.min(axis=(1, 2)), zoomed.max(axis=(1, 2)))
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        frames, frame_mins, frame_maxs = self.blocks[block_key]
+        return frames[frame_in_block], frame_mins[frame_in_block], frame_maxs[frame_in_block]
+
+def schedule_computing_poll():
+    """Redraws shortly, so pending lazily computed data appears once it is ready."""
+    global computing_poll_timer
+    if computing_poll_timer is None:
+        computing_poll_timer = fig.canvas.new_timer(interval=COMPUTING_POLL_INTERVAL_MS)
+        computing_poll_timer.single_shot = True
+        computing_poll_timer.add_callback(update_plot_gui, "computing_poll")
+    computing_poll_timer.start()
+
+# --- Overview strip and time pyramid ---
+# With envelope pyramids, the time slider spans a view window chosen on the overview strip. Its step is the bin
+# size of the finest pyramid level with at most GUI_MAX_SLIDER_STEPS bins in the window; at levels >= 1 frames
+# are read from the memory-mapped pyramid, and full-resolution frames, singularities and tracks are only loaded
+# once the window is short enough for level 0.
+
+def create_overview_strip(overview_axes):
+    """Draws the mean band power over the whole recording, with the view window and current time marked."""
+    global overview_ax, overview_power_line, overview_window_span, overview_time_line, overview_span_selector
+    overview_ax = overview_axes
+    overview_power_line, = overview_ax.plot([], [], lw=0.8, color='tab:blue')
+    overview_window_span = overview_ax.axvspan(0, num_time_points_data, color='tab:orange', alpha=0.2)
+    overview_time_line = overview_ax.axvline(current_display_time_idx_view, color='red', lw=1)
+    overview_ax.set_xlim(0, num_time_points_data)
+    overview_ax.set_yticks([])
+    overview_ax.set_ylabel('Power', fontsize='small')
+    overview_ax.tick_params(labelsize='small')
+    overview_span_selector = SpanSelector(overview_ax, lambda xmin, xmax: set_view_window(xmin, xmax + 1),
+                                          'horizontal', minspan=1, props=dict(facecolor='tab:orange', alpha=0.4))
+    update_overview_strip()
+
+def update_overview_strip():
+    """Shows the selected band's power curve (at most GUI_OVERVIEW_MAX_POINTS points); empty while it is computed."""
+    global overview_band_shown
+    if not request_condition(envelope_pyramids_data, current_selected_band_view):
+        overview_band_shown = None
+        overview_power_line.set_data([], [])
+        return
+    overview_band_shown = current_selected_band_view
+    bin_starts, band_power = envelope_pyramids_data[current_selected_band_view].overview(config_module.GUI_OVERVIEW_MAX_POINTS)
+    overview_power_line.set_data(bin_starts, band_power)
+    if len(band_power): # Robust upper limit, so edge transients do not flatten the rest of the curve
+        overview_ax.set_ylim(0, max(float(np.percentile(band_power, 99.5)), 1e-12) * 1.1)
+
+def set_view_window(start, stop, redraw=True):
+    """Makes the time slider span time points [start, stop) at the pyramid level fitting the window."""
+    global current_view_window, current_pyramid_level, overview_window_span
+    start = int(np.clip(start, 0, num_time_points_data - 1))
+    stop = int(np.clip(stop, start + 1, num_time_points_data))
+    current_view_window = (start, stop)
+    current_pyramid_level = level_for_window(pyramid_level_bin_sizes, stop - start, config_module.GUI_MAX_SLIDER_STEPS)
+    bin_size = pyramid_level_bin_sizes[current_pyramid_level]
+    slider_start, slider_stop = start - start % bin_size, (stop - 1) - (stop - 1) % bin_size # Values fall on bin starts
+    time_slider.valmin, time_slider.valmax, time_slider.valstep = slider_start, slider_stop, bin_size
+    time_slider.ax.set_xlim(slider_start, max(slider_stop, slider_start + 1))
+    time_slider.poly.set_x(slider_start)
+    overview_window_span.remove()
+    overview_window_span = overview_ax.axvspan(start, stop, color='tab:orange', alpha=0.2)
+    time_idx = int(np.clip(current_display_time_idx_view, start, stop - 1))
+    time_slider.eventson = False # Redrawn once below
+    time_slider.set_val(time_idx - time_idx % bin_size)
+    time_slider.eventson = True
+    if redraw:
+        update_plot_gui("view_window")
+
+def view_bin_size():
+    return pyramid_level_bin_sizes[current_pyramid_level]
+
+def select_trial(trial_idx, show_average):
+    """Switches the displayed envelopes and tracks to one trial, or to the trial average (no tracks or markers)."""
+    global band_envelopes_data, all_tracks_data_cache, track_interval_indices, current_trial_view, current_trial_average_view
+    if (trial_idx, show_average) == (current_trial_view, current_trial_average_view):
+        return
+    current_trial_view, current_trial_average_view = trial_idx, show_average
+    if show_average:
+        band_envelopes_data = trial_results_data.mean_envelopes
+        all_tracks_data_cache = trial_results_data.average_tracks()
+    else:
+        band_envelopes_data = trial_results_data.trial_envelopes(trial_idx)
+        all_tracks_data_cache = trial_results_data.trial_tracks(trial_idx)
+    track_interval_indices = {}
+    envelope_frame_cache.blocks.clear() # Cached frames belong to the previous trial
+
+def select_tracks_for_display(track_condition_key):
+    """Switches the displayed track set, building its interval index the first time it is loaded."""
+    global current_tracks_for_display_plot, current_track_interval_index
+    current_tracks_for_display_plot = all_tracks_data_cache[track_condition_key] if track_condition_key in all_tracks_data_cache else TrackStore.empty()
+    if track_condition_key not in track_interval_indices:
+        track_interval_indices[track_condition_key] = TrackIntervalIndex(current_tracks_for_display_plot)
+    current_track_interval_index = track_interval_indices[track_condition_key]
+
+def get_visible_track_segments(time_idx):
+    """Returns (segments, colors) of the displayed tracks active at time_idx, truncated at time_idx."""
+    return track_segments_at(current_tracks_for_display_plot, current_track_interval_index, time_idx, config_module)
+
 def update_plot_gui(event_source=None):
     """Main GUI update function, called by widget events."""
     global current_selected_band_view, current_display_time_idx_view, \
            current_show_singularities_view, current_filter_phase_view, \
-           current_show_tracks_view, track_lines_plots_display, current_tracks_for_display_plot
+           current_show_tracks_view, current_tracks_for_display_plot
     global config_module, band_envelopes_data, all_phase_series_data_cache, all_tracks_data_cache # Read-only access to data
 
     # Get current widget states
     current_display_time_idx_view = int(time_slider.val)
     current_selected_band_view = band_radio.value_selected
     current_show_singularities_view = check_singularities.get_status()[0]
-    new_filter_phase_state_for_view = check_filter_phase.get_status()[0] # This is for BOTH inst. sings and track set
+    current_filter_phase_view = check_filter_phase.get_status()[0] # This is for BOTH inst. sings and track set
     current_show_tracks_view = check_show_tracks.get_status()[0]
-    
-    # --- Load the correct set of precomputed tracks if filter/band condition changed ---
-    track_condition_key_for_display = (new_filter_phase_state_for_view, 
-                                       current_selected_band_view if new_filter_phase_state_for_view else None)
-    
-    # Check if the condition for displaying tracks has changed
-    # We need to compare with the *previous* filter_phase_view for tracks
-    previous_track_condition_filter_state = current_filter_phase_view 
-    # (assuming current_filter_phase_view hasn't been updated yet for *this call* if event was not check_filter_phase)
-    # A bit tricky, let's just re-fetch based on new_filter_phase_state_for_view always
-    
-    if track_condition_key_for_display in all_tracks_data_cache:
-        current_tracks_for_display_plot = all_tracks_data_cache[track_condition_key_for_display]
-    else:
-        print(f"Error in GUI: Tracks for condition {track_condition_key_for_display} not found in cache!")
-        current_tracks_for_display_plot = []
-    
-    current_filter_phase_view = new_filter_phase_state_for_view # Now update the global view state
+    if trial_results_data is not None:
+        select_trial(int(trial_slider.val), check_trial_average.get_status()[0])
+    full_resolution = current_pyramid_level == 0 # Singularities and tracks are only shown on full-resolution frames
+
+    # --- Load the precomputed tracks of the current filter/band condition ---
+    # Tracks hold every detected singularity (one point per frame), so they also serve the instantaneous markers
+    condition_key = (current_filter_phase_view, current_selected_band_view if current_filter_phase_view else None)
+    if condition_key not in all_tracks_data_cache:
+        print(f"Error in GUI: Tracks for condition {condition_key} not found in cache!")
+    computing_items = [] # Lazily computed data that is not available yet
+    tracks_available = (full_resolution and (current_show_tracks_view or current_show_singularities_view)
+                        and request_condition(all_tracks_data_cache, condition_key))
+    if tracks_available:
+        select_tracks_for_display(condition_key)
+    elif current_show_tracks_view and full_resolution:
+        computing_items.append('tracks')
 
     # --- Update Amplitude Envelope ---
-    envelope_data = band_envelopes_data[current_selected_band_view][:, current_display_time_idx_view]
-    env_grid_orig = envelope_data.reshape((config_module.GRID_DIM, config_module.GRID_DIM))
-    zoomed_amp_data = zoom(env_grid_orig, config_module.UPSAMPLE_FACTOR, order=config_module.INTERPOLATION_ORDER_ZOOM)
-    img_display.set_data(zoomed_amp_data)
-    min_amp, max_amp = np.min(zoomed_amp_data), np.max(zoomed_amp_data)
-    if max_amp > min_amp: img_display.set_clim(min_amp, max_amp)
-    else: # Handle flat data
-        val=max_amp
-        if np.isclose(val,0): img_display.set_clim(-0.05,0.05)
-        else: 
-            abs_v=np.abs(val)
-            clim_min=val - abs_v*0.05 if val!=0 else -0.01
-            clim_max=val + abs_v*0.05 if val!=0 else 0.01
-            if np.isclose(clim_min,clim_max) and not np.isclose(clim_min,-0.05): clim_min-=0.01; clim_max+=0.01
-            img_display.set_clim(clim_min,clim_max)
-    ax.set_title(f'Amp: {current_selected_band_view} @T: {current_display_time_idx_view}')
+    if request_condition(band_envelopes_data if full_resolution else envelope_pyramids_data, current_selected_band_view):
+        update_envelope_image()
+    else:
+        computing_items.append('envelope')
+    if overview_ax is not None:
+        if overview_band_shown != current_selected_band_view:
+            update_overview_strip()
+        if overview_band_shown is None:
+            computing_items.append('overview')
+        overview_time_line.set_xdata([current_display_time_idx_view, current_display_time_idx_view])
 
     # --- Update Singularity Markers (Instantaneous) ---
-    if current_show_singularities_view:
-        phase_series_for_inst_sings = all_phase_series_data_cache[(current_filter_phase_view, 
-                                                                  current_selected_band_view if current_filter_phase_view else None)]
-        phase_grid_for_inst_sings = get_zoomed_phase_grid_from_series(
-                                            current_display_time_idx_view, 
-                                            phase_series_for_inst_sings,
-                                            config_module.GRID_DIM,
-                                            config_module.UPSAMPLE_FACTOR,
-                                            config_module.INTERPOLATION_ORDER_ZOOM
-                                        )
-        if phase_grid_for_inst_sings is not None:
-            s_disp, a_disp = detect_singularities(phase_grid_for_inst_sings, config_module.PHASE_TOLERANCE)
-            if s_disp: sr,sc=zip(*s_disp); spiral_scatter.set_offsets(np.c_[[c+0.5 for c in sc],[r+0.5 for r in sr]])
-            else: spiral_scatter.set_offsets(np.empty((0,2)))
-            if a_disp: asr,asc=zip(*a_disp); anti_spiral_scatter.set_offsets(np.c_[[c+0.5 for c in asc],[r+0.5 for r in asr]])
-            else: anti_spiral_scatter.set_offsets(np.empty((0,2)))
-        spiral_scatter.set_visible(True); anti_spiral_scatter.set_visible(True); legend_singularities.set_visible(True)
-    else:
-        spiral_scatter.set_visible(False); anti_spiral_scatter.set_visible(False); legend_singularities.set_visible(False)
+    singularities_available = full_resolution and current_show_singularities_view and (
+                                  tracks_available or request_condition(all_phase_series_data_cache, condition_key))
+    if singularities_available:
+        update_singularity_markers(condition_key, from_tracks=tracks_available)
+    elif current_show_singularities_view and full_resolution:
+        computing_items.append('phase')
+    spiral_scatter.set_visible(singularities_available); anti_spiral_scatter.set_visible(singularities_available)
+    legend_singularities.set_visible(singularities_available)
+
+    bin_size = view_bin_size()
+    ax.set_title(f'Amp: {current_selected_band_view} @T: {current_display_time_idx_view}'
+                 + ('' if full_resolution else f'-{min(current_display_time_idx_view + bin_size, num_time_points_data) - 1}'
+                    f' ({config_module.GUI_PYRAMID_STATISTIC} of {bin_size} samples)')
+                 + ('' if trial_results_data is None else
+                    ' (trial average)' if current_trial_average_view else f' (trial {current_trial_view})')
+                 + (f" (computing {', '.join(computing_items)}…)" if computing_items else ''))
 
     # --- Update Track Lines Display ---
-    for line in track_lines_plots_display: line.remove()
-    track_lines_plots_display.clear()
-    
-    if current_show_tracks_view:
-        for track_obj in current_tracks_for_display_plot:
-            if track_obj['start_time'] <= current_display_time_idx_view <= track_obj['end_time']:
-                points_to_draw_rc_z = []
-                for i, t_point in enumerate(track_obj['time_indices']):
-                    if t_point <= current_display_time_idx_view:
-                        points_to_draw_rc_z.append(track_obj['points_rc_zoomed'][i])
-                    else: break 
-                
-                if len(points_to_draw_rc_z) > 1:
-                    color = config_module.SINGULARITY_EDGE_COLOR if track_obj['type'] == 'spiral' else config_module.SINGULARITY_ANTI_EDGE_COLOR
-                    track_cols = [(p[1] + 0.5) for p in points_to_draw_rc_z]
-                    track_rows = [(p[0] + 0.5) for p in points_to_draw_rc_z]
-                    line, = ax.plot(track_cols, track_rows, color=color, linewidth=config_module.TRACK_LINEWIDTH, alpha=0.7, zorder=5)
-                    track_lines_plots_display.append(line)
-        
-    fig.canvas.draw_idle()
\ No newline at end of file
+    show_track_lines = current_show_tracks_view and tracks_available
+    if show_track_lines:
+        segments, segment_colors = get_visible_track_segments(current_display_time_idx_view)
+        track_line_collection.set_segments(segments)
+        track_line_collection.set_color(segment_colors)
+    track_line_collection.set_visible(show_track_lines)
+
+    if computing_items:
+        schedule_computing_poll()
+    if event_source in ("time_slider", "playback") and blitting_active:
+        blit_animated_artists() # Only the time-dependent artists changed
+    else:
+        fig.canvas.draw_idle()
+
+def update_envelope_image():
+    if current_pyramid_level == 0:
+        cache_key, envelope_series, frame_idx = (current_selected_band_view, band_envelopes_data[current_selected_band_view],
+                                                 current_display_time_idx_view)
+    else: # One bin of the memory-mapped pyramid level
+        pyramid = envelope_pyramids_data[current_selected_band_view]
+        cache_key = (current_selected_band_view, current_pyramid_level, config_module.GUI_PYRAMID_STATISTIC)
+        envelope_series = pyramid.frame_series(current_pyramid_level, config_module.GUI_PYRAMID_STATISTIC)
+        frame_idx = current_display_time_idx_view // pyramid_level_bin_sizes[current_pyramid_level]
+    zoomed_amp_data, min_amp, max_amp = envelope_frame_cache.frame(cache_key, envelope_series, frame_idx)
+    img_display.set_data(zoomed_amp_data)
+    img_display.set_clim(*envelope_clim(min_amp, max_amp))
+
+def update_singularity_markers(phase_condition_key, from_tracks=True):
+    """Places the spiral/anti-spiral markers, read from the precomputed tracks or (while those are pending) detected live."""
+    if from_tracks:
+        active_tracks = current_track_interval_index.active_at(current_display_time_idx_view)
+        points_rc, types = current_tracks_for_display_plot.points_at(active_tracks, current_display_time_idx_view)
+        spiral_scatter.set_offsets(points_to_display_offsets(points_rc[types == SPIRAL]))
+        anti_spiral_scatter.set_offsets(points_to_display_offsets(points_rc[types != SPIRAL]))
+        return
+    phase_series_for_inst_sings = all_phase_series_data_cache[phase_condition_key]
+    s_disp, _, a_disp, _ = detect_singularities_from_series(
+                                current_display_time_idx_view,
+                                current_display_time_idx_view + 1,
+                                phase_series_for_inst_sings,
+                                config_module.GRID_DIM,
+                                config_module.UPSAMPLE_FACTOR,
+                                config_module.INTERPOLATION_ORDER_ZOOM,
+                                config_module.PHASE_TOLERANCE,
+                                config_module.SINGULARITY_DETECTION_MODE
+                            )
+    spiral_scatter.set_offsets(points_to_display_offsets(s_disp))
+    anti_spiral_scatter.set_offsets(points_to_display_offsets(a_disp))
+
+# --- Blitting ---
+# While scrubbing or playing, the artists that change with time are marked animated: a full draw
+# renders everything else once into a cached background, and each new frame restores that
+# background and redraws only these artists. Outside of that they are ordinary artists, so
+# saving the figure still includes them.
+
+def get_time_dependent_artists():
+    return [img_display, track_line_collection, spiral_scatter, anti_spiral_scatter,
+            ax.title, cbar.ax, time_slider.ax, fps_text] + ([overview_time_line] if overview_time_line is not None else [])
+
+def set_blitting(active):
+    global blitting_active, blit_background
+    active = active and config_module.GUI_BLITTING and fig.canvas.supports_blit
+    if active == blitting_active:
+        return
+    blitting_active, blit_background = active, None
+    for artist in get_time_dependent_artists():
+        artist.set_animated(active)
+    time_slider.drawon = not active # The slider is redrawn with the other animated artists
+    fig.canvas.draw_idle() # The next full draw captures the background
+
+def on_canvas_draw(event):
+    global blit_background
+    if blitting_active:
+        blit_background = fig.canvas.copy_from_bbox(fig.bbox)
+        draw_time_dependent_artists()
+
+def draw_time_dependent_artists():
+    for artist in get_time_dependent_artists():
+        if artist.get_visible():
+            fig.draw_artist(artist)
+
+def blit_animated_artists():
+    if blit_background is None: # Background not captured yet
+        fig.canvas.draw_idle()
+        return
+    fig.canvas.restore_region(blit_background)
+    draw_time_dependent_artists()
+    fig.canvas.blit(fig.bbox)
+    fig.canvas.flush_events()
+
+def on_mouse_press(event):
+    global slider_dragging
+    if event.inaxes is time_slider.ax:
+        slider_dragging = True
+        set_blitting(True)
+
+def on_mouse_release(event):
+    global slider_dragging
+    if slider_dragging:
+        slider_dragging = False
+        if not playback_active:
+            set_blitting(False)
+
+# --- Playback ---
+
+def playback_button_label():
+    return 'Pause' if playback_active else 'Play'
+
+def toggle_playback():
+    """Starts or stops real-time playback from the current time point."""
+    global playback_active, playback_start_wall_time, playback_start_time_idx
+    playback_active = not playback_active
+    play_button.label.set_text(playback_button_label())
+    if not playback_active:
+        playback_timer.stop()
+        fps_text.set_text('')
+        set_blitting(False)
+        fig.canvas.draw_idle()
+        return
+    playback_start_wall_time, playback_start_time_idx = time.perf_counter(), current_display_time_idx_view
+    playback_frame_times.clear()
+    set_blitting(True)
+    playback_timer.start()
+
+def advance_playback():
+    """
+    Timer callback. The displayed time point follows the wall clock (PLAYBACK_TARGET_FPS frames of
+    PLAYBACK_TIME_STEP time points, or one pyramid bin when zoomed out, per second), so time points are skipped
+    when rendering is too slow. Playback stays within the view window.
+    """
+    global playback_start_wall_time, playback_start_time_idx
+    view_start, view_stop = current_view_window
+    elapsed_frames = int((time.perf_counter() - playback_start_wall_time) * config_module.PLAYBACK_TARGET_FPS)
+    target_time_idx = playback_start_time_idx + elapsed_frames * max(config_module.PLAYBACK_TIME_STEP, view_bin_size())
+    if target_time_idx >= view_stop:
+        if not config_module.PLAYBACK_LOOP:
+            toggle_playback()
+            return
+        playback_start_wall_time, playback_start_time_idx = time.perf_counter(), view_start
+        target_time_idx = view_start
+    if target_time_idx == current_display_time_idx_view:
+        return
+
+    playback_frame_times.append(time.perf_counter())
+    if len(playback_frame_times) > 1:
+        achieved_fps = (len(playback_frame_times) - 1) / max(playback_frame_times[-1] - playback_frame_times[0], 1e-9)
+        fps_text.set_text(f'Playback: {achieved_fps:.1f} fps (target {config_module.PLAYBACK_TARGET_FPS})')
+    time_slider.eventson = False # Render once below instead of through the slider callback
+    time_slider.set_val(target_time_idx)
+    time_slider.eventson = True
+    update_plot_gui("playback")
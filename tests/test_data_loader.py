@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from src import instrumentation
+from src.data_loader import LazyTrialArray, open_lfp_data, open_lfp_trials
+
+def write_v73_mat(filepath, variable_name, array):
+    """Minimal MATLAB v7.3 file: HDF5 with the 128-byte MAT header in its user block."""
+    h5py = pytest.importorskip('h5py')
+    with h5py.File(filepath, 'w', userblock_size=512) as f:
+        f[variable_name] = array
+    with open(filepath, 'r+b') as f:
+        f.write(b'MATLAB 7.3 MAT-file'.ljust(116, b' ') + b'\0' * 8 + b'\x00\x02' + b'IM')
+
+@pytest.mark.parametrize('time_first', [True, False])
+def test_npy_lazy_slices_match_in_memory_data(tmp_path, time_first):
+    lfp = np.random.default_rng(0).standard_normal((16, 300)) # channels x time
+    filepath = str(tmp_path / 'lfp.npy')
+    np.save(filepath, lfp.T if time_first else lfp)
+
+    lfp_array = open_lfp_data(filepath, num_expected_channels=16)
+    assert isinstance(lfp_array.source, np.memmap)
+    assert lfp_array.time_first == time_first
+    assert lfp_array.shape == (16, 300)
+    np.testing.assert_array_equal(lfp_array[:, 40:170], lfp[:, 40:170])
+    np.testing.assert_array_equal(lfp_array[3:9, 250:], lfp[3:9, 250:])
+    np.testing.assert_array_equal(lfp_array[:, 7], lfp[:, 7])
+    np.testing.assert_array_equal(np.asarray(lfp_array), lfp)
+
+    narrowed = lfp_array.select(channels=[11, 2, 5], time_range=(100, 200))
+    np.testing.assert_array_equal(narrowed[:, 10:60], lfp[[11, 2, 5], 110:160])
+
+def test_v73_trials_are_read_per_batch(tmp_path):
+    trials = np.random.default_rng(1).standard_normal((6, 16, 50)) # trials x channels x time
+    filepath = str(tmp_path / 'epochs.mat')
+    write_v73_mat(filepath, 'lfp', trials.transpose(2, 1, 0)) # As MATLAB stores a trials x channels x time variable
+
+    lfp_trials = open_lfp_trials(filepath, 'lfp', num_expected_channels=16, layout='time_channels_trials')
+    assert isinstance(lfp_trials, LazyTrialArray)
+    assert lfp_trials.shape == (6, 16, 50)
+    recorder = instrumentation.configure(enabled=True)
+    try:
+        np.testing.assert_array_equal(lfp_trials[2:4], trials[2:4])
+        assert recorder.counters['lfp_bytes_read'] == trials[2:4].nbytes # Only the requested trials
+        np.testing.assert_array_equal(lfp_trials[-1], trials[-1])
+        np.testing.assert_array_equal(np.asarray(lfp_trials), trials)
+    finally:
+        instrumentation.configure(enabled=False)
@@ -0,0 +1,38 @@
+import os
+import types
+import numpy as np
+from src import config, pipeline
+from src.result_cache import ResultCache
+
+def config_copy(**overrides):
+    cfg = types.SimpleNamespace(**{name: getattr(config, name) for name in dir(config) if name.isupper()})
+    for name, value in overrides.items():
+        setattr(cfg, name, value)
+    return cfg
+
+def test_tracking_parameter_invalidates_only_the_tracks_key(tmp_path):
+    input_path = tmp_path / 'lfp.npy'
+    np.save(input_path, np.zeros((4, 10)))
+    keys = pipeline.make_stage_keys(config_copy(), str(input_path))
+    relinked_keys = pipeline.make_stage_keys(config_copy(MAX_TRACK_DISTANCE_SQ=config.MAX_TRACK_DISTANCE_SQ + 1),
+                                             str(input_path))
+    assert relinked_keys['signal'] == keys['signal']
+    assert relinked_keys['detections'] == keys['detections']
+    assert relinked_keys['tracks'] != keys['tracks']
+
+    resampled_keys = pipeline.make_stage_keys(config_copy(FS=config.FS * 2), str(input_path))
+    for stage_name in ('signal', 'detections', 'tracks'):
+        assert resampled_keys[stage_name] != keys[stage_name], stage_name
+
+def test_size_cap_evicts_least_recently_read_entry(tmp_path):
+    entry_array = np.zeros(1000) # About 8 kB per entry
+    cache = ResultCache(str(tmp_path / 'cache'))
+    for age, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, {'x': entry_array})
+        meta_path = os.path.join(cache.cache_dir, key, 'meta.json')
+        os.utime(meta_path, (1000 + age, 1000 + age)) # Distinct access times, oldest first
+    assert cache.get('a') is not None # Now the most recently read; 'b' is the least recently read
+
+    cache.max_size_bytes = sum(size_bytes for _, size_bytes, _ in cache.entries()) + 4000 # Room for three entries
+    cache.put('d', {'x': entry_array})
+    assert sorted(key for key, _, _ in cache.entries()) == ['a', 'c', 'd']
@@ -0,0 +1,43 @@
+import numpy as np
+from src import config
+from src.signal_processing import (compare_fft_filter_bank_to_filtfilt, compute_envelopes_and_phases,
+                                   compute_envelopes_and_phases_chunked, _filtfilt_analytic_signals)
+
+def pink_noise_lfp(num_channels, num_time_points, fs, seed=0):
+    """1/f-like synthetic LFP (amplitude spectrum ~ 1/sqrt(f)), channels x time."""
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft(rng.standard_normal((num_channels, num_time_points)), axis=-1)
+    freqs = np.fft.rfftfreq(num_time_points, d=1.0 / fs)
+    spectrum[:, 0] = 0
+    spectrum[:, 1:] /= np.sqrt(freqs[1:])
+    return np.fft.irfft(spectrum, num_time_points, axis=-1)
+
+def test_fft_filter_bank_matches_filtfilt():
+    lfp = pink_noise_lfp(8, 20000, config.FS)
+    deviations = compare_fft_filter_bank_to_filtfilt(lfp, config.FREQ_BANDS, config.FS, config.FILTER_ORDER)
+    assert set(deviations) == {'raw'} | set(config.FREQ_BANDS)
+    assert deviations['raw']['envelope_rel_max'] < 1e-12 # No filter: both paths are the same Hilbert transform
+    for band_name in config.FREQ_BANDS:
+        # Delta has the longest impulse response and differs most where filtfilt and circular filtering part ways
+        envelope_bound, phase_bound = (1e-2, 5e-2) if band_name.startswith('Delta') else (2e-3, 1e-2)
+        assert deviations[band_name]['envelope_rel_rms'] < envelope_bound, band_name
+        assert deviations[band_name]['phase_rms_rad'] < phase_bound, band_name
+
+def test_chunked_matches_in_memory(tmp_path):
+    lfp = pink_noise_lfp(16, 100000, config.FS)
+    band_envelopes, all_phase_series = compute_envelopes_and_phases_chunked(
+        lfp, config.FREQ_BANDS, config.FS, config.FILTER_ORDER, str(tmp_path), block_size=20000,
+        envelope_dtype='float64', phase_dtype='float64')
+    for band_name, reference in _filtfilt_analytic_signals(lfp, config.FREQ_BANDS, config.FS, config.FILTER_ORDER,
+                                                           include_raw=False):
+        chunked = band_envelopes[band_name] * np.exp(1j * all_phase_series[(True, band_name)])
+        max_rel_error = np.max(np.abs(chunked - reference)) / np.sqrt(np.mean(np.abs(reference)**2))
+        assert max_rel_error < (2e-2 if band_name.startswith('Delta') else 2e-3), band_name # Stated tolerance
+
+def test_chunked_single_block_is_exact(tmp_path):
+    lfp = pink_noise_lfp(4, 5000, config.FS)
+    band_envelopes, _ = compute_envelopes_and_phases_chunked(lfp, config.FREQ_BANDS, config.FS, config.FILTER_ORDER,
+                                                             str(tmp_path), block_size=5000, envelope_dtype='float64')
+    reference_envelopes, _ = compute_envelopes_and_phases(lfp, config.FREQ_BANDS, config.FS, config.FILTER_ORDER)
+    for band_name, envelope in band_envelopes.items():
+        np.testing.assert_allclose(envelope, reference_envelopes[band_name], rtol=0, atol=1e-12)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.ndimage import zoom
+from src import config
+from src.signal_processing import correct_phase_diff
+from src.singularity_detection import detect_singularities_batch, get_zoom_operator, upsample_grid_frames
+
+def detect_singularities_loop(phase_grid, phase_tolerance):
+    """Per-plaquette reference: the original frame-by-frame detector."""
+    s_list, a_list = [], []
+    for r_idx in range(phase_grid.shape[0] - 1):
+        for c_idx in range(phase_grid.shape[1] - 1):
+            p1, p2 = phase_grid[r_idx, c_idx], phase_grid[r_idx, c_idx + 1]
+            p3, p4 = phase_grid[r_idx + 1, c_idx + 1], phase_grid[r_idx + 1, c_idx]
+            total_phase_change = sum([correct_phase_diff(p2 - p1), correct_phase_diff(p3 - p2),
+                                      correct_phase_diff(p4 - p3), correct_phase_diff(p1 - p4)])
+            if np.abs(total_phase_change - 2 * np.pi) < phase_tolerance:
+                s_list.append((r_idx, c_idx))
+            elif np.abs(total_phase_change + 2 * np.pi) < phase_tolerance:
+                a_list.append((r_idx, c_idx))
+    return s_list, a_list
+
+def test_batch_detector_matches_loop_detector():
+    rng = np.random.default_rng(0)
+    phase_volume = rng.uniform(-np.pi, np.pi, size=(50, 15, 17))
+    phase_volume[7] = 0.3 # A frame without detections
+    s_rc, s_frames, a_rc, a_frames = detect_singularities_batch(phase_volume, config.PHASE_TOLERANCE, chunk_size=8)
+    num_detections = 0
+    for t, phase_grid in enumerate(phase_volume):
+        s_list, a_list = detect_singularities_loop(phase_grid, config.PHASE_TOLERANCE)
+        assert [tuple(rc) for rc in s_rc[s_frames == t].tolist()] == s_list, t
+        assert [tuple(rc) for rc in a_rc[a_frames == t].tolist()] == a_list, t
+        num_detections += len(s_list) + len(a_list)
+    assert not np.any(s_frames == 7) and not np.any(a_frames == 7)
+    assert num_detections > 0
+
+@pytest.mark.parametrize('interpolation_order', [0, 1, 3])
+@pytest.mark.parametrize('upsample_factor', [4, 2.5, 3.3]) # Non-integer factors are where the output shape could drift
+def test_separable_zoom_matches_scipy_zoom(interpolation_order, upsample_factor):
+    grid_dim = 20
+    frames = np.random.default_rng(1).standard_normal((3, grid_dim, grid_dim))
+    zoomed = upsample_grid_frames(frames.reshape((3, -1)), grid_dim, upsample_factor, interpolation_order)
+    assert get_zoom_operator(grid_dim, upsample_factor, interpolation_order).shape[1] == grid_dim
+    for frame, zoomed_frame in zip(frames, zoomed):
+        reference = zoom(frame, upsample_factor, order=interpolation_order)
+        assert zoomed_frame.shape == reference.shape
+        np.testing.assert_allclose(zoomed_frame, reference, rtol=0, atol=1e-12)
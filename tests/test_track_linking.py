@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from src import config
+from src import track_linking
+from src.singularity_detection import detect_singularities_batch
+from src.track_linking import TrackLinker, find_candidate_pairs, link_frame
+from src.track_store import SPIRAL, ANTI_SPIRAL
+
+def synthetic_spiral_detections(num_frames=60, grid_size=40, num_spirals=12, seed=0):
+    """Per-frame (spiral_rc, anti_rc) detections of drifting phase singularities; the phase noise adds short-lived pairs."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(5, grid_size - 5, size=(num_spirals, 2))
+    velocities = rng.normal(0, 1.0, size=(num_spirals, 2))
+    charges = np.where(np.arange(num_spirals) % 2 == 0, 1, -1)
+    rows, cols = np.mgrid[0:grid_size, 0:grid_size]
+    phase_volume = np.empty((num_frames, grid_size, grid_size))
+    for t in range(num_frames):
+        phase = rng.normal(0, 0.9, size=(grid_size, grid_size))
+        for (center_r, center_c), charge in zip(centers + t * velocities, charges):
+            phase += charge * np.arctan2(rows - center_r, cols - center_c)
+        phase_volume[t] = np.angle(np.exp(1j * phase))
+    s_rc, s_frames, a_rc, a_frames = detect_singularities_batch(phase_volume, config.PHASE_TOLERANCE)
+    return [([tuple(rc) for rc in s_rc[s_frames == t].tolist()], [tuple(rc) for rc in a_rc[a_frames == t].tolist()])
+            for t in range(num_frames)]
+
+def link_loop(frame_detections, max_track_distance_sq):
+    """Reference: the original per-track nearest-unmatched-detection loop. Returns sorted segments."""
+    segments, active = [], {SPIRAL: [], ANTI_SPIRAL: []}
+    for t, detections_by_type in enumerate(frame_detections):
+        for track_type, detections in zip((SPIRAL, ANTI_SPIRAL), detections_by_type):
+            newly_active, matched = [], [False] * len(detections)
+            for track in active[track_type]:
+                last_r, last_c = track['points'][-1]
+                best_match_idx, min_dist_sq = -1, float('inf')
+                for i, (r, c) in enumerate(detections):
+                    if not matched[i]:
+                        dist_sq = (r - last_r)**2 + (c - last_c)**2
+                        if dist_sq <= max_track_distance_sq and dist_sq < min_dist_sq:
+                            min_dist_sq, best_match_idx = dist_sq, i
+                if best_match_idx != -1:
+                    track['points'].append(detections[best_match_idx]); matched[best_match_idx] = True
+                    newly_active.append(track)
+                else:
+                    segments.append(track)
+            newly_active += [{'type': track_type, 'start': t, 'points': [point]}
+                             for i, point in enumerate(detections) if not matched[i]]
+            active[track_type] = newly_active
+    segments += active[SPIRAL] + active[ANTI_SPIRAL]
+    return sorted((track['type'], track['start'], tuple(track['points'])) for track in segments)
+
+def link_store_segments(frame_detections, max_track_distance_sq, linking_mode):
+    track_linker = TrackLinker(max_track_distance_sq, linking_mode)
+    for t, (spiral_rc, anti_rc) in enumerate(frame_detections):
+        track_linker.step(t, spiral_rc, anti_rc)
+    store = track_linker.finish()
+    return sorted((int(store.types[i]), int(store.start_times[i]), tuple(map(tuple, store.track_points(i)[0].tolist())))
+                  for i in range(len(store)))
+
+@pytest.mark.parametrize('max_track_distance_sq', [2, 9, 25])
+def test_greedy_linking_matches_original_loop(max_track_distance_sq):
+    frame_detections = synthetic_spiral_detections()
+    expected = link_loop(frame_detections, max_track_distance_sq)
+    assert sum(len(points) for _, _, points in expected) > len(expected) # Some detections were linked
+    assert link_store_segments(frame_detections, max_track_distance_sq, 'greedy') == expected
+
+def test_optimal_linking_makes_more_links_than_greedy():
+    # Track 0 is nearest to detection 0, which is the only detection within reach of track 1
+    last_points_rc = np.array([[0.0, 0.0], [0.0, 3.0]])
+    detections_rc = np.array([[0.0, 1.0], [0.0, -1.5]])
+    greedy = link_frame(last_points_rc, detections_rc, 4, 'greedy')
+    optimal = link_frame(last_points_rc, detections_rc, 4, 'optimal')
+    np.testing.assert_array_equal(greedy, [0, -1])
+    np.testing.assert_array_equal(optimal, [1, 0])
+
+def test_kdtree_candidate_pairs_match_dense_path(monkeypatch):
+    rng = np.random.default_rng(2)
+    last_points_rc = rng.uniform(0, 80, size=(100, 2))
+    detections_rc = np.vstack([rng.uniform(0, 80, size=(97, 2)), last_points_rc[:3] + [3.0, 0.0]]) # Exactly on the radius
+    assert len(last_points_rc) * len(detections_rc) > track_linking.KDTREE_MIN_PAIRS
+    kdtree_pairs = find_candidate_pairs(last_points_rc, detections_rc, 9)
+    monkeypatch.setattr(track_linking, 'KDTREE_MIN_PAIRS', np.inf)
+    dense_pairs = find_candidate_pairs(last_points_rc, detections_rc, 9)
+    kdtree_order, dense_order = np.lexsort(kdtree_pairs[1::-1]), np.lexsort(dense_pairs[1::-1])
+    assert len(dense_pairs[0]) > 3
+    for kdtree_values, dense_values in zip(kdtree_pairs, dense_pairs):
+        np.testing.assert_array_equal(kdtree_values[kdtree_order], dense_values[dense_order])
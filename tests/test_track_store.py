@@ -0,0 +1,62 @@
+import numpy as np
+from src import config
+from src.track_store import SPIRAL, ANTI_SPIRAL, TrackIntervalIndex, TrackStore, TrackStoreBuilder
+
+def build_long_track_store():
+    """One spiral longer than MAX_POINTS_PER_TRACK_DEQUE and a short anti-spiral that starts later."""
+    num_long = config.MAX_POINTS_PER_TRACK_DEQUE + 30
+    builder = TrackStoreBuilder()
+    long_id, = builder.open_tracks(SPIRAL, 0, [[0.0, 0.0]])
+    for t in range(1, num_long):
+        if t == 10:
+            short_id, = builder.open_tracks(ANTI_SPIRAL, t, [[100.0, 100.0]])
+        if 10 < t <= 14:
+            builder.extend_tracks([short_id], t, [[100.0 + t, 100.0]])
+        builder.extend_tracks([long_id], t, [[float(t), 2.0 * t]])
+    return builder.build(), num_long
+
+def test_long_track_round_trips_untruncated(tmp_path):
+    store, num_long = build_long_track_store()
+    filepath = str(tmp_path / 'tracks.npz')
+    store.save_npz(filepath)
+    loaded = TrackStore.load_npz(filepath)
+
+    np.testing.assert_array_equal(loaded.track_ids, [0, 1])
+    np.testing.assert_array_equal(loaded.types, [SPIRAL, ANTI_SPIRAL])
+    np.testing.assert_array_equal(loaded.start_times, [0, 10])
+    np.testing.assert_array_equal(loaded.end_times, [num_long - 1, 14])
+    np.testing.assert_array_equal(loaded.offsets, [0, num_long, num_long + 5])
+    points_rc, time_indices = loaded.track_points(0)
+    np.testing.assert_array_equal(time_indices, np.arange(num_long))
+    np.testing.assert_array_equal(points_rc, np.column_stack([np.arange(num_long), 2 * np.arange(num_long)]))
+    for name in TrackStore.ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(store, name), err_msg=name)
+
+def test_track_points_up_to_truncates_only_when_drawing():
+    store, num_long = build_long_track_store()
+    max_points = config.MAX_POINTS_PER_TRACK_DEQUE
+    last_t = num_long - 1
+    assert len(store.track_points_up_to(0, last_t)) == num_long
+    drawn = store.track_points_up_to(0, last_t, max_points)
+    np.testing.assert_array_equal(drawn[:, 0], np.arange(num_long - max_points, num_long))
+    assert len(store.track_points_up_to(0, 20, max_points)) == 21 # Shorter than max_points: nothing dropped
+    assert len(store.track_points(0)[0]) == num_long # The store itself is untouched
+
+    points_rc, types = store.points_at([0, 1], 12)
+    np.testing.assert_array_equal(points_rc, [[12.0, 24.0], [112.0, 100.0]])
+    np.testing.assert_array_equal(types, [SPIRAL, ANTI_SPIRAL])
+
+def test_interval_index_matches_brute_force_at_every_time():
+    bucket_size = 16
+    rng = np.random.default_rng(0)
+    start_times = rng.integers(0, 200, size=60)
+    end_times = start_times + rng.integers(0, 40, size=60)
+    # Ends on a bucket's last frame, crosses a bucket edge by one frame, fills one bucket exactly, spans many buckets
+    start_times[:4] = [0, 15, 16, 3]
+    end_times[:4] = [15, 16, 31, 190]
+    store = TrackStore(np.arange(60), np.zeros(60, dtype=np.int8), start_times, end_times,
+                       np.zeros(61, dtype=np.int64), np.empty((0, 2)), np.empty(0))
+    index = TrackIntervalIndex(store, bucket_size)
+    for t in range(-1, end_times.max() + bucket_size + 2):
+        expected = np.nonzero((start_times <= t) & (t <= end_times))[0]
+        np.testing.assert_array_equal(index.active_at(t), expected, err_msg=str(t))